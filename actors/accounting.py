@@ -0,0 +1,245 @@
+"""
+Usage accounting for Abaco: the number of actors, workers and executions created and the resources used by
+executions.
+
+Counters live in the abaco_metrics_store and are only ever updated with `$inc`, so the cost of recording usage
+does not grow with the amount of usage recorded. There are two kinds of counter documents:
+  - hourly buckets, one per tenant per hour:
+      {'_id': 'bucket_<tenant>_<YYYYMMDDHH>', 'type': 'bucket', 'tenant': .., 'hour': .., <counters>}
+  - per-actor totals, one per actor:
+      {'_id': 'actor_<actor dbid>', 'type': 'actor', 'tenant': .., 'actor_dbid': .., <counters>}
+
+Totals are computed with an aggregation over the bucket documents. The counters can be rebuilt from the
+executions_store, the actors_store and the legacy 'stats' document by running this module:
+
+    python3 accounting.py --writers-stopped [--drop-legacy]
+
+A rebuild overwrites the counters with what it counted, so usage recorded while it runs would be lost or counted
+twice; it must only be run while no API, spawner or worker process is running.
+
+"""
+import datetime
+import sys
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+from stores import abaco_metrics_store, actors_store, executions_store
+
+
+BUCKET = 'bucket'
+ACTOR = 'actor'
+
+# all counters kept in the bucket documents; the per-actor documents only keep the execution counters.
+COUNTERS = ('actors_total', 'workers_total', 'executions_total',
+            'execution_runtime', 'execution_cpu', 'execution_io')
+EXECUTION_COUNTERS = ('executions_total', 'execution_runtime', 'execution_cpu', 'execution_io')
+
+# hour used for usage that predates the counters and has no known time (see rebuild()).
+LEGACY_HOUR = datetime.datetime(1970, 1, 1)
+
+# tenant used for legacy usage that cannot be attributed to a tenant.
+UNKNOWN_TENANT = 'unknown'
+
+
+def get_hour(t=None):
+    """Return the start of the hour (UTC) containing the datetime `t`, or the current time if `t` is None."""
+    if not t:
+        t = datetime.datetime.utcnow()
+    return t.replace(minute=0, second=0, microsecond=0)
+
+def bucket_id(tenant, hour):
+    return 'bucket_{}_{}'.format(tenant, hour.strftime('%Y%m%d%H'))
+
+def actor_doc_id(actor_dbid):
+    return 'actor_{}'.format(actor_dbid)
+
+def _bucket_update(tenant, counts, t=None):
+    hour = get_hour(t)
+    return ({'_id': bucket_id(tenant, hour)},
+            {'$inc': counts,
+             '$setOnInsert': {'type': BUCKET, 'tenant': tenant, 'hour': hour}})
+
+def _actor_update(tenant, actor_dbid, counts):
+    return ({'_id': actor_doc_id(actor_dbid)},
+            {'$inc': counts,
+             '$setOnInsert': {'type': ACTOR, 'tenant': tenant, 'actor_dbid': actor_dbid}})
+
+def _record(tenant, counts, actor_dbid=None):
+    # the bucket and actor counters are incremented with a single round trip.
+    updates = [_bucket_update(tenant, counts)]
+    if actor_dbid:
+        updates.append(_actor_update(tenant, actor_dbid, counts))
+    # usage accounting should never fail the request it is accounting for.
+    try:
+        abaco_metrics_store.bulk_update(updates, upsert=True)
+    except Exception as e:
+        logger.error(f"Got exception recording usage {counts} for tenant: {tenant}; actor: {actor_dbid}; e: {e}")
+
+def record_actor_created(tenant):
+    _record(tenant, {'actors_total': 1})
+
+def record_workers_created(tenant, count=1):
+    _record(tenant, {'workers_total': count})
+
+def record_executions_created(tenant, actor_dbid, count=1):
+    _record(tenant, {'executions_total': count}, actor_dbid=actor_dbid)
+
+def record_execution_usage(tenant, actor_dbid, stats):
+    """Record the resources used by a finished execution; `stats` is the dictionary with io, cpu and runtime."""
+    _record(tenant,
+            {'execution_runtime': stats.get('runtime') or 0,
+             'execution_cpu': stats.get('cpu') or 0,
+             'execution_io': stats.get('io') or 0},
+            actor_dbid=actor_dbid)
+
+
+def get_totals(tenant=None, start=None, end=None):
+    """
+    Return a dictionary of the totals of all counters, optionally restricted to a tenant and to the hours
+    in [start, end).
+    """
+    match = {'type': BUCKET}
+    if tenant:
+        match['tenant'] = tenant
+    if start or end:
+        match['hour'] = {}
+        if start:
+            match['hour']['$gte'] = get_hour(start)
+        if end:
+            match['hour']['$lt'] = end
+    group = {'_id': None}
+    for c in COUNTERS:
+        group[c] = {'$sum': f'${c}'}
+    totals = {c: 0 for c in COUNTERS}
+    for doc in abaco_metrics_store.aggregate([{'$match': match}, {'$group': group}]):
+        for c in COUNTERS:
+            totals[c] = doc.get(c) or 0
+    return totals
+
+def get_actor_totals(tenant=None):
+    """Return a list of the per-actor execution counters, optionally restricted to a tenant."""
+    query = {'type': ACTOR}
+    if tenant:
+        query['tenant'] = tenant
+    return abaco_metrics_store.items(query)
+
+
+def _tenant_from_dbid(dbid, parts=1):
+    """
+    Best-effort tenant for a legacy dbid; actor dbids are '<tenant>_<actor_id>' and worker dbids are
+    '<tenant>_<actor_id>_<worker_id>'.
+    """
+    pieces = dbid.rsplit('_', parts)
+    if len(pieces) <= parts:
+        return UNKNOWN_TENANT
+    return pieces[0]
+
+def rebuild(drop_legacy=False, writers_stopped=False):
+    """
+    Rebuild all counter documents from the executions_store, the actors_store and the legacy 'stats' document.
+    Executions and existing actors are bucketed by their timestamps; usage that is only known from the legacy
+    totals is put in the LEGACY_HOUR bucket. If `drop_legacy` is True, the legacy dbid arrays are removed from
+    the 'stats' document.
+
+    The counters are not locked while they are rebuilt, so usage recorded meanwhile is lost or counted twice: the
+    caller must stop every process that records usage (the API, spawners and workers) first, and confirm it by
+    passing `writers_stopped=True`; otherwise, ValueError is raised. Readers see either the old or the rebuilt
+    counters of each document, as the rebuilt documents overwrite the old ones before the stale ones are deleted.
+    Returns the rebuilt totals.
+    """
+    if not writers_stopped:
+        raise ValueError("the usage counters can only be rebuilt while no process records usage; stop the API, "
+                         "spawners and workers and pass writers_stopped=True.")
+    buckets = {}
+    actors = {}
+
+    def add(tenant, t, counts, actor_dbid=None):
+        hour = get_hour(t) if t else LEGACY_HOUR
+        bucket = buckets.setdefault((tenant, hour), {c: 0 for c in COUNTERS})
+        for k, v in counts.items():
+            bucket[k] += v
+        if actor_dbid:
+            actor = actors.setdefault(actor_dbid, {'tenant': tenant, 'counts': {c: 0 for c in EXECUTION_COUNTERS}})
+            for k, v in counts.items():
+                actor['counts'][k] += v
+
+    try:
+        legacy = abaco_metrics_store['stats']
+    except KeyError:
+        legacy = {}
+
+    # executions --
+    num_executions = 0
+    for ex in executions_store._db.find({}, projection={'actor_id': True, 'tenant': True, 'runtime': True,
+                                                        'cpu': True, 'io': True, 'message_received_time': True}):
+        num_executions += 1
+        t = ex.get('message_received_time')
+        if not isinstance(t, datetime.datetime):
+            t = None
+        add(ex.get('tenant') or UNKNOWN_TENANT, t,
+            {'executions_total': 1,
+             'execution_runtime': ex.get('runtime') or 0,
+             'execution_cpu': ex.get('cpu') or 0,
+             'execution_io': ex.get('io') or 0},
+            actor_dbid=ex.get('actor_id'))
+    leftover = (legacy.get('executions_total') or 0) - num_executions
+    if leftover > 0:
+        add(UNKNOWN_TENANT, None, {'executions_total': leftover})
+
+    # actors --
+    existing = set()
+    for actor in actors_store.items(proj_inp={'db_id': True, 'tenant': True, 'create_time': True, '_id': False}):
+        existing.add(actor.get('db_id'))
+        t = actor.get('create_time')
+        if not isinstance(t, datetime.datetime):
+            t = None
+        add(actor.get('tenant') or UNKNOWN_TENANT, t, {'actors_total': 1})
+    num_actors = len(existing)
+    for dbid in legacy.get('actor_dbids') or []:
+        if dbid not in existing:
+            add(_tenant_from_dbid(dbid), None, {'actors_total': 1})
+            num_actors += 1
+    leftover = (legacy.get('actor_total') or 0) - num_actors
+    if leftover > 0:
+        add(UNKNOWN_TENANT, None, {'actors_total': leftover})
+
+    # workers are deleted when they shut down, so only the legacy stats know about them --
+    num_workers = 0
+    for dbid in legacy.get('worker_dbids') or []:
+        add(_tenant_from_dbid(dbid, parts=2), None, {'workers_total': 1})
+        num_workers += 1
+    leftover = (legacy.get('worker_total') or 0) - num_workers
+    if leftover > 0:
+        add(UNKNOWN_TENANT, None, {'workers_total': leftover})
+
+    # overwrite the existing counter documents, then delete the ones that were not rebuilt --
+    rebuilt = []
+    for (tenant, hour), counts in buckets.items():
+        doc = {'type': BUCKET, 'tenant': tenant, 'hour': hour}
+        doc.update(counts)
+        abaco_metrics_store[bucket_id(tenant, hour)] = doc
+        rebuilt.append(bucket_id(tenant, hour))
+    for actor_dbid, actor in actors.items():
+        doc = {'type': ACTOR, 'tenant': actor['tenant'], 'actor_dbid': actor_dbid}
+        doc.update(actor['counts'])
+        abaco_metrics_store[actor_doc_id(actor_dbid)] = doc
+        rebuilt.append(actor_doc_id(actor_dbid))
+    abaco_metrics_store.delete_many({'type': {'$in': [BUCKET, ACTOR]}, '_id': {'$nin': rebuilt}})
+    logger.info(f"rebuilt {len(buckets)} usage buckets and {len(actors)} actor usage documents.")
+
+    if drop_legacy and legacy:
+        abaco_metrics_store.full_update(
+            {'_id': 'stats'},
+            {'$unset': {'actor_dbids': '', 'worker_dbids': '', 'execution_dbids': ''}})
+        logger.info("removed the legacy dbid arrays from the stats document.")
+    return get_totals()
+
+
+if __name__ == "__main__":
+    if '--writers-stopped' not in sys.argv:
+        print("usage: python3 accounting.py --writers-stopped [--drop-legacy]\n"
+              "Rebuilds the usage counters. Usage recorded during the rebuild is lost or counted twice, so stop the "
+              "API, spawners and workers first and pass --writers-stopped to confirm.")
+        sys.exit(1)
+    print(rebuild(drop_legacy='--drop-legacy' in sys.argv, writers_stopped=True))
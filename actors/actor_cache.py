@@ -0,0 +1,165 @@
+"""
+Process-local read-through cache of actor documents.
+
+Hot paths read the same actor documents over and over: every message POST, every message a worker processes (for
+the revision check) and every event published. Each process (API, worker, spawner, events) keeps the most recently
+used actor documents, up to [store] actor_cache_size of them, in memory; see Actor.from_cache().
+
+The cache is kept coherent with a MongoDB change stream on the actors_store: a background thread drops the cached
+copy of every actor that is updated or deleted. Change streams require a replica set; when the stream cannot be
+opened, the thread instead polls the cached actors every [store] actor_cache_poll_interval seconds, with a single
+query. In any case, an actor document is never served from the cache if it was read more than
+[store] actor_cache_max_staleness seconds ago, and writes made by the process itself invalidate its copy right away.
+
+Hits, misses and invalidations are recorded in prometheus metrics.
+"""
+import collections
+import copy
+import threading
+import time
+
+from prometheus_client import Counter
+
+from config import Config
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+ACTOR_CACHE_HITS = Counter('actor_cache_hits', 'Number of actor documents read from the process-local cache.')
+ACTOR_CACHE_MISSES = Counter('actor_cache_misses', 'Number of actor documents read from the actors store.')
+ACTOR_CACHE_INVALIDATIONS = Counter('actor_cache_invalidations',
+                                    'Number of cached actor documents dropped or refreshed because they changed.',
+                                    ['source'])
+
+
+def _get_config(option, default, typ=int):
+    try:
+        return typ(Config.get('store', option))
+    except Exception:
+        return default
+
+
+class ActorCache(object):
+    """
+    Bounded LRU cache of the documents of a store, kept coherent with a change stream or by polling; see the module
+    docstring.
+    """
+
+    def __init__(self, store, maxsize=1000, max_staleness=30, poll_interval=5, change_stream=True):
+        self.store = store
+        self.maxsize = maxsize
+        self.max_staleness = max_staleness
+        self.poll_interval = poll_interval
+        self.change_stream = change_stream
+        # key -> (document, time it was read)
+        self._entries = collections.OrderedDict()
+        # incremented on every invalidation, so that a document read concurrently with a change is not cached.
+        self._version = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def get(self, key):
+        """Return a copy of the document `key`; raises KeyError if it does not exist."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[1] < self.max_staleness:
+                self._entries.move_to_end(key)
+                ACTOR_CACHE_HITS.inc()
+                return copy.deepcopy(entry[0])
+            version = self._version
+        ACTOR_CACHE_MISSES.inc()
+        self._start_watcher()
+        read_at = time.time()
+        doc = self.store[key]
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (doc, read_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return copy.deepcopy(doc)
+
+    def invalidate(self, key, source='local'):
+        with self._lock:
+            self._version += 1
+            if self._entries.pop(key, None) is not None:
+                ACTOR_CACHE_INVALIDATIONS.labels(source=source).inc()
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def _start_watcher(self):
+        if self._watcher is None:
+            with self._lock:
+                if self._watcher is None:
+                    self._watcher = threading.Thread(target=self._watch, daemon=True)
+                    self._watcher.start()
+
+    def _watch(self):
+        if self.change_stream:
+            try:
+                with self.store._db.watch() as stream:
+                    # documents read before the stream was opened could have missed changes.
+                    self.clear()
+                    logger.info("actor cache following the actors store change stream.")
+                    for change in stream:
+                        key = (change.get('documentKey') or {}).get('_id')
+                        if key is None:
+                            # e.g., the collection was dropped.
+                            self.clear()
+                        else:
+                            self.invalidate(key, source='change_stream')
+            except Exception as e:
+                logger.info(f"actor cache could not follow the change stream; polling every {self.poll_interval} "
+                            f"seconds instead. e: {e}")
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"actor cache got exception polling the actors store; e: {e}")
+
+    def poll(self):
+        """Read all cached documents with a single query, dropping the ones that changed."""
+        with self._lock:
+            keys = list(self._entries.keys())
+        if not keys:
+            return
+        read_at = time.time()
+        docs = {}
+        for doc in self.store.items({'_id': {'$in': keys}}, proj_inp=None):
+            docs[doc.pop('_id')] = doc
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if docs.get(key) == entry[0]:
+                    # unchanged; the cached copy is as fresh as this read.
+                    self._entries[key] = (entry[0], read_at)
+                else:
+                    self._version += 1
+                    del self._entries[key]
+                    ACTOR_CACHE_INVALIDATIONS.labels(source='poll').inc()
+
+
+_actor_cache = None
+_actor_cache_lock = threading.Lock()
+
+
+def get_actor_cache():
+    """The actor cache of this process, created on first use."""
+    global _actor_cache
+    if _actor_cache is None:
+        with _actor_cache_lock:
+            if _actor_cache is None:
+                from stores import actors_store
+                _actor_cache = ActorCache(actors_store,
+                                          maxsize=_get_config('actor_cache_size', 1000),
+                                          max_staleness=_get_config('actor_cache_max_staleness', 30, float),
+                                          poll_interval=_get_config('actor_cache_poll_interval', 5, float),
+                                          change_stream=_get_config('actor_cache_change_stream', 'true',
+                                                                    str).lower() == 'true')
+    return _actor_cache
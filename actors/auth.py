@@ -18,7 +18,8 @@ logger = get_logger(__name__)
 from agavepy.agave import Agave
 from config import Config
 import codes
-from models import Actor, Alias, ActorConfig, get_permissions, is_hashid, Nonce, get_config_permissions, permission_process
+from models import Actor, Alias, ActorConfig, get_user_permissions, is_hashid, Nonce, get_config_permissions, \
+    permission_process
 
 from errors import ClientException, ResourceError, PermissionsException
 
@@ -353,8 +354,8 @@ def check_permissions(user, identifier, level, roles=None):
     if roles:
         if codes.ADMIN_ROLE in roles:
             return True
-    # get all permissions for this actor -
-    permissions = get_permissions(identifier)
+    # get the permissions of the user and the world user for this actor; cached, see auth_cache.py -
+    permissions = get_user_permissions(identifier, user)
     if permission_process(permissions, user, level, identifier):
         return True
     # didn't find the user or world_user, return False
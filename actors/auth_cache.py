@@ -0,0 +1,136 @@
+"""
+Short-lived caches of the lookups made to authorize API requests.
+
+Every API request for an actor resolves the actor identifier in the URL, which is an alias_store read when it is an
+alias (see auth.get_db_id()), and then checks the permissions of the user on the actor or alias, which is a
+permissions_store read (see auth.check_permissions()). Each process keeps the results of both lookups in bounded
+caches, up to [web] auth_cache_size entries each, for at most [web] auth_cache_ttl seconds; a TTL of 0 disables them.
+Writes made by the process invalidate the affected entries right away (see models.set_permission(),
+models.Alias.check_and_create_alias() and the alias and actor controllers); other processes see them once their
+entries expire.
+
+Within a request, the results are also memoized on flask.g, so each document is read at most once per request, even
+when the caches are disabled.
+
+Hits and misses are recorded in prometheus metrics.
+"""
+import collections
+import threading
+import time
+
+from flask import g, has_request_context
+from prometheus_client import Counter
+
+from config import Config
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+AUTH_CACHE_HITS = Counter('auth_cache_hits', 'Number of authorization lookups served from a cache.', ['cache'])
+AUTH_CACHE_MISSES = Counter('auth_cache_misses', 'Number of authorization lookups read from the store.', ['cache'])
+
+
+def _get_config(option, default, typ=int):
+    try:
+        return typ(Config.get('web', option))
+    except Exception:
+        return default
+
+
+def _request_memo():
+    """The memo of the current request, or None outside of a request."""
+    if not has_request_context():
+        return None
+    memo = getattr(g, '_auth_cache_memo', None)
+    if memo is None:
+        memo = {}
+        g._auth_cache_memo = memo
+    return memo
+
+
+class TTLCache(object):
+    """
+    Bounded LRU cache whose entries expire `ttl` seconds after they were read, backed by the memo of the current
+    request; see the module docstring.
+    """
+
+    def __init__(self, name, maxsize=10000, ttl=5):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, expiration time)
+        self._entries = collections.OrderedDict()
+        # incremented on every invalidation, so that a value read concurrently with a change is not cached.
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Return the value of `key`, calling `load()` to read it on a miss. Exceptions raised by `load()` are not cached.
+        """
+        memo = _request_memo()
+        if memo is not None and (self.name, key) in memo:
+            return memo[self.name, key]
+        value = self._get(key, load)
+        if memo is not None:
+            memo[self.name, key] = value
+        return value
+
+    def _get(self, key, load):
+        if self.ttl <= 0:
+            return load()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() < entry[1]:
+                self._entries.move_to_end(key)
+                AUTH_CACHE_HITS.labels(cache=self.name).inc()
+                return entry[0]
+            version = self._version
+        AUTH_CACHE_MISSES.labels(cache=self.name).inc()
+        expires_at = time.time() + self.ttl
+        value = load()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, match):
+        """Drop the entries for which `match(key, value)` is true, from the cache and the memo of the request."""
+        with self._lock:
+            self._version += 1
+            for key in [key for key, (value, _) in self._entries.items() if match(key, value)]:
+                del self._entries[key]
+        memo = _request_memo()
+        if memo is not None:
+            for memo_key in [k for k, value in memo.items() if k[0] == self.name and match(k[1], value)]:
+                del memo[memo_key]
+
+    def clear(self):
+        self.invalidate(lambda key, value: True)
+
+
+_maxsize = _get_config('auth_cache_size', 10000)
+_ttl = _get_config('auth_cache_ttl', 5, float)
+
+# alias_id -> id of the actor the alias points to.
+alias_cache = TTLCache('alias', maxsize=_maxsize, ttl=_ttl)
+
+# (identifier, user) -> the permissions of the user and of the world user on the actor or alias `identifier`.
+permissions_cache = TTLCache('permissions', maxsize=_maxsize, ttl=_ttl)
+
+
+def invalidate_alias(alias_id):
+    alias_cache.invalidate(lambda key, value: key == alias_id)
+
+
+def invalidate_actor_aliases(actor_id):
+    """Drop the aliases that point to the actor `actor_id`; e.g., when the actor is deleted."""
+    alias_cache.invalidate(lambda key, value: value == actor_id)
+
+
+def invalidate_permissions(identifier):
+    """Drop the permissions of all users on the actor or alias `identifier`."""
+    permissions_cache.invalidate(lambda key, value: key[0] == identifier)
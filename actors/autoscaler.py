@@ -0,0 +1,130 @@
+"""
+Autoscaler agent.
+
+Scales actor workers in response to "message enqueued" signals instead of waiting for the metrics endpoint to be
+scraped. MessagesResource.post, the cron endpoint and the events agent put a signal on the autoscaler channel
+(see channels.signal_enqueued) whenever they put messages on an actor's inbox. The agent debounces the signals per
+actor and then runs the metrics_utils.Autoscaler for just the signaled actors, scaling up only. Scaling down is
+done by a full autoscaler pass every `autoscaler_interval` seconds.
+
+The agent is only used when the [workers] autoscaling_mode config is 'events'; in that case the metrics endpoint
+only updates the Prometheus gauges.
+"""
+import threading
+import time
+
+import rabbitpy
+
+from channels import AutoscalerChannel
+from config import Config
+import metrics_utils
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+
+def _get_float_config(option, default):
+    try:
+        return float(Config.get('workers', option))
+    except Exception:
+        return default
+
+
+class Debouncer(object):
+    """
+    Collects actor ids and releases each one `window` seconds after the first signal for it, so that a burst of
+    messages for an actor results in a single scaling decision.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        # actor id -> time at which the actor is due
+        self._pending = {}
+
+    def add(self, actor_id):
+        with self._lock:
+            self._pending.setdefault(actor_id, time.time() + self.window)
+
+    def due(self, now=None):
+        """Remove and return the actor ids that are due."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            ready = [actor_id for actor_id, t in self._pending.items() if t <= now]
+            for actor_id in ready:
+                self._pending.pop(actor_id)
+        return ready
+
+
+class AutoscalerAgent(object):
+
+    def __init__(self, debounce=None, interval=None):
+        # seconds to wait after the first signal for an actor before scaling it.
+        self.debounce = debounce if debounce is not None else _get_float_config('autoscaler_debounce', 0.5)
+        # seconds between the full passes that also scale down.
+        self.interval = interval if interval is not None else _get_float_config('autoscaler_interval', 30)
+        self.debouncer = Debouncer(self.debounce)
+        self.autoscaler = metrics_utils.Autoscaler()
+        self._stop = threading.Event()
+
+    def scale(self):
+        """Loop that runs the autoscaler for the debounced actors and the periodic full passes."""
+        last_full_run = 0
+        while not self._stop.is_set():
+            try:
+                actor_ids = self.debouncer.due()
+                if actor_ids:
+                    logger.debug(f"autoscaler agent scaling up actors: {actor_ids}")
+                    # the signals are newer than any cached inbox length, so always fetch them.
+                    self.autoscaler.run(actor_ids=actor_ids, scale_down=False, max_age=0)
+                if time.time() - last_full_run > self.interval:
+                    logger.debug("autoscaler agent starting a full pass.")
+                    self.autoscaler.run()
+                    last_full_run = time.time()
+            except Exception as e:
+                logger.error(f"autoscaler agent got exception running the autoscaler; e: {e}")
+            self._stop.wait(max(self.debounce / 2, 0.05))
+
+    def consume(self, ch):
+        """Loop that reads the "message enqueued" signals off the autoscaler channel."""
+        while not self._stop.is_set():
+            msg, msg_obj = ch.get_one()
+            try:
+                self.debouncer.add(msg['actor_id'])
+            except Exception as e:
+                logger.error(f"autoscaler agent got an invalid signal; e: {e}; msg: {msg}")
+            # signals are only hints, so they are acked even when they could not be processed.
+            msg_obj.ack()
+
+    def run(self, ch):
+        t = threading.Thread(target=self.scale, daemon=True)
+        t.start()
+        try:
+            self.consume(ch)
+        finally:
+            self._stop.set()
+
+
+def main():
+    """
+    Entrypoint for the autoscaler agent.
+    :return:
+    """
+    idx = 0
+    while idx < 3:
+        try:
+            ch = AutoscalerChannel()
+            logger.info("autoscaler agent made connection to rabbit, entering main loop")
+            AutoscalerAgent().run(ch)
+        except (rabbitpy.exceptions.ConnectionException, RuntimeError):
+            # rabbit seems to take a few seconds to come up
+            time.sleep(5)
+            idx += 1
+    logger.critical("autoscaler agent could not connect to rabbitMQ. Shutting down!")
+
+
+if __name__ == '__main__':
+    # This is the entry point for the autoscaler agent container.
+    logger.info("Inital log for autoscaler agent.")
+    main()
@@ -0,0 +1,173 @@
+"""
+Micro-batch delivery of messages to actor containers.
+
+For actors registered with a batch_size greater than 1, a worker that got a message waits up to batch_wait
+milliseconds for up to batch_size - 1 more (see ActorMsgChannel.get_more()) and runs a single actor container for
+all of them. Each message keeps its own execution: it is acked or nacked with the rest of its batch, and gets its own
+status, results and stats in the executions store.
+
+The container gets the batch as an NDJSON file, mounted read-only at /_abaco_batch.ndjson (the _abaco_batch
+environment variable), with one line per message:
+    {"execution_id": ..., "message": ..., "environment": {...}}
+where `environment` holds the variables a container running only that message would get from it (query parameters,
+_abaco_execution_id, _abaco_username, ...). Binary messages are passed base64 encoded, as "message_b64". The container
+reports the outcome of each message by appending a line to /_abaco_batch_results.ndjson (_abaco_batch_results):
+    {"execution_id": ..., "exit_code": 0, "results": [<base64>, ...]}
+The results are put on the results channel of the message's execution. A message without a line gets the exit code
+of the container.
+
+The first execution of the batch (the leader) runs the container: the logs of the container are shipped as its logs
+and the other executions of the batch link to them (see log_shipping.link_logs()), and results sent over the results
+socket go to it. The cpu, io and runtime of the container are split evenly between the executions of the batch, while
+memory_peak is the peak of the container.
+"""
+import base64
+import json
+import os
+
+from channels import ExecutionResultsChannel
+from codes import RUNNING
+import log_shipping
+from models import Actor, Execution
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+# where the batch and batch results files are mounted in the actor container.
+BATCH_CONTAINER_PATH = '/_abaco_batch.ndjson'
+BATCH_RESULTS_CONTAINER_PATH = '/_abaco_batch_results.ndjson'
+
+
+class MessageBatch(object):
+    """
+    The message objects of a batch; acks or nacks all of them, so the worker handles a batch like a single message.
+    """
+
+    def __init__(self, msg_objs):
+        self.msg_objs = msg_objs
+
+    def ack(self):
+        for msg_obj in self.msg_objs:
+            msg_obj.ack()
+
+    def nack(self, requeue=True):
+        for msg_obj in self.msg_objs:
+            msg_obj.nack(requeue=requeue)
+
+
+class Batch(object):
+    """
+    A batch of messages run by a single actor container.
+     `messages` is a list of (message, msg) tuples, where `msg` is the dictionary of fields of the message, as put on
+     the actor's inbox, with the 'message' entry already popped; the first message is the leader.
+     `directory` is where the batch files are created; it must be mounted at the same path in the worker container.
+    """
+
+    def __init__(self, actor_id, worker_id, tenant, messages, directory):
+        self.actor_id = actor_id
+        self.worker_id = worker_id
+        self.tenant = tenant
+        self.messages = messages
+        self.leader_id = messages[0][1]['_abaco_execution_id']
+        self.input_path = os.path.join(directory, '{}_batch.ndjson'.format(self.leader_id))
+        self.results_path = os.path.join(directory, '{}_batch_results.ndjson'.format(self.leader_id))
+
+    @property
+    def executions(self):
+        """List of (execution_id, synchronous) tuples for the executions of the batch."""
+        return [(msg['_abaco_execution_id'], str(msg.get('_abaco_synchronous', '')).lower() == 'true')
+                for _, msg in self.messages]
+
+    def write(self):
+        """Write the batch file and create the empty results file."""
+        with open(self.input_path, 'w') as f:
+            for message, msg in self.messages:
+                f.write(json.dumps(self.line(message, msg)) + '\n')
+        open(self.results_path, 'w').close()
+        # the actor container runs as the actor's uid and gid.
+        os.chmod(self.input_path, 0o644)
+        os.chmod(self.results_path, 0o666)
+
+    @staticmethod
+    def line(message, msg):
+        line = {'execution_id': msg['_abaco_execution_id'],
+                'environment': {k: str(v) for k, v in msg.items()}}
+        if isinstance(message, bytes):
+            line['message_b64'] = base64.b64encode(message).decode('ascii')
+        else:
+            line['message'] = message
+        return line
+
+    def mounts(self):
+        return [{'host_path': self.input_path, 'container_path': BATCH_CONTAINER_PATH, 'format': 'ro'},
+                {'host_path': self.results_path, 'container_path': BATCH_RESULTS_CONTAINER_PATH, 'format': 'rw'}]
+
+    def environment(self):
+        return {'_abaco_batch': BATCH_CONTAINER_PATH,
+                '_abaco_batch_results': BATCH_RESULTS_CONTAINER_PATH,
+                '_abaco_batch_size': str(len(self.messages))}
+
+    def start(self):
+        """
+        Write the batch files and mark the executions other than the leader's, which execute_actor() starts, as
+        running in this batch.
+        """
+        self.write()
+        log_ex = Actor.get_actor_log_ttl(self.actor_id)
+        for execution_id, _ in self.executions[1:]:
+            Execution.add_to_batch(self.actor_id, execution_id, self.worker_id, self.leader_id, RUNNING)
+            log_shipping.link_logs(execution_id, self.leader_id, self.actor_id, self.tenant, log_ex)
+
+    def read_results(self):
+        """Return a dictionary mapping execution ids to the results lines the container wrote for them."""
+        results = {}
+        try:
+            with open(self.results_path, 'r') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        result = json.loads(line)
+                        results[result['execution_id']] = result
+                    except Exception as e:
+                        logger.info(f"ignoring invalid batch results line: {line[:200]}; e: {e}; "
+                                    f"batch: {self.leader_id}")
+        except OSError as e:
+            logger.error(f"could not read batch results file {self.results_path}; e: {e}")
+        return results
+
+    def finish(self, stats, exit_code):
+        """
+        Put the results the container reported for each message on its results channel and split the stats of the
+        container between the executions. Returns a list of (execution_id, synchronous, stats, exit_code) tuples.
+        """
+        results = self.read_results()
+        count = len(self.messages)
+        ex_stats = {'cpu': stats.get('cpu', 0) // count,
+                    'io': stats.get('io', 0) // count,
+                    'runtime': stats.get('runtime', 0) / count}
+        if stats.get('memory_peak') is not None:
+            ex_stats['memory_peak'] = stats['memory_peak']
+        outcomes = []
+        for execution_id, synchronous in self.executions:
+            result = results.get(execution_id, {})
+            data = result.get('results') or []
+            if data:
+                results_ch = ExecutionResultsChannel(self.actor_id, execution_id)
+                try:
+                    for item in data:
+                        results_ch.put(base64.b64decode(item))
+                except Exception as e:
+                    logger.error(f"could not put the results of execution {execution_id} in batch "
+                                 f"{self.leader_id}; e: {e}")
+                finally:
+                    results_ch.close()
+            outcomes.append((execution_id, synchronous, dict(ex_stats), result.get('exit_code', exit_code)))
+        return outcomes
+
+    def cleanup(self):
+        for path in (self.input_path, self.results_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -1,4 +1,5 @@
 import time
+import uuid
 
 from channelpy import BasicChannel, Channel, RabbitConnection
 from channelpy.chan import checking_events
@@ -7,6 +8,8 @@ import cloudpickle
 import rabbitpy
 
 from config import Config
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
 
 # class WorkerChannel(Channel):
 #     """Channel for communication with a worker. Pass the id of the worker to communicate with an
@@ -152,7 +155,7 @@ class BinaryChannel(BasicChannel):
             return self._process(msg.body), msg
 
 
-from queues import BinaryTaskQueue
+from queues import BinaryTaskQueue, get_pool, get_queue_depths, invalidate_queue_depth
 
 
 class EventsChannel(BinaryTaskQueue):
@@ -193,7 +196,9 @@ class CommandChannel(BinaryTaskQueue):
                'image': image,
                'revision': revision,
                'tenant': tenant,
-               'stop_existing': stop_existing}
+               'stop_existing': stop_existing,
+               # used by the spawner to report how long commands wait on the channel
+               'time_queued': time.time()}
 
         self.put(msg)
 
@@ -228,8 +233,13 @@ class WorkerChannel(BinaryTaskQueue):
 
 
 class ActorMsgChannel(BinaryTaskQueue):
+    @classmethod
+    def get_name(cls, actor_id):
+        """Return the name of the channel that would be used for this actor_id."""
+        return 'actor_msg_{}'.format(actor_id)
+
     def __init__(self, actor_id):
-        super().__init__(name='actor_msg_{}'.format(actor_id))
+        super().__init__(name=ActorMsgChannel.get_name(actor_id))
 
     def put_msg(self, message, d={}, **kwargs):
         d['message'] = message
@@ -237,6 +247,95 @@ class ActorMsgChannel(BinaryTaskQueue):
             d[k] = v
         self.put(d)
 
+    def put_msgs(self, messages, d={}):
+        """
+        Put a batch of messages on the actor's inbox in one transaction. Each item of `messages` is a
+        (message, fields) tuple; the fields are merged over the common fields in `d`.
+        """
+        batch = []
+        for message, fields in messages:
+            m = dict(d)
+            m.update(fields)
+            m['message'] = message
+            batch.append(m)
+        self.put_many(batch)
+
+    def get_more(self, count, wait, poll_interval=0.01):
+        """
+        Get up to `count` more messages, waiting at most `wait` seconds for them to arrive; returns a list of
+        (message, msg) tuples like get_one(). Used by the workers of actors with batching to fill a batch after
+        get_one() returned its first message; see batching.py.
+        """
+        messages = []
+        deadline = time.time() + wait
+        while len(messages) < count:
+            m = self.get_nowait()
+            if m:
+                messages.append(m)
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(poll_interval, remaining))
+        return messages
+
+
+class AutoscalerChannel(BinaryTaskQueue):
+    """Channel carrying "message enqueued" signals from the APIs and agents to the autoscaler agent."""
+
+    def __init__(self, name='autoscaler'):
+        super().__init__(name=name)
+
+    def put_enqueued(self, actor_id, count=1):
+        """Signal that `count` messages were put on the inbox of the actor with dbid `actor_id`."""
+        self.put({'actor_id': actor_id,
+                  'count': count,
+                  'time': time.time()})
+
+
+def event_driven_autoscaling():
+    """Whether scaling is driven by the autoscaler agent (autoscaler.py) instead of the metrics endpoint."""
+    try:
+        return Config.get('workers', 'autoscaling_mode').lower() == 'events'
+    except Exception:
+        return False
+
+
+def signal_enqueued(actor_id, count=1):
+    """
+    Notify the autoscaler agent that messages were put on an actor's inbox. This is a no-op unless the
+    autoscaling_mode is 'events', and it never raises since the messages have already been queued.
+    """
+    if not event_driven_autoscaling():
+        return
+    try:
+        ch = AutoscalerChannel()
+        try:
+            ch.put_enqueued(actor_id, count)
+        finally:
+            ch.close()
+    except Exception as e:
+        logger.error(f"Got exception signaling the autoscaler for actor {actor_id}; e: {e}")
+
+
+def get_inbox_lengths(actor_ids, max_age=None):
+    """
+    Return a dictionary mapping each actor dbid in `actor_ids` to the number of messages in its inbox. Lengths
+    are fetched in bulk and cached for a short time; see queues.QueueDepths.
+    """
+    names = {ActorMsgChannel.get_name(actor_id): actor_id for actor_id in actor_ids}
+    depths = get_queue_depths(list(names.keys()), max_age=max_age)
+    return {names[name]: depth for name, depth in depths.items()}
+
+
+def get_inbox_length(actor_id, max_age=None):
+    """Return the number of messages in the inbox of the actor with dbid `actor_id`."""
+    return get_inbox_lengths([actor_id], max_age=max_age)[actor_id]
+
+
+def invalidate_inbox_length(actor_id):
+    invalidate_queue_depth(ActorMsgChannel.get_name(actor_id))
+
 
 class FiniteRabbitConnection(RabbitConnection):
     """Override the channelpy.connections.RabbitConnection to provide TTL functionality,"""
@@ -272,3 +371,152 @@ class ExecutionJSONResultsChannel(Channel):
                          connection_type=FiniteRabbitConnection,
                          uri=self.uri)
 
+
+# direct exchange on which workers publish the completion notifications of synchronous executions, with the routing
+# key '<actor dbid>_<execution id>'.
+COMPLETION_EXCHANGE = 'abaco_execution_completions'
+
+
+def _declare_completion_exchange(pool, conn):
+    if not pool.is_declared(COMPLETION_EXCHANGE):
+        rabbitpy.DirectExchange(conn._ch, COMPLETION_EXCHANGE, durable=True).declare()
+        pool.mark_declared(COMPLETION_EXCHANGE)
+
+
+class ExecutionCompletionChannel(object):
+    """
+    Receive the completion notification of a single execution. The channel binds an exclusive queue to the
+    completion exchange when it is created, so it should be created before the execution's message is queued;
+    wait() then blocks on a single consumer until a notification arrives (see publish_completion()).
+    """
+
+    def __init__(self, actor_id, execution_id):
+        self._pool = get_pool()
+        self.conn = self._pool.checkout()
+        try:
+            _declare_completion_exchange(self._pool, self.conn)
+            key = '{}_{}'.format(actor_id, execution_id)
+            self.queue = rabbitpy.Queue(self.conn._ch,
+                                        name='completion_{}_{}'.format(key, uuid.uuid4().hex[:8]),
+                                        exclusive=True,
+                                        auto_delete=True)
+            self.queue.declare()
+            self.queue.bind(COMPLETION_EXCHANGE, routing_key=key)
+        except Exception:
+            self._pool.release(self.conn, reusable=False)
+            self.conn = None
+            raise
+
+    def wait(self):
+        """Block until a notification arrives and return it; a dictionary with at least an 'event' key."""
+        if self.conn is None:
+            raise ChannelClosedException()
+        for msg in self.queue.consume(no_ack=True):
+            return cloudpickle.loads(msg.body)
+
+    def close(self):
+        conn = self.conn
+        if conn is None:
+            return
+        self.conn = None
+        # the connection consumed messages, so it is not returned to the pool; closing it deletes the queue.
+        self._pool.release(conn, reusable=False)
+
+
+def publish_completion(actor_id, execution_id, event, **fields):
+    """
+    Notify the ExecutionCompletionChannel waiting on an execution, if there is one. `event` is 'result' when the
+    execution produced a result, or the final status of the execution. Never raises.
+    """
+    try:
+        pool = get_pool()
+        conn = pool.checkout()
+        reusable = True
+        try:
+            _declare_completion_exchange(pool, conn)
+            body = dict(fields, event=event, time=time.time())
+            rabbitpy.Message(conn._ch, cloudpickle.dumps(body), {}).publish(
+                COMPLETION_EXCHANGE, routing_key='{}_{}'.format(actor_id, execution_id))
+        except Exception:
+            reusable = False
+            raise
+        finally:
+            pool.release(conn, reusable=reusable)
+    except Exception as e:
+        logger.error(f"Got exception publishing the completion of execution {execution_id}; e: {e}")
+
+
+def get_revision_exchange(actor_id):
+    """Name of the fanout exchange on which the revision changes of an actor are published to its workers."""
+    return 'actor_revisions_{}'.format(actor_id)
+
+
+def _declare_revision_exchange(conn, actor_id):
+    # the exchange is deleted by RabbitMQ when the last of the actor's workers unbinds from it, so it is declared
+    # before every publish and every bind rather than once per connection.
+    rabbitpy.FanoutExchange(conn._ch, get_revision_exchange(actor_id), durable=False, auto_delete=True).declare()
+
+
+class ActorRevisionChannel(object):
+    """
+    Receive the revision changes of an actor (see publish_revision()). Every channel binds its own exclusive queue to
+    the actor's fanout exchange, so each of the actor's workers gets every change.
+    """
+
+    def __init__(self, actor_id):
+        self._pool = get_pool()
+        self.conn = self._pool.checkout()
+        try:
+            _declare_revision_exchange(self.conn, actor_id)
+            self.queue = rabbitpy.Queue(self.conn._ch,
+                                        name='revisions_{}_{}'.format(actor_id, uuid.uuid4().hex[:8]),
+                                        exclusive=True,
+                                        auto_delete=True)
+            self.queue.declare()
+            self.queue.bind(get_revision_exchange(actor_id))
+        except Exception:
+            self._pool.release(self.conn, reusable=False)
+            self.conn = None
+            raise
+
+    def get(self):
+        """Block until a change arrives and return it; a dictionary with 'revision' and 'keep' keys."""
+        if self.conn is None:
+            raise ChannelClosedException()
+        for msg in self.queue.consume(no_ack=True):
+            return cloudpickle.loads(msg.body)
+        raise ChannelClosedException()
+
+    def close(self):
+        conn = self.conn
+        if conn is None:
+            return
+        self.conn = None
+        # the connection consumed messages, so it is not returned to the pool; closing it deletes the queue.
+        self._pool.release(conn, reusable=False)
+
+
+def publish_revision(actor_id, revision, keep=None):
+    """
+    Notify the workers of an actor that the actor changed. Workers drop their cached copy of the actor, and workers
+    of a revision other than `revision` drain: they finish their running executions and exit. With a `revision` of
+    None, all workers drain. Workers whose id is in `keep` never drain. Returns whether the change was published;
+    never raises.
+    """
+    try:
+        pool = get_pool()
+        conn = pool.checkout()
+        reusable = True
+        try:
+            _declare_revision_exchange(conn, actor_id)
+            body = {'revision': revision, 'keep': list(keep or []), 'time': time.time()}
+            rabbitpy.Message(conn._ch, cloudpickle.dumps(body), {}).publish(get_revision_exchange(actor_id))
+        except Exception:
+            reusable = False
+            raise
+        finally:
+            pool.release(conn, reusable=reusable)
+        return True
+    except Exception as e:
+        logger.error(f"Got exception publishing revision {revision} of actor {actor_id}; e: {e}")
+        return False
@@ -0,0 +1,233 @@
+"""
+Resource accounting backends for actor containers.
+
+execute_actor() starts a sampler for each actor container with `get_stats_backend().start(cid)`, calls `sample()` on
+every pass of its supervision loop and `finish()` as soon as the container has exited, before it is removed. finish()
+returns a dictionary with:
+  - cpu: CPU time used by the container, in nanoseconds;
+  - io: bytes of I/O done by the container;
+  - memory_peak: peak memory usage of the container, in bytes, or None when it is not known.
+
+Two backends are available:
+  - CgroupStats reads the cgroup (v1 or v2) files of the container directly. This is cheap and exact, and is used
+    when the host's cgroup hierarchy is mounted into the worker (see the [workers] cgroup_host_path config).
+  - DockerStats reads the docker stats stream; io is the bytes received on eth0 and memory_peak is the largest
+    memory usage sampled.
+
+The cgroup directory of a container is removed when the container exits, so samplers keep the last values read
+while the container was running.
+"""
+import os
+
+from config import Config
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+# where the host's cgroup hierarchy is mounted in worker containers.
+CGROUP_CONTAINER_PATH = '/abaco_cgroup'
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def _read_lines(path):
+    try:
+        with open(path) as f:
+            return f.read().splitlines()
+    except OSError:
+        return None
+
+
+class CgroupStats(object):
+    """Reads container usage from the cgroup hierarchy mounted at `root`."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def version(self):
+        return 2 if os.path.exists(os.path.join(self.root, 'cgroup.controllers')) else 1
+
+    @staticmethod
+    def _container_paths(cid):
+        # the cgroupfs and systemd cgroup drivers place containers in different places.
+        return [os.path.join('docker', cid), os.path.join('system.slice', 'docker-{}.scope'.format(cid))]
+
+    def _find(self, controllers, cid):
+        """Return the first existing cgroup directory of the container under any of the `controllers` roots."""
+        for controller in controllers:
+            for p in self._container_paths(cid):
+                path = os.path.join(self.root, controller, p)
+                if os.path.isdir(path):
+                    return path
+        return None
+
+    def read(self, cid):
+        """Return the current cumulative usage of the container, or None if its cgroup was not found."""
+        if self.version() == 2:
+            return self._read_v2(cid)
+        return self._read_v1(cid)
+
+    def _read_v2(self, cid):
+        path = self._find([''], cid)
+        if not path:
+            return None
+        cpu = 0
+        for line in _read_lines(os.path.join(path, 'cpu.stat')) or []:
+            k, _, v = line.partition(' ')
+            if k == 'usage_usec':
+                cpu = int(v) * 1000
+        io = 0
+        for line in _read_lines(os.path.join(path, 'io.stat')) or []:
+            # lines look like: 8:0 rbytes=1 wbytes=2 rios=3 wios=4 dbytes=0 dios=0
+            for field in line.split()[1:]:
+                k, _, v = field.partition('=')
+                if k in ('rbytes', 'wbytes'):
+                    io += int(v)
+        memory_peak = _read_int(os.path.join(path, 'memory.peak'))
+        if memory_peak is None:
+            # memory.peak is only available on newer kernels.
+            memory_peak = _read_int(os.path.join(path, 'memory.current'))
+        return {'cpu': cpu, 'io': io, 'memory_peak': memory_peak}
+
+    def _read_v1(self, cid):
+        cpu_path = self._find(['cpuacct', 'cpu,cpuacct', 'cpuacct,cpu'], cid)
+        if not cpu_path:
+            return None
+        cpu = _read_int(os.path.join(cpu_path, 'cpuacct.usage')) or 0
+        io = 0
+        blkio_path = self._find(['blkio'], cid)
+        if blkio_path:
+            # lines look like: 8:0 Read 4096; the last line is: Total 8192
+            for line in _read_lines(os.path.join(blkio_path, 'blkio.throttle.io_service_bytes')) or []:
+                parts = line.split()
+                if len(parts) == 3 and parts[1] in ('Read', 'Write'):
+                    io += int(parts[2])
+        memory_peak = None
+        memory_path = self._find(['memory'], cid)
+        if memory_path:
+            memory_peak = _read_int(os.path.join(memory_path, 'memory.max_usage_in_bytes'))
+        return {'cpu': cpu, 'io': io, 'memory_peak': memory_peak}
+
+    def start(self, cid):
+        return CgroupSampler(self, cid)
+
+
+class CgroupSampler(object):
+
+    def __init__(self, backend, cid):
+        self.backend = backend
+        self.cid = cid
+        # the counters of the container's cgroup start at zero when the container is created, so the last values
+        # read are the container's usage.
+        self.last = None
+        self.sample()
+
+    def sample(self):
+        usage = self.backend.read(self.cid)
+        if usage:
+            # keep the largest memory usage seen, in case only the current usage is available.
+            if self.last and (self.last['memory_peak'] or 0) > (usage['memory_peak'] or 0):
+                usage['memory_peak'] = self.last['memory_peak']
+            self.last = usage
+
+    def finish(self):
+        self.sample()
+        if not self.last:
+            logger.info(f"no cgroup usage found for container {self.cid}.")
+            return {'cpu': 0, 'io': 0, 'memory_peak': None}
+        return dict(self.last)
+
+
+class DockerStats(object):
+    """Reads container usage from the docker stats stream of the daemon at `base_url`."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def start(self, cid):
+        return DockerStatsSampler(self.base_url, cid)
+
+
+class DockerStatsSampler(object):
+
+    def __init__(self, base_url, cid):
+        import docker
+        from requests.exceptions import ReadTimeout
+        self.cid = cid
+        self.cpu = 0
+        self.io = 0
+        self.memory_peak = None
+        self.stream = None
+        # create a separate cli for checking stats objects since these should be fast and we don't want to wait
+        stats_cli = docker.APIClient(base_url=base_url, timeout=1, version="auto")
+        # under load, we can see UnixHTTPConnectionPool ReadTimeout's trying to create the stats_obj
+        # so here we are trying up to 3 times to create the stats object for a possible total of 3s
+        # timeouts
+        ct = 0
+        while ct < 3:
+            try:
+                self.stream = stats_cli.stats(container=cid, decode=True)
+                break
+            except ReadTimeout:
+                ct += 1
+            except Exception as e:
+                logger.error(f"Unexpected exception creating the docker stats stream for container {cid}. "
+                             f"Exception: {e}")
+                break
+
+    def sample(self):
+        if not self.stream:
+            return
+        try:
+            stats = next(self.stream)
+        except StopIteration:
+            # we have read the last stats object
+            self.stream = None
+            return
+        except Exception as e:
+            # under load, a timeout reading a stats object does NOT imply the container has stopped.
+            logger.info(f"Got exception reading docker stats for container {self.cid}; e: {e}")
+            return
+        # these counters are cumulative, so only the latest values are kept.
+        try:
+            self.cpu = max(self.cpu, stats['cpu_stats']['cpu_usage']['total_usage'])
+        except (KeyError, TypeError):
+            pass
+        try:
+            self.io = max(self.io, stats['networks']['eth0']['rx_bytes'])
+        except (KeyError, TypeError):
+            pass
+        try:
+            usage = stats['memory_stats']['usage']
+            self.memory_peak = max(self.memory_peak or 0, usage)
+        except (KeyError, TypeError):
+            pass
+
+    def finish(self):
+        return {'cpu': self.cpu, 'io': self.io, 'memory_peak': self.memory_peak}
+
+
+def usage_delta(before, after):
+    """
+    Return the usage of a container between two values returned by the finish() method of its sampler; hot containers
+    (see hot_containers.py) run many executions. memory_peak cannot be split, so it is the container's peak so far.
+    """
+    return {'cpu': max(after['cpu'] - before['cpu'], 0),
+            'io': max(after['io'] - before['io'], 0),
+            'memory_peak': after['memory_peak']}
+
+
+def get_stats_backend(base_url):
+    """Return the CgroupStats backend when the host's cgroup hierarchy is mounted, or else DockerStats."""
+    try:
+        cgroup_host_path = Config.get('workers', 'cgroup_host_path')
+    except Exception:
+        cgroup_host_path = None
+    if cgroup_host_path and os.path.isdir(CGROUP_CONTAINER_PATH):
+        return CgroupStats(CGROUP_CONTAINER_PATH)
+    return DockerStats(base_url)
@@ -9,26 +9,30 @@ import timeit
 import base64
 import re
 
-from channelpy.exceptions import ChannelClosedException, ChannelTimeoutException
-from flask import g, request, render_template, make_response, Response
+from flask import g, request, render_template, make_response, Response, stream_with_context
+from flask import json as flask_json
 from flask_restful import Resource, Api, inputs
 from werkzeug.exceptions import BadRequest
 from agaveflask.utils import RequestParser, ok
 from parse import parse
 
+from auth_cache import invalidate_actor_aliases, invalidate_alias, invalidate_permissions
 from auth import check_permissions, check_config_permissions, get_tas_data, tenant_can_use_tas, get_uid_gid_homedir, get_token_default
-from channels import ActorMsgChannel, CommandChannel, ExecutionResultsChannel, WorkerChannel
-from codes import SUBMITTED, COMPLETE, SHUTTING_DOWN, PERMISSION_LEVELS, ALIAS_NONCE_PERMISSION_LEVELS, READ, UPDATE, EXECUTE, PERMISSION_LEVELS, PermissionLevel
+from channels import ActorMsgChannel, CommandChannel, ExecutionCompletionChannel, ExecutionResultsChannel, \
+    WorkerChannel, get_inbox_length, get_inbox_lengths, invalidate_inbox_length, event_driven_autoscaling, \
+    publish_completion, publish_revision, signal_enqueued
+from codes import SUBMITTED, COMPLETE, ERROR, SHUTTING_DOWN, PERMISSION_LEVELS, ALIAS_NONCE_PERMISSION_LEVELS, READ, UPDATE, EXECUTE, PERMISSION_LEVELS, PermissionLevel
 from config import Config
-from errors import DAOError, ResourceError, PermissionsException, WorkerException
+from errors import DAOError, ResourceError, PermissionsException, WorkerException, TAG
 from models import dict_to_camel, display_time, is_hashid, Actor, ActorConfig, Alias, Execution, ExecutionsSummary, Nonce, Worker, Search, get_permissions, \
     get_config_permissions, set_permission, get_current_utc_time, set_config_permission
 
 from mounts import get_all_mounts
 import codes
 from stores import actors_store, alias_store, configs_store, configs_permissions_store, workers_store, \
-    executions_store, logs_store, nonce_store, permissions_store, abaco_metrics_store
+    executions_store, nonce_store, permissions_store
 from worker import shutdown_workers, shutdown_worker
+import accounting
 import metrics_utils
 import encrypt_utils
 
@@ -55,6 +59,16 @@ try:
 except:
     num_init_workers = 1
 
+try:
+    ACTOR_MAX_CONCURRENCY = int(Config.get('workers', 'max_concurrency'))
+except:
+    ACTOR_MAX_CONCURRENCY = 10
+
+try:
+    ACTOR_MAX_BATCH_SIZE = int(Config.get('workers', 'max_batch_size'))
+except:
+    ACTOR_MAX_BATCH_SIZE = 100
+
 
 class SearchResource(Resource):
     def get(self, search_type):
@@ -100,6 +114,7 @@ class CronResource(Resource):
                         ch = ActorMsgChannel(actor_id=actor_id)
                         ch.put_msg(message="This is your cron execution", d=d)
                         ch.close()
+                        signal_enqueued(actor_id)
                         logger.debug("Message added to actor inbox. id: {}.".format(actor_id))
                         # Update the actor's next execution
                         actors_store[actor_id, 'cron_next_ex'] = Actor.set_next_ex(actor, actor_id)
@@ -142,116 +157,20 @@ class MetricsResource(Resource):
         else:
             logger.debug("No autoscaler configuration found; exiting.")
             do_autoscaling = False
-        try:
-            actor_ids, inbox_lengths, cmd_length = self.get_metrics()
-        except Exception as e:
-            logger.error(f"MetricsResource got exception from get_metrics(); e: {e}."
-                         f"Responding without running check_metrics."
-                         f"Autoscaling is broken!!!!!!")
-            return Response("Unhandled exception in get_metrics of MetricsResource!")
-        if len(actor_ids) == 0:
+        if event_driven_autoscaling():
+            logger.debug("Autoscaling is driven by the autoscaler agent; only updating the gauges.")
             do_autoscaling = False
-        if not do_autoscaling:
-            logger.debug("AUTOSCALER run complete --------")
-            return
+        # the gauges are updated on every run; workers are only started and stopped when autoscaling is on.
         try:
-            self.check_metrics(actor_ids, inbox_lengths, cmd_length)
+            metrics_utils.Autoscaler().run(scale=do_autoscaling)
         except Exception as e:
-            logger.error(f"MetricsResource got exception from check_metrics(); e: {e}."
+            logger.error(f"MetricsResource got exception from the autoscaler; e: {e}."
                          f"Responding with an error."
                          f"Autoscaling is likely broken!!!")
-            return Response("Unhandled exception in check_metrics MetricsResource!")
-
-        # self.add_workers(actor_ids)
+            return Response("Unhandled exception in the autoscaler of MetricsResource!")
         logger.debug("AUTOSCALER run complete --------")
         return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
-    def get_metrics(self):
-        logger.debug("top of get_metrics")
-        actor_ids = [actor['db_id'] for actor in actors_store.items()
-            if actor.get('stateless')
-            and not actor.get('status') == 'ERROR'
-            and not actor.get('status') == SHUTTING_DOWN]
-        logger.debug(f"autoscaler found {len(actor_ids)} actors.")
-        if len(actor_ids) == 0:
-            return [], {}, None
-        try:
-            # Create a gauge for each actor id
-            actor_ids, inbox_lengths, cmd_length = metrics_utils.create_gauges(actor_ids)
-            # return the actor_ids so we can use them again for check_metrics
-            return actor_ids, inbox_lengths, cmd_length
-        except Exception as e:
-            logger.info("Got exception in call to create_gauges; skipping autoscaler; e: {}".format(e))
-            return [], {}, None
-
-    def check_metrics(self, actor_ids, inbox_lengths, cmd_length):
-        logger.debug("top of check_metrics")
-        for actor_id in actor_ids:
-            current_message_count = 0
-            try:
-                current_message_count = inbox_lengths[actor_id]
-            except KeyError as e:
-                logger.info("Got KeyError trying to get current_message_count. Exception: {}".format(e))
-                # don't try to process the actor any further
-                continue
-            except Exception as e:
-                logger.error(f"Uncaught exception in check_metrics; e: {e}")
-                # don't try to process the actor any further
-                continue
-            workers = Worker.get_workers(actor_id)
-            current_workers = len(workers)
-            logger.debug(f"actor {actor_id}; Current message count: {current_message_count}; "
-                         f"Current workers: {current_workers}")
-
-            # If this actor has a custom max_workers, use that. Otherwise use default.
-            actor = actors_store[actor_id]
-            max_workers = None
-            if actor.get('max_workers'):
-                try:
-                    max_workers = int(actor['max_workers'])
-                except Exception as e:
-                    logger.error("max_workers defined for actor_id {} but could not cast to int. "
-                                 "Exception: {}".format(actor_id, e))
-            if not max_workers:
-                try:
-                    conf = Config.get('spawner', 'max_workers_per_actor')
-                    max_workers = int(conf)
-                except Exception as e:
-                    logger.error("Unable to get/cast max_workers_per_actor config ({}) to int. "
-                                 "Exception: {}".format(conf, e))
-                    max_workers = 1
-            logger.debug(f"actor: {actor_id}; Max workers: {max_workers}")
-            # Add an additional worker if message count reaches a given number
-            try:
-                if metrics_utils.allow_autoscaling(max_workers, current_workers, cmd_length):
-                    if current_message_count >= 1:
-                        channel = metrics_utils.scale_up(actor_id)
-                        if channel == 'default':
-                            cmd_length = cmd_length + 1
-                else:
-                    # todo -- this is not necessarily true... the actor's current workers could just be
-                    # at the max workers for this actor.
-                    logger.warning('METRICS - COMMAND QUEUE is getting full. Skipping autoscale.')
-                if current_message_count == 0:
-                    logger.debug("current message count was 0; checking whether to scale down...")
-                    # first check if this is a "sync" actor
-                    is_sync_actor = False
-                    try:
-                        hints = list(actor.get("hints"))
-                    except:
-                        hints = []
-                    for hint in hints:
-                        if hint == Actor.SYNC_HINT:
-                            is_sync_actor = True
-                            break
-                    logger.debug(f"actor {actor_id} was a SYNC actor (T/F): {is_sync_actor}.")
-                    metrics_utils.scale_down(actor_id, is_sync_actor)
-                    logger.debug("autoscaler returned from scale_down() call.")
-                else:
-                    logger.warning('METRICS - COMMAND QUEUE is getting full. Skipping autoscale.')
-            except Exception as e:
-                logger.debug("METRICS - ANOTHER ERROR: {} - {} - {}".format(type(e), e, e.args))
-
     def test_metrics(self):
         logger.debug("METRICS TESTING")
 
@@ -262,16 +181,16 @@ class AdminActorsResource(Resource):
         case = Config.get('web', 'case')
         actors = []
         try:
-            for actor in actors_store.items():
+            all_actors = actors_store.items()
+            inbox_lengths = get_inbox_lengths([actor['db_id'] for actor in all_actors])
+            for actor in all_actors:
                 actor = Actor.from_db(actor)
                 actor.workers = []
                 for worker in Worker.get_workers(actor.db_id):
                     if case == 'camel':
                         worker = dict_to_camel(worker)
                     actor.workers.append(worker)
-                ch = ActorMsgChannel(actor_id=actor.db_id)
-                actor.messages = len(ch._queue._queue)
-                ch.close()
+                actor.messages = inbox_lengths.get(actor.db_id, 0)
                 summary = ExecutionsSummary(db_id=actor.db_id)
                 actor.executions = summary.total_executions
                 actor.runtime = summary.total_runtime
@@ -352,52 +271,39 @@ class AdminExecutionsResource(Resource):
                   'actors': []
         }
         case = Config.get('web', 'case')
+        # read the usage counters maintained by the accounting module instead of scanning every execution
+        totals = accounting.get_totals()
+        result['summary']['total_actors_all'] += totals['actors_total']
+        result['summary']['total_executions_all'] += totals['executions_total']
+        result['summary']['total_execution_runtime_all'] += totals['execution_runtime']
+        result['summary']['total_execution_io_all'] += totals['execution_io']
+        result['summary']['total_execution_cpu_all'] += totals['execution_cpu']
+        existing_actors = {}
+        for actor in actors_store.items(proj_inp={'db_id': True, 'id': True, 'owner': True, 'image': True,
+                                                  '_id': False}):
+            existing_actors[actor.get('db_id')] = actor
+        result['summary']['total_actors_existing'] += len(existing_actors)
         actor_stats = {}
-        actor_does_not_exist = []
-        for execution in executions_store.items():
-            actor_id = execution['actor_id']
-            actor_cpu = execution['cpu']
-            actor_io = execution['io']
-            actor_runtime = execution['runtime']
-            if actor_id in actor_does_not_exist:
-                pass
-            else:
-                try:
-                    # checks if actor existance has already been tested
-                    if not actor_id in actor_stats:
-                        result['summary']['total_actors_all_with_executions'] += 1
-                        # determine if actor still exists:
-                        actor = Actor.from_db(actors_store[actor_id])
-                        # creates dict if actor does exist
-                        actor_stats[actor_id] = {'actor_id': actor.get('id'),
-                                                'owner': actor.get('owner'),
-                                                'image': actor.get('image'),
-                                                'total_executions': 0,
-                                                'total_execution_cpu': 0,
-                                                'total_execution_io': 0,
-                                                'total_execution_runtime': 0}
-                        result['summary']['total_actors_existing_with_executions'] += 1
-
-                    # write actor information if actor does exist
-                    actor_stats[actor_id]['total_executions'] += 1
-                    actor_stats[actor_id]['total_execution_runtime'] += actor_runtime
-                    actor_stats[actor_id]['total_execution_io'] += actor_io
-                    actor_stats[actor_id]['total_execution_cpu'] += actor_cpu
-                    # write result information if actor does exist
-                    result['summary']['total_executions_existing'] += 1
-                    result['summary']['total_execution_runtime_existing'] += actor_runtime
-                    result['summary']['total_execution_io_existing'] += actor_io
-                    result['summary']['total_execution_cpu_existing'] += actor_cpu
-                except KeyError:
-                    actor_does_not_exist.append(actor_id)
-            # always add these to the totals:
-            result['summary']['total_executions_all'] += 1
-            result['summary']['total_execution_runtime_all'] += actor_runtime
-            result['summary']['total_execution_io_all'] += actor_io
-            result['summary']['total_execution_cpu_all'] += actor_cpu
-
-        result['summary']['total_actors_all'] += abaco_metrics_store['stats', 'actor_total']
-        result['summary']['total_actors_existing'] += len(actors_store)
+        for actor_totals in accounting.get_actor_totals():
+            if not actor_totals.get('executions_total'):
+                continue
+            result['summary']['total_actors_all_with_executions'] += 1
+            actor = existing_actors.get(actor_totals.get('actor_dbid'))
+            if not actor:
+                continue
+            actor_stats[actor_totals.get('actor_dbid')] = {
+                'actor_id': actor.get('id'),
+                'owner': actor.get('owner'),
+                'image': actor.get('image'),
+                'total_executions': actor_totals.get('executions_total', 0),
+                'total_execution_cpu': actor_totals.get('execution_cpu', 0),
+                'total_execution_io': actor_totals.get('execution_io', 0),
+                'total_execution_runtime': actor_totals.get('execution_runtime', 0)}
+            result['summary']['total_actors_existing_with_executions'] += 1
+            result['summary']['total_executions_existing'] += actor_totals.get('executions_total', 0)
+            result['summary']['total_execution_runtime_existing'] += actor_totals.get('execution_runtime', 0)
+            result['summary']['total_execution_io_existing'] += actor_totals.get('execution_io', 0)
+            result['summary']['total_execution_cpu_existing'] += actor_totals.get('execution_cpu', 0)
 
         for actor_stat in actor_stats.values():
             if case == 'camel':
@@ -462,6 +368,8 @@ class AliasesResource(Resource):
         logger.debug("Alias object instantiated; checking for uniqueness and creating alias. "
                      "alias: {}".format(alias))
         alias.check_and_create_alias()
+        # workers resolve the configs of an actor by its aliases too.
+        ActorConfig.bump_generation()
         logger.info("alias added for actor: {}.".format(dbid))
         set_permission(g.user, alias.alias_id, UPDATE)
         return ok(result=alias.display(), msg="Actor alias created successfully.")
@@ -532,6 +440,8 @@ class AliasResource(Resource):
         logger.debug("Alias object instantiated; updating alias in alias_store. "
                      "alias: {}".format(new_alias_obj))
         alias_store[alias_id] = new_alias_obj
+        invalidate_alias(alias_id)
+        ActorConfig.bump_generation()
         logger.info("alias updated for actor: {}.".format(dbid))
         set_permission(g.user, new_alias_obj.alias_id, UPDATE)
         return ok(result=new_alias_obj.display(), msg="Actor alias updated successfully.")
@@ -554,9 +464,12 @@ class AliasResource(Resource):
         #                                f"access to the actor associated with this alias.")
         try:
             del alias_store[alias_id]
+            invalidate_alias(alias_id)
+            ActorConfig.bump_generation()
             # also remove all permissions - there should be at least one permissions associated
             # with the owner
             del permissions_store[alias_id]
+            invalidate_permissions(alias_id)
             logger.info("alias {} deleted from alias store.".format(alias_id))
         except Exception as e:
             logger.info("got Exception {} trying to delete alias {}".format(e, alias_id))
@@ -764,12 +677,38 @@ def validate_link(args):
     check_for_link_cycles(g.db_id, link_dbid)
 
 
+def validate_concurrency(concurrency, stateless):
+    """
+    Check the number of executions each worker of an actor runs at the same time. Each of them gets the actor's
+    mem_limit and max_cpus, so it is bounded by the max_concurrency config.
+    """
+    if concurrency is None:
+        return
+    if concurrency < 1 or concurrency > ACTOR_MAX_CONCURRENCY:
+        raise DAOError(f"Invalid actor description: concurrency must be between 1 and {ACTOR_MAX_CONCURRENCY}.")
+    if concurrency > 1 and not stateless:
+        raise DAOError("Invalid actor description: stateful actors can only run one execution at a time.")
+
+
+def validate_batching(batch_size, batch_wait, hints):
+    """
+    Check the batching options of an actor; a batch of up to batch_size messages is run by a single actor container
+    (see batching.py), so it is bounded by the max_batch_size config.
+    """
+    if batch_size is not None and (batch_size < 1 or batch_size > ACTOR_MAX_BATCH_SIZE):
+        raise DAOError(f"Invalid actor description: batch_size must be between 1 and {ACTOR_MAX_BATCH_SIZE}.")
+    if batch_wait is not None and batch_wait < 0:
+        raise DAOError("Invalid actor description: batch_wait cannot be negative.")
+    if (batch_size or 1) > 1 and Actor.HOT_HINT in (hints or []):
+        raise DAOError(f"Invalid actor description: actors with the {Actor.HOT_HINT} hint cannot use batching.")
+
+
 class AbacoUtilizationResource(Resource):
 
     def get(self):
         logger.debug("top of GET /actors/utilization")
         num_current_actors = len(actors_store)
-        num_actors = abaco_metrics_store['stats', 'actor_total']
+        num_actors = accounting.get_totals()['actors_total']
         num_workers = len(workers_store)
         ch = CommandChannel()
         result = {'currentActors': num_current_actors,
@@ -779,25 +718,53 @@ class AbacoUtilizationResource(Resource):
                   }
         return ok(result=result, msg="Abaco utilization returned successfully.")
 
+def stream_actors(actors, limit, msg="Actors retrieved successfully."):
+    """
+    Generate the JSON of an ok() response listing the actor documents of the cursor `actors`, one actor at a time.
+    The _metadata of the response holds the id to pass as `after` to get the next page, or null on the last page.
+    """
+    yield '{{"message": {}, "status": "success", "version": {}, "result": ['.format(json.dumps(msg), json.dumps(TAG))
+    count = 0
+    last = None
+    for actor_info in actors:
+        actor = Actor.from_db(actor_info)
+        last = actor.id
+        yield '{}{}'.format(', ' if count else '', flask_json.dumps(actor.display()))
+        count += 1
+    metadata = {'record_limit': limit,
+                'count_returned': count,
+                'next_after': last if limit and count == limit else None}
+    if Config.get('web', 'case') == 'camel':
+        metadata = dict_to_camel(metadata)
+    yield '], "_metadata": {}}}'.format(json.dumps(metadata))
+
+
 class ActorsResource(Resource):
 
     def get(self):
         logger.debug("top of GET /actors")
-        if len(request.args) > 1 or (len(request.args) == 1 and not 'x-nonce' in request.args):
+        if set(request.args.keys()) - {'x-nonce', 'limit', 'after'}:
             args_given = request.args
             args_full = {}
             args_full.update(args_given)
             result = Search(args_full, 'actors', g.tenant, g.user).search()
             return ok(result=result, msg="Actors search completed successfully.")
         else:
-            actors = []
-            for actor_info in actors_store.items():
-                if actor_info['tenant'] == g.tenant:
-                    actor = Actor.from_db(actor_info)
-                    if check_permissions(g.user, actor.db_id, READ):
-                        actors.append(actor.display())
+            # the actors are listed a page at a time: `limit` is the size of the page and `after` the id of the last
+            # actor of the previous page, returned in the _metadata of the response.
+            limit = request.args.get('limit')
+            if limit is not None:
+                try:
+                    limit = int(limit)
+                    if limit < 1:
+                        raise ValueError()
+                except ValueError:
+                    raise ResourceError(f"Invalid limit: {limit}. limit must be a positive integer.", 400)
+            after = request.args.get('after')
+            actors = Actor.list_actors(g.tenant, g.user, limit=limit, after=after)
             logger.info("actors retrieved.")
-            return ok(result=actors, msg="Actors retrieved successfully.")
+            # the actors are streamed as they are read from the cursor, so the list is never built in memory.
+            return Response(stream_with_context(stream_actors(actors, limit)), mimetype='application/json')
 
     def validate_post(self):
         logger.debug("top of validate post in /actors")
@@ -904,16 +871,15 @@ class ActorsResource(Resource):
             args['maxWorkers'] = max_workers
         if max_workers and 'stateless' in args and not args.get('stateless'):
             raise DAOError("Invalid actor description: stateful actors can only have 1 worker.")
+        validate_concurrency(args.get('concurrency'), args.get('stateless', True))
+        validate_batching(args.get('batch_size', args.get('batchSize')), args.get('batch_wait', args.get('batchWait')),
+                          args.get('hints'))
         args['mounts'] = get_all_mounts(args)
         logger.debug("create args: {}".format(args))
         actor = Actor(**args)
         # Change function
         actors_store.add_if_empty([actor.db_id], actor)
-        abaco_metrics_store.full_update(
-            {'_id': 'stats'},
-            {'$inc': {'actor_total': 1},
-             '$addToSet': {'actor_dbids': actor.db_id}},
-             upsert=True)
+        accounting.record_actor_created(actor.tenant)
 
         logger.debug("new actor saved in db. id: {}. image: {}. tenant: {}".format(actor.db_id,
                                                                                    actor.image,
@@ -953,7 +919,7 @@ class ActorResource(Resource):
             try:
                 executions_by_actor = executions_store.items({'actor_id': id})
                 for execution in executions_by_actor:
-                    del logs_store[execution['id']]
+                    Execution.delete_logs(execution['id'])
             except KeyError as e:
                 logger.info("got KeyError {} trying to retrieve actor or executions with id {}".format(
                     e, id))
@@ -993,8 +959,11 @@ class ActorResource(Resource):
             # if we get an error trying to remove the inbox, log it but keep going
             logger.error("Unable to delete the actor's message channel for actor: {}, exception: {}".format(id, e))
         del actors_store[id]
+        Actor.invalidate_cache(id)
         logger.info("actor {} deleted from store.".format(id))
         del permissions_store[id]
+        invalidate_permissions(id)
+        invalidate_actor_aliases(Actor.get_display_id(g.tenant, id))
         logger.info("actor {} permissions deleted from store.".format(id))
         del nonce_store[id]
         logger.info("actor {} nonces delete from nonce store.".format(id))
@@ -1099,6 +1068,17 @@ class ActorResource(Resource):
         actor = Actor(**args)
 
         actors_store[actor.db_id] = actor.to_db()
+        Actor.invalidate_cache(actor.db_id)
+        # the actor's workers learn of the update right away and drop their cached copy of the actor. on an image
+        # update, the current workers are kept here: they are drained by the spawner (see Spawner.stop_workers()) once
+        # a worker of the new revision is ready.
+        keep = []
+        if update_image:
+            try:
+                keep = [worker['id'] for worker in workers_store.items({'actor_id': actor.db_id})]
+            except KeyError:
+                keep = []
+        publish_revision(actor.db_id, actor.revision, keep=keep)
 
         logger.info("updated actor {} stored in db.".format(actor_id))
         if update_image:
@@ -1134,6 +1114,8 @@ class ActorResource(Resource):
             actor.pop('mem_limit')
             actor.pop('max_cpus')
             actor.pop('log_ex')
+            actor.pop('batch_size', None)
+            actor.pop('batch_wait', None)
 
         # this update overrides all required and optional attributes
         try:
@@ -1156,6 +1138,9 @@ class ActorResource(Resource):
                     if bad_char in hint:
                         raise BadRequest(f"Hints must be simple stings or numbers, no lists or dicts. Error character: {bad_char}")    
         actor.update(new_fields)
+        validate_concurrency(actor.get('concurrency'), actor.get('stateless'))
+        validate_batching(actor.get('batch_size', actor.get('batchSize')),
+                          actor.get('batch_wait', actor.get('batchWait')), actor.get('hints'))
         return actor
 
 
@@ -1185,6 +1170,7 @@ class ActorStateResource(Resource):
         state = self.validate_post()
         logger.debug("state post params validated: {}".format(actor_id))
         actors_store[dbid, 'state'] = state
+        Actor.invalidate_cache(dbid)
         logger.info("state updated: {}".format(actor_id))
         actor = Actor.from_db(actors_store[dbid])
         return ok(result=actor.display(), msg="State updated successfully.")
@@ -1265,6 +1251,7 @@ class ActorConfigsResource(Resource):
         # save the config to the db
         config_id = ActorConfig.get_config_db_key(tenant_id=g.tenant, name=actor_config.name)
         configs_store[config_id] = actor_config.to_db()
+        ActorConfig.bump_generation()
         # set permissions for this config
         set_config_permission(g.user, config_id, UPDATE)
         return ok(result=actor_config.display(), msg="Actor config created successfully.")
@@ -1361,6 +1348,7 @@ class ActorConfigResource(Resource):
         logger.debug("Actor Config object instantiated; updating actor config in configs_store. "
                      "config: {}".format(new_config_obj))
         configs_store[config_id] = new_config_obj
+        ActorConfig.bump_generation()
         logger.debug(f"NEW CONFIG OBJ {new_config_obj}")
         logger.info(f"actor config updated for config: {config_id}.")
         return ok(result=new_config_obj.display(), msg="Actor config updated successfully.")
@@ -1380,6 +1368,7 @@ class ActorConfigResource(Resource):
         # delete the config and associated permissions
         try:
             del configs_store[config_id]
+            ActorConfig.bump_generation()
             # also remove all permissions - there should be at least one permissions associated
             # with the owner
             del configs_permissions_store[config_id]
@@ -1565,7 +1554,7 @@ class ActorExecutionResource(Resource):
         logger.debug("issuing force quit to worker: {} "
                      "for actor_id: {} execution_id: {}".format(exc.worker_id, actor_id, execution_id))
         ch = WorkerChannel(worker_id=exc.worker_id)
-        ch.put('force_quit')
+        ch.put({'force_quit': execution_id})
         msg = 'Issued force quit command for execution {}.'.format(execution_id)
         return ok(result=None, msg=msg)
 
@@ -1604,13 +1593,14 @@ class ActorExecutionLogsResource(Resource):
     def get(self, actor_id, execution_id):
         def get_hypermedia(actor, exc):
             return {'_links': {'self': '{}/actors/v2/{}/executions/{}/logs'.format(actor.api_server, actor.id, exc.id),
+                                'stream': '{}/actors/v2/{}/executions/{}/logs/stream'.format(actor.api_server, actor.id, exc.id),
                                 'owner': '{}/profiles/v2/{}'.format(actor.api_server, actor.owner),
                                 'execution': '{}/actors/v2/{}/executions/{}'.format(actor.api_server, actor.id, exc.id)},
                     }
         logger.debug("top of GET /actors/{}/executions/{}/logs.".format(actor_id, execution_id))
         if len(request.args) > 1 or (len(request.args) == 1 and not 'x-nonce' in request.args):
             args_given = request.args
-            args_full = {'actor_id': f'{g.tenant}_{actor_id}', '_id': execution_id}
+            args_full = {'actor_id': f'{g.tenant}_{actor_id}', 'execution_id': execution_id}
             args_full.update(args_given)
             result = Search(args_full, 'logs', g.tenant, g.user).search()
             return ok(result=result, msg="Log search completed successfully.")
@@ -1627,14 +1617,103 @@ class ActorExecutionLogsResource(Resource):
             except KeyError:
                 logger.debug(f"did not find execution with actor id of {actor_id} and execution id of {execution_id}.")
                 raise ResourceError(f"No executions found with actor id of {actor_id} and execution id of {execution_id}.")
+            byte_range = parse_byte_range(request.headers.get('Range'))
+            start, end = byte_range or (0, None)
             try:
-                logs = logs_store[execution_id]['logs']
+                logs, summary = Execution.get_logs(execution_id, start, end)
             except KeyError:
                 logger.debug("did not find logs. execution: {}. actor: {}.".format(execution_id, actor_id))
-                logs = ""
+                logs, summary = "", {'length': 0, 'returned': 0, 'complete': False}
+            length = summary.get('length')
+            if byte_range and summary.get('complete', True) and length is not None and start >= length:
+                # the range starts past the end of a log that will not grow any more.
+                response = make_response(flask_json.jsonify({'message': f"Range not satisfiable; the log has {length} bytes.",
+                                                             'status': 'error',
+                                                             'version': TAG,
+                                                             'result': None}), 416)
+                response.headers['Content-Range'] = f"bytes */{length}"
+                return response
             result={'logs': logs}
             result.update(get_hypermedia(actor, exc))
-            return ok(result, msg="Logs retrieved successfully.")
+            if not byte_range:
+                return ok(result, msg="Logs retrieved successfully.")
+            # a byte range of the logs was requested; `length` is the length of the whole log.
+            result['offset'] = start
+            result['length'] = summary.get('length')
+            result['complete'] = summary.get('complete', True)
+            response = ok(result, msg="Logs retrieved successfully.")
+            if not summary['returned']:
+                # nothing was shipped past `start` yet; the log is still growing.
+                return response
+            response.status_code = 206
+            # the byte count read from the store, as the decoded text can have a different length once re-encoded.
+            last = start + summary['returned'] - 1
+            response.headers['Content-Range'] = f"bytes {start}-{last}/{summary.get('length', '*')}"
+            return response
+
+
+class ActorExecutionLogsStreamResource(Resource):
+    def get(self, actor_id, execution_id):
+        """
+        Stream the logs of an execution as they are shipped by the worker, starting at the byte offset given by the
+        `since` query parameter (or the Last-Event-ID header). Clients accepting text/event-stream get Server-Sent
+        Events whose ids are the offsets to resume from; other clients get a chunked text/plain response.
+        The stream closes when the execution reaches COMPLETE or ERROR, or after [web] log_stream_max_time seconds,
+        after which clients can reconnect with the last offset.
+        """
+        logger.debug("top of GET /actors/{}/executions/{}/logs/stream.".format(actor_id, execution_id))
+        dbid = g.db_id
+        try:
+            executions_store[f'{dbid}_{execution_id}', 'status']
+        except KeyError:
+            logger.debug(f"did not find execution with actor id of {actor_id} and execution id of {execution_id}.")
+            raise ResourceError(f"No executions found with actor id of {actor_id} and execution id of {execution_id}.", 404)
+        since = request.args.get('since') or request.headers.get('Last-Event-ID') or 0
+        try:
+            since = int(since)
+            if since < 0:
+                raise ValueError()
+        except ValueError:
+            raise ResourceError(f"Invalid since: {since}. since must be a non-negative byte offset.", 400)
+        try:
+            max_time = int(Config.get('web', 'log_stream_max_time'))
+        except:
+            max_time = 300
+        logs = Execution.tail_logs(dbid, execution_id, since, max_time=max_time)
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            def events():
+                for data, offset in logs:
+                    lines = ''.join(f'data: {line}\n' for line in data.split('\n'))
+                    yield f'id: {offset}\n{lines}\n'
+                yield 'event: end\ndata: \n\n'
+            response = Response(events(), mimetype='text/event-stream')
+        else:
+            response = Response((data for data, _ in logs), mimetype='text/plain')
+        response.headers['Cache-Control'] = 'no-cache'
+        # ask proxies not to buffer the stream.
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def parse_byte_range(header):
+    """
+    Parse a `Range: bytes=<first>-[<last>]` header into a (start, end) tuple, with `end` exclusive (or None for the
+    end of the log). Returns None if no header was passed.
+    """
+    if not header:
+        return None
+    try:
+        unit, _, spec = header.partition('=')
+        first, _, last = spec.strip().partition('-')
+        if not unit.strip() == 'bytes' or not first:
+            raise ValueError()
+        start = int(first)
+        end = int(last) + 1 if last else None
+        if start < 0 or (end is not None and end <= start):
+            raise ValueError()
+    except ValueError:
+        raise ResourceError(f"Invalid Range header: {header}. Expected bytes=<first>-[<last>].", 416)
+    return start, end
 
 
 def get_messages_hypermedia(actor):
@@ -1655,9 +1734,7 @@ class MessagesResource(Resource):
             logger.debug("did not find actor: {}.".format(actor_id))
             raise ResourceError(
                 "No actor found with id: {}.".format(actor_id), 404)
-        ch = ActorMsgChannel(actor_id=id)
-        result = {'messages': len(ch._queue._queue)}
-        ch.close()
+        result = {'messages': get_inbox_length(id)}
         logger.debug("messages found for actor: {}.".format(actor_id))
         result.update(get_messages_hypermedia(actor))
         return ok(result)
@@ -1676,6 +1753,7 @@ class MessagesResource(Resource):
         ch._queue._queue.purge()
         result = {'msg': "Actor mailbox purged."}
         ch.close()
+        invalidate_inbox_length(id)
         logger.debug("messages purged for actor: {}.".format(actor_id))
         result.update(get_messages_hypermedia(actor))
         return ok(result)
@@ -1735,7 +1813,7 @@ class MessagesResource(Resource):
         synchronous = False
         dbid = g.db_id
         try:
-            actor = Actor.from_db(actors_store[dbid])
+            actor = Actor.from_cache(dbid)
         except KeyError:
             logger.debug("did not find actor: {}.".format(actor_id))
             raise ResourceError("No actor found with id: {}.".format(actor_id), 404)
@@ -1764,9 +1842,7 @@ class MessagesResource(Resource):
         logger.debug("extra fields added to message from query parameters: {}.".format(d))
         if synchronous:
             # actor mailbox length must be 0 to perform a synchronous execution
-            ch = ActorMsgChannel(actor_id=actor_id)
-            box_len = len(ch._queue._queue)
-            ch.close()
+            box_len = get_inbox_length(dbid)
             if box_len > 3:
                 raise ResourceError("Cannot issue synchronous execution when actor message queue > 0.")
         if hasattr(g, 'user'):
@@ -1791,16 +1867,26 @@ class MessagesResource(Resource):
         d['_abaco_Content_Type'] = args.get('_abaco_Content_Type', '')
         d['_abaco_actor_revision'] = actor.revision
         logger.debug("Final message dictionary: {}".format(d))
+        completion_ch = None
+        if synchronous:
+            # subscribe to the completion notification before the message can be processed.
+            completion_ch = self.subscribe_completion(dbid, exc)
         before_ch_timer = timeit.default_timer()
-        ch = ActorMsgChannel(actor_id=dbid)
-        after_ch_timer = timeit.default_timer()
-        ch.put_msg(message=args['message'], d=d)
+        try:
+            ch = ActorMsgChannel(actor_id=dbid)
+            after_ch_timer = timeit.default_timer()
+            ch.put_msg(message=args['message'], d=d)
+        except Exception:
+            if completion_ch:
+                completion_ch.close()
+            raise
         after_put_msg_timer = timeit.default_timer()
         ch.close()
+        signal_enqueued(dbid)
         after_ch_close_timer = timeit.default_timer()
         logger.debug("Message added to actor inbox. id: {}.".format(actor_id))
         # make sure at least one worker is available
-        actor = Actor.from_db(actors_store[dbid])
+        actor = Actor.from_cache(dbid)
         after_get_actor_db_timer = timeit.default_timer()
         actor.ensure_one_worker()
         after_ensure_one_worker_timer = timeit.default_timer()
@@ -1827,82 +1913,198 @@ class MessagesResource(Resource):
                      }
         logger.info("Times to process message: {}".format(time_data))
         if synchronous:
-            return self.do_synch_message(exc)
+            return self.do_synch_message(exc, completion_ch)
         if not case == 'camel':
             return ok(result)
         else:
             return ok(dict_to_camel(result))
 
-    def do_synch_message(self, execution_id):
-        """Monitor for the termination of a synchronous message execution."""
+    def subscribe_completion(self, dbid, execution_id):
+        """Return the channel on which the completion notification of a synchronous execution is received."""
+        return ExecutionCompletionChannel(dbid, execution_id)
+
+    def do_synch_message(self, execution_id, completion_ch):
+        """
+        Wait for the termination of a synchronous message execution and return its result, or its logs if it did not
+        produce a result. The worker publishes a notification to `completion_ch` when the execution produces its
+        first result and when it finishes.
+        """
         logger.debug("top of do_synch_message")
         dbid = g.db_id
-        ch = ExecutionResultsChannel(actor_id=dbid, execution_id=execution_id)
-        result = None
-        complete = False
-        check_results_channel = True
-        binary_result = False
-        timeout = 0.1
-        while not complete:
-            # check for a result on the results channel -
-            if check_results_channel:
-                logger.debug("checking for result on the results channel...")
-                try:
-                    result = ch.get(timeout=timeout)
-                    ch.close()
-                    complete = True
-                    binary_result = True
-                    logger.debug("check_results_channel thread got a result.")
-                except ChannelClosedException as e:
-                    # the channel unexpectedly closed, so just return
-                    logger.info("unexpected ChannelClosedException in check_results_channel thread: {}".format(e))
-                    check_results_channel = False
-                except ChannelTimeoutException:
-                    pass
-                except Exception as e:
-                    logger.info("unexpected exception in check_results_channel thread: {}".format(e))
-                    check_results_channel = False
+        try:
+            check_interval = float(Config.get('web', 'sync_check_interval'))
+        except:
+            check_interval = 30
+        done = threading.Event()
 
-            # check to see if execution has completed:
-            if not complete:
+        def check_status():
+            # safety net for workers that stop without publishing a notification (e.g., when they are killed).
+            while not done.wait(check_interval):
                 try:
-                    exc = Execution.from_db(executions_store[f'{dbid}_{execution_id}'])
-                    complete = exc.status == COMPLETE
-                except Exception as e:
-                    logger.info("got exception trying to check execution status: {}".format(e))
-            if complete:
-                logger.debug("execution is complete")
-                if not result:
-                    # first try one more time to get a result -
-                    if check_results_channel:
-                        logger.debug("looking for result on results channel.")
-                        try:
-                            result = ch.get(timeout=timeout)
-                            binary_result = True
-                            logger.debug("got binary result.")
-                        except Exception as e:
-                            logger.debug(f"got exception: {e} -- did not get binary result")
-                            pass
-                    # if we still have no result, get the logs -
-                    if not result:
-                        logger.debug("stll don't have result; looking for logs...")
-                        try:
-                            result = logs_store[execution_id]['logs']
-                            logger.debug("got logs; returning result.")
-                        except KeyError:
-                            logger.debug("did not find logs. execution: {}. actor: {}.".format(execution_id, dbid))
-                            result = ""
+                    status = executions_store[f'{dbid}_{execution_id}', 'status']
+                except KeyError:
+                    status = ERROR
+                if status in (COMPLETE, ERROR):
+                    logger.info(f"execution {execution_id} finished without a notification; status: {status}")
+                    publish_completion(dbid, execution_id, status)
+                    return
+
+        threading.Thread(target=check_status, daemon=True).start()
+        try:
+            notification = completion_ch.wait()
+            logger.debug(f"got completion notification: {notification}")
+        finally:
+            done.set()
+            completion_ch.close()
+        return self.synch_response(dbid, execution_id)
+
+    @staticmethod
+    def synch_response(dbid, execution_id):
+        """Build the response to a finished synchronous execution: its result, or its logs."""
+        result = None
+        binary_result = False
+        ch = ExecutionResultsChannel(actor_id=dbid, execution_id=execution_id)
+        try:
+            result = ch.get(timeout=0.1)
+            binary_result = True
+            logger.debug("got binary result.")
+        except Exception as e:
+            logger.debug(f"got exception: {e} -- did not get binary result")
+        finally:
+            try:
+                ch.close()
+            except:
+                pass
+        # if we have no result, get the logs -
+        if not result:
+            logger.debug("no result; looking for logs...")
+            try:
+                result, _ = Execution.get_logs(execution_id)
+                logger.debug("got logs; returning result.")
+            except KeyError:
+                logger.debug("did not find logs. execution: {}. actor: {}.".format(execution_id, dbid))
+                result = ""
         response = make_response(result)
         if binary_result:
             response.headers['content-type'] = 'application/octet-stream'
-        try:
-            ch.close()
-        except:
-            pass
         logger.debug("returning synchronous response.")
         return response
 
 
+class MessagesBatchResource(Resource):
+    def validate_post(self):
+        """
+        Parse a batch of messages from the POST body. The body is either a JSON list with one item per message or
+        newline-delimited JSON (NDJSON) with one message per line.
+        """
+        logger.debug("validating batch message payload.")
+        data = request.get_data()
+        if not data:
+            raise DAOError("A batch of messages is required; pass a JSON list or newline-delimited JSON.")
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            raise DAOError("Batches of binary messages are not supported; pass a JSON list or newline-delimited JSON.")
+        messages = None
+        if 'ndjson' not in request.headers.get('Content-Type', ''):
+            try:
+                messages = json.loads(data)
+            except json.decoder.JSONDecodeError:
+                logger.debug("batch POST body was not a JSON document; trying NDJSON.")
+            else:
+                if not isinstance(messages, list):
+                    raise DAOError("A batch of messages must be a JSON list or newline-delimited JSON.")
+        if messages is None:
+            messages = []
+            for idx, line in enumerate(data.splitlines()):
+                if not line.strip():
+                    continue
+                try:
+                    messages.append(json.loads(line))
+                except json.decoder.JSONDecodeError:
+                    raise DAOError("Line {} of the batch could not be parsed as JSON.".format(idx + 1))
+        if not messages:
+            raise DAOError("The batch did not contain any messages.")
+        try:
+            max_batch_messages = int(Config.get('web', 'max_batch_messages'))
+        except Exception:
+            max_batch_messages = 10000
+        if len(messages) > max_batch_messages:
+            raise DAOError("A batch may contain at most {} messages.".format(max_batch_messages))
+        return messages
+
+    def post(self, actor_id):
+        start_timer = timeit.default_timer()
+        logger.debug("top of POST /actors/{}/messages/batch.".format(actor_id))
+        dbid = g.db_id
+        try:
+            actor = Actor.from_db(actors_store[dbid])
+        except KeyError:
+            logger.debug("did not find actor: {}.".format(actor_id))
+            raise ResourceError("No actor found with id: {}.".format(actor_id), 404)
+        messages = self.validate_post()
+        val_post_timer = timeit.default_timer()
+        # fields common to every message in the batch; see MessagesResource.post
+        d = {}
+        for k, v in request.args.items():
+            if k == '_abaco_synchronous':
+                if v.lower() == 'true':
+                    raise ResourceError("Synchronous executions are not supported for batches of messages.")
+                continue
+            if k == 'message':
+                continue
+            d[k] = v
+        if hasattr(g, 'user'):
+            d['_abaco_username'] = g.user
+        if hasattr(g, 'api_server'):
+            d['_abaco_api_server'] = g.api_server
+        if hasattr(g, 'jwt_header_name'):
+            d['_abaco_jwt_header_name'] = g.jwt_header_name
+        d['_abaco_actor_revision'] = actor.revision
+        # create all executions with one write
+        exc_ids = Execution.add_executions(dbid,
+                                           [{'cpu': 0,
+                                             'io': 0,
+                                             'runtime': 0,
+                                             'status': SUBMITTED,
+                                             'executor': g.user} for _ in messages],
+                                           actor=actor)
+        after_exc_timer = timeit.default_timer()
+        logger.info("{} executions added for actor {}".format(len(exc_ids), actor_id))
+        batch = []
+        for message, exc in zip(messages, exc_ids):
+            content_type = 'str' if isinstance(message, str) else 'application/json'
+            batch.append((message, {'_abaco_execution_id': exc, '_abaco_Content_Type': content_type}))
+        ch = ActorMsgChannel(actor_id=dbid)
+        try:
+            ch.put_msgs(batch, d=d)
+        finally:
+            ch.close()
+        signal_enqueued(dbid, len(batch))
+        after_put_msgs_timer = timeit.default_timer()
+        logger.debug("{} messages added to actor inbox. id: {}.".format(len(batch), actor_id))
+        # make sure at least one worker is available
+        actor.ensure_one_worker()
+        end_timer = timeit.default_timer()
+        time_data = {'total': (end_timer - start_timer) * 1000,
+                     'validate_post': (val_post_timer - start_timer) * 1000,
+                     'add_executions': (after_exc_timer - val_post_timer) * 1000,
+                     'put_msgs_ch': (after_put_msgs_timer - after_exc_timer) * 1000,
+                     'ensure_1_worker': (end_timer - after_put_msgs_timer) * 1000,
+                     }
+        logger.info("Times to process batch of {} messages: {}".format(len(batch), time_data))
+        result = {'execution_ids': exc_ids,
+                  'count': len(exc_ids),
+                  '_links': {'self': '{}/actors/v2/{}/executions'.format(actor.api_server, actor.id),
+                             'owner': '{}/profiles/v2/{}'.format(actor.api_server, actor.owner),
+                             'messages': '{}/actors/v2/{}/messages'.format(actor.api_server, actor.id)}}
+        case = Config.get('web', 'case')
+        if not case == 'camel':
+            return ok(result)
+        else:
+            return ok(dict_to_camel(result))
+
+
 class WorkersResource(Resource):
     def get(self, actor_id):
         logger.debug("top of GET /actors/{}/workers for tenant {}.".format(actor_id, g.tenant))
@@ -0,0 +1,190 @@
+"""
+Container supervision from the docker events stream.
+
+Instead of listing containers on every pass of its supervision loop to find out whether an actor container has
+exited, execute_actor() watches the container on a ContainerEvents object. The ContainerEvents object reads a single,
+long-lived docker events stream (one per worker process; see get_container_events()) in a background thread and
+signals the watch as soon as a 'die' event for the container arrives.
+
+Event sources are callables that return an iterable of decoded docker events, so the behaviour can be tested with a
+FakeEventSource instead of a docker daemon.
+"""
+import queue
+import threading
+import time
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+# docker events the supervision cares about.
+WATCHED_EVENTS = ('die', 'oom')
+
+
+class DockerEventSource(object):
+    """Event source reading the container events stream of the docker daemon at `base_url`."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def __call__(self):
+        import docker
+        cli = docker.APIClient(base_url=self.base_url, version="auto")
+        return cli.events(decode=True, filters={'type': 'container', 'event': list(WATCHED_EVENTS)})
+
+
+class FakeEventSource(object):
+    """
+    Event source for tests; events passed to emit() (or the die() and oom() helpers) are delivered to the
+    ContainerEvents reading from this source. Calling disconnect() ends the current stream.
+    """
+
+    _DISCONNECT = object()
+
+    def __init__(self):
+        self._events = queue.Queue()
+        # number of times the stream was opened.
+        self.connections = 0
+
+    def __call__(self):
+        self.connections += 1
+        return self._stream()
+
+    def _stream(self):
+        while True:
+            event = self._events.get()
+            if event is self._DISCONNECT:
+                return
+            yield event
+
+    def emit(self, event):
+        self._events.put(event)
+
+    def die(self, cid, exit_code=0):
+        self.emit({'Type': 'container', 'status': 'die', 'Action': 'die', 'id': cid,
+                   'Actor': {'ID': cid, 'Attributes': {'exitCode': str(exit_code)}},
+                   'time': int(time.time())})
+
+    def oom(self, cid):
+        self.emit({'Type': 'container', 'status': 'oom', 'Action': 'oom', 'id': cid,
+                   'Actor': {'ID': cid, 'Attributes': {}},
+                   'time': int(time.time())})
+
+    def disconnect(self):
+        self._events.put(self._DISCONNECT)
+
+
+class ContainerWatch(object):
+    """What the events stream has reported for one container."""
+
+    def __init__(self, cid):
+        self.cid = cid
+        # set once the container has exited.
+        self.exited = threading.Event()
+        self.exit_code = None
+        self.oom_killed = False
+
+    def wait(self, timeout=None):
+        """Wait up to `timeout` seconds for the container to exit; returns whether it has exited."""
+        return self.exited.wait(timeout)
+
+
+class ContainerEvents(object):
+    """
+    Reads a docker events stream in a background thread and dispatches the events to the ContainerWatch objects of
+    the containers being watched. Events for containers that are not (yet) watched are remembered for `retention`
+    seconds, so watching a container that has already exited still reports the exit.
+    The stream is re-opened when it ends or fails; `connected` is False until it is open again, and callers should
+    fall back to polling the container while it is.
+    """
+
+    def __init__(self, source, retention=60, reconnect_interval=1):
+        self.source = source
+        self.retention = retention
+        self.reconnect_interval = reconnect_interval
+        self.connected = False
+        self._lock = threading.Lock()
+        self._watches = {}
+        # cid -> (time received, list of events) for containers that are not watched.
+        self._recent = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def watch(self, cid):
+        """Start watching the container `cid`; returns its ContainerWatch."""
+        w = ContainerWatch(cid)
+        with self._lock:
+            self._watches[cid] = w
+            _, events = self._recent.pop(cid, (None, []))
+        for event in events:
+            self._apply(w, event)
+        return w
+
+    def unwatch(self, cid):
+        with self._lock:
+            self._watches.pop(cid, None)
+
+    @staticmethod
+    def _apply(w, event):
+        action = event.get('Action') or event.get('status')
+        if action == 'oom':
+            w.oom_killed = True
+        elif action == 'die':
+            try:
+                w.exit_code = int(event.get('Actor', {}).get('Attributes', {}).get('exitCode'))
+            except (TypeError, ValueError):
+                w.exit_code = None
+            w.exited.set()
+
+    def dispatch(self, event):
+        cid = event.get('id') or event.get('Actor', {}).get('ID')
+        if not cid:
+            return
+        now = time.time()
+        with self._lock:
+            w = self._watches.get(cid)
+            if not w:
+                _, events = self._recent.get(cid, (None, []))
+                events.append(event)
+                self._recent[cid] = (now, events)
+                # forget events for containers nobody watched in time.
+                for k in [k for k, (t, _) in self._recent.items() if now - t > self.retention]:
+                    self._recent.pop(k)
+        if w:
+            self._apply(w, event)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                stream = self.source()
+                self.connected = True
+                for event in stream:
+                    self.dispatch(event)
+                    if self._stop.is_set():
+                        break
+            except Exception as e:
+                logger.error(f"Got exception reading the docker events stream; e: {e}")
+            self.connected = False
+            if not self._stop.is_set():
+                time.sleep(self.reconnect_interval)
+
+
+_container_events = None
+_container_events_lock = threading.Lock()
+
+
+def get_container_events(base_url):
+    """Return the started ContainerEvents for this process, reading the events of the daemon at `base_url`."""
+    global _container_events
+    with _container_events_lock:
+        if _container_events is None:
+            _container_events = ContainerEvents(DockerEventSource(base_url)).start()
+        return _container_events
@@ -2,6 +2,7 @@ import configparser
 import json
 import os
 import socket
+import threading
 import time
 import timeit
 import datetime
@@ -14,9 +15,12 @@ from requests.exceptions import ReadTimeout, ConnectionError
 from agaveflask.logs import get_logger, get_log_file_strategy
 logger = get_logger(__name__)
 
-from channels import ExecutionResultsChannel
+from channels import ExecutionResultsChannel, publish_completion
 from config import Config
 from codes import BUSY, READY, RUNNING
+from container_stats import CGROUP_CONTAINER_PATH, get_stats_backend
+from docker_events import get_container_events
+from log_shipping import LogFollower
 import encrypt_utils
 import globals
 from models import Actor, Execution, get_current_utc_time, display_time, ActorConfig
@@ -34,8 +38,19 @@ RESULTS_SOCKET_TIMEOUT = 0.1
 # max frame size, in bytes, for a single result
 MAX_RESULT_FRAME_SIZE = 131072
 
+# while the docker events stream is connected, execute_actor() only lists the container to check its status this
+# often (in seconds), as a safety net; exits are otherwise signaled by the events stream.
+CONTAINER_POLL_INTERVAL = 10
+
 max_run_time = int(Config.get('workers', 'max_run_time'))
 
+# how often (in seconds) a worker checks whether configs or aliases changed, i.e., how long get_actor_configs() may
+# return configs resolved before a change.
+try:
+    CONFIGS_CHECK_INTERVAL = float(Config.get('workers', 'configs_check_interval'))
+except Exception:
+    CONFIGS_CHECK_INTERVAL = 5
+
 dd = Config.get('docker', 'dd')
 host_id = os.environ.get('SPAWNER_HOST_ID', Config.get('spawner', 'host_id'))
 logger.debug("host_id: {}".format(host_id))
@@ -150,6 +165,40 @@ def pull_image(image):
     return rsp
 
 
+# image -> {'done': Event, 'rsp': .., 'error': ..} for the pulls in progress in this process; see pull_image_shared()
+_pulls = {}
+_pulls_lock = threading.Lock()
+
+
+def pull_image_shared(image):
+    """
+    Like pull_image(), but concurrent calls for the same image within this process share a single pull: callers that
+    arrive while a pull of the image is in progress wait for it and get its response, or its exception.
+    """
+    with _pulls_lock:
+        pull = _pulls.get(image)
+        owner = pull is None
+        if owner:
+            pull = {'done': threading.Event(), 'rsp': None, 'error': None}
+            _pulls[image] = pull
+    if not owner:
+        logger.debug(f"waiting on the pull of image {image} already in progress.")
+        pull['done'].wait()
+        if pull['error']:
+            raise pull['error']
+        return pull['rsp']
+    try:
+        pull['rsp'] = pull_image(image)
+        return pull['rsp']
+    except Exception as e:
+        pull['error'] = e
+        raise
+    finally:
+        with _pulls_lock:
+            _pulls.pop(image, None)
+        pull['done'].set()
+
+
 def list_all_containers():
     """Returns a list of all containers """
     cli = docker.APIClient(base_url=dd, version="auto")
@@ -336,25 +385,12 @@ def run_container_with_docker(image,
     return container
 
 
-def run_worker(image,
-               revision,
-               actor_id,
-               worker_id,
-               client_id,
-               client_access_token,
-               client_refresh_token,
-               tenant,
-               api_server,
-               client_secret):
+def get_worker_mounts(worker_id=None):
     """
-    Run an actor executor worker with a given channel and image.
-    :return:
+    Returns the mounts for the fifo and results socket directories of a worker, and the cgroup hierarchy when
+    configured. The fifo and socket directories are mounted at the same path in the worker container. Warm workers
+    (worker_id None) do not know their worker id yet, so they get the parent directories instead.
     """
-    logger.debug("top of run_worker()")
-    command = 'python3 -u /actors/worker.py'
-    logger.debug("docker_utils running worker. actor_id: {}; worker_id: {}; "
-                 "image:{}, revision: {}; command:{}".format(actor_id, worker_id, image, revision, command))
-
     # mount the directory on the host for creating fifos
     try:
         fifo_host_path_dir = Config.get('workers', 'fifo_host_path_dir')
@@ -362,12 +398,12 @@ def run_worker(image,
     except (configparser.NoSectionError, configparser.NoOptionError) as e:
         logger.error("Got exception trying to look up fifo_host_path_dir. Setting to None. Exception: {}".format(e))
         fifo_host_path_dir = None
+    mounts = []
     if fifo_host_path_dir:
-        mounts = [{'host_path': os.path.join(fifo_host_path_dir, worker_id),
-                   'container_path': os.path.join(fifo_host_path_dir, worker_id),
-                   'format': 'rw'}]
-    else:
-        mounts = []
+        path = os.path.join(fifo_host_path_dir, worker_id) if worker_id else fifo_host_path_dir
+        mounts.append({'host_path': path,
+                       'container_path': path,
+                       'format': 'rw'})
 
     # mount the directory on the host for creating result sockets
     try:
@@ -377,12 +413,27 @@ def run_worker(image,
         logger.error("Got exception trying to look up fifo_host_path_dir. Setting to None. Exception: {}".format(e))
         socket_host_path_dir = None
     if socket_host_path_dir:
-        mounts.append({'host_path': os.path.join(socket_host_path_dir, worker_id),
-                       'container_path': os.path.join(socket_host_path_dir, worker_id),
+        path = os.path.join(socket_host_path_dir, worker_id) if worker_id else socket_host_path_dir
+        mounts.append({'host_path': path,
+                       'container_path': path,
                        'format': 'rw'})
 
     logger.info("Final fifo_host_path_dir: {}; socket_host_path_dir: {}".format(fifo_host_path_dir,
                                                                                 socket_host_path_dir))
+
+    # mount the host's cgroup hierarchy (read-only) for reading the usage of actor containers
+    try:
+        cgroup_host_path = Config.get('workers', 'cgroup_host_path')
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        cgroup_host_path = None
+    if cgroup_host_path:
+        mounts.append({'host_path': cgroup_host_path,
+                       'container_path': CGROUP_CONTAINER_PATH,
+                       'format': 'ro'})
+    return mounts
+
+
+def get_worker_auto_remove():
     try:
         auto_remove = Config.get('workers', 'auto_remove')
     except (configparser.NoSectionError, configparser.NoOptionError) as e:
@@ -395,6 +446,44 @@ def run_worker(image,
             auto_remove = True
     elif not auto_remove == True:
         auto_remove = False
+    return auto_remove
+
+
+def get_worker_dict(image, worker_id, cid):
+    """Returns the description of a running worker that is stored in the workers_store."""
+    # TODO - determines worker structure; should be placed in a proper DAO class.
+    return { 'image': image,
+             # @todo - location will need to change to support swarm or cluster
+             'location': dd,
+             'id': worker_id,
+             'cid': cid,
+             'status': READY,
+             'host_id': host_id,
+             'host_ip': host_ip,
+             'last_execution_time': 0,
+             'last_health_check_time': get_current_utc_time() }
+
+
+def run_worker(image,
+               revision,
+               actor_id,
+               worker_id,
+               client_id,
+               client_access_token,
+               client_refresh_token,
+               tenant,
+               api_server,
+               client_secret):
+    """
+    Run an actor executor worker with a given channel and image.
+    :return:
+    """
+    logger.debug("top of run_worker()")
+    command = 'python3 -u /actors/worker.py'
+    logger.debug("docker_utils running worker. actor_id: {}; worker_id: {}; "
+                 "image:{}, revision: {}; command:{}".format(actor_id, worker_id, image, revision, command))
+    mounts = get_worker_mounts(worker_id)
+    auto_remove = get_worker_auto_remove()
     container = run_container_with_docker(
         image=AE_IMAGE,
         command=command,
@@ -416,18 +505,52 @@ def run_worker(image,
             client_secret=client_secret
     )
     # don't catch errors -- if we get an error trying to run a worker, let it bubble up.
-    # TODO - determines worker structure; should be placed in a proper DAO class.
     logger.info("worker container running. worker_id: {}. container: {}".format(worker_id, container))
-    return { 'image': image,
-             # @todo - location will need to change to support swarm or cluster
-             'location': dd,
-             'id': worker_id,
-             'cid': container.get('Id'),
-             'status': READY,
-             'host_id': host_id,
-             'host_ip': host_ip,
-             'last_execution_time': 0,
-             'last_health_check_time': get_current_utc_time() }
+    return get_worker_dict(image, worker_id, container.get('Id'))
+
+
+def run_warm_worker(warm_id, bind_timeout):
+    """
+    Run a worker container that is not yet bound to an actor. The worker waits up to `bind_timeout` seconds for a
+    bind message on the SpawnerWorkerChannel for `warm_id` and exits if none arrives.
+    Returns the container id.
+    """
+    logger.debug(f"top of run_warm_worker(); warm_id: {warm_id}")
+    container = run_container_with_docker(
+        image=AE_IMAGE,
+        command='python3 -u /actors/worker.py',
+        environment={
+            'worker_id': warm_id,
+            '_abaco_warm': 'true',
+            '_abaco_warm_bind_timeout': str(bind_timeout),
+            '_abaco_secret': os.environ.get('_abaco_secret')},
+        mounts=get_worker_mounts(),
+        log_file=None,
+        auto_remove=get_worker_auto_remove(),
+        name='abaco_warm_{}'.format(warm_id))
+    logger.info(f"warm worker container running. warm_id: {warm_id}; container: {container}")
+    return container.get('Id')
+
+
+def container_is_running(cid):
+    """Whether the container with id `cid` exists and is running."""
+    cli = docker.APIClient(base_url=dd, version="auto")
+    try:
+        return cli.inspect_container(cid)['State']['Running']
+    except Exception as e:
+        logger.debug(f"got exception inspecting container {cid}; e: {e}")
+        return False
+
+
+def rename_container(cid, name):
+    cli = docker.APIClient(base_url=dd, version="auto")
+    try:
+        cli.rename(cid, name)
+    except Exception as e:
+        msg = "Got exception trying to rename container {} to {}. Exception: {}".format(cid, name, e)
+        logger.info(msg)
+        raise DockerError(msg)
+
 
 def stop_container(cli, cid):
     """
@@ -447,72 +570,78 @@ def stop_container(cli, cid):
             continue
     raise DockerStopContainerError
 
-def execute_actor(actor_id,
-                  worker_id,
-                  execution_id,
-                  image,
-                  msg,
-                  user=None,
-                  d={},
-                  privileged=False,
-                  mounts=[],
-                  leave_container=False,
-                  fifo_host_path=None,
-                  socket_host_path=None,
-                  mem_limit=None,
-                  max_cpus=None,
-                  tenant=None):
+class ActorConfigsCache(object):
+    """
+    Per-process cache of the resolved and decrypted configs of actors. Every change to a config or an alias bumps
+    the configs generation (see ActorConfig.bump_generation()); the cache is dropped when the generation changes,
+    which is checked at most every CONFIGS_CHECK_INTERVAL seconds.
     """
-    Creates and runs an actor container and supervises the execution, collecting statistics about resource consumption
-    from the Docker daemon.
 
-    :param actor_id: the dbid of the actor; for updating worker status
-    :param worker_id: the worker id; also for updating worker status
-    :param execution_id: the id of the execution.
-    :param image: the actor's image; worker must have already downloaded this image to the local docker registry.
-    :param msg: the message being passed to the actor.
-    :param user: string in the form {uid}:{gid} representing the uid and gid to run the command as.
-    :param d: dictionary representing the environment to instantiate within the actor container.
-    :param privileged: whether this actor is "privileged"; i.e., its container should run in privileged mode with the
-    docker daemon mounted.
-    :param mounts: list of dictionaries representing the mounts to add; each dictionary mount should have 3 keys:
-    host_path, container_path and format (which should have value 'ro' or 'rw').
-    :param fifo_host_path: If not None, a string representing a path on the host to a FIFO used for passing binary data to the actor.
-    :param socket_host_path: If not None, a string representing a path on the host to a socket used for collecting results from the actor.
-    :param mem_limit: The maximum amount of memory the Actor container can use; should be the same format as the --memory Docker flag.
-    :param max_cpus: The maximum number of CPUs each actor will have available to them. Does not guarantee these CPU resources; serves as upper bound.
-    :return: result (dict), logs (str) - `result`: statistics about resource consumption; `logs`: output from docker logs.
+    def __init__(self, check_interval=CONFIGS_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.generation = None
+        self.checked_at = 0
+        self.configs = {}
+        self._lock = threading.Lock()
+
+    def _check_generation(self):
+        if self.generation is not None and time.time() - self.checked_at < self.check_interval:
+            return
+        generation = ActorConfig.get_generation()
+        self.checked_at = time.time()
+        if generation != self.generation:
+            self.generation = generation
+            self.configs = {}
+
+    def get(self, actor_id, tenant):
+        with self._lock:
+            try:
+                self._check_generation()
+            except Exception as e:
+                logger.error(f"could not read the configs generation; not using cached configs. e: {e}")
+                self.generation = None
+                self.configs = {}
+                return resolve_actor_configs(actor_id, tenant)
+            key = (actor_id, tenant)
+            if key not in self.configs:
+                self.configs[key] = resolve_actor_configs(actor_id, tenant)
+            return dict(self.configs[key])
+
+
+_actor_configs_cache = ActorConfigsCache()
+
+
+def get_actor_configs(actor_id, tenant):
     """
-    logger.debug(f"top of execute_actor(); actor_id: {actor_id}; tenant: {tenant} (worker {worker_id};{execution_id})")
+    Returns a dictionary of the configs (see ActorConfig) that apply to an actor, by its id or any of its aliases,
+    with the secret configs decrypted. These are passed to actor containers as the _actor_configs variable.
+    The configs are cached by the worker; see ActorConfigsCache.
+    :param actor_id: the dbid of the actor.
+    """
+    return _actor_configs_cache.get(actor_id, tenant)
 
-    # get any configs for this actor
+def resolve_actor_configs(actor_id, tenant):
+    """
+    Look up and decrypt the configs that apply to an actor; see get_actor_configs(). Aliases are found by the
+    actor_id and tenant index of the alias_store, and configs by the index of their actor_ids.
+    """
     actor_configs = {}
     config_list = []
-    # list of all aliases for the actor
-    alias_list = []
     # the actor_id passed in is the dbid
     actor_human_id = Actor.get_display_id(tenant, actor_id)
-
-    for alias in alias_store.items():
-        logger.debug(f"checking alias: {alias}")
-        if actor_human_id == alias['actor_id'] and tenant == alias['tenant']:
-            alias_list.append(alias['alias'])
+    # list of all aliases for the actor
+    alias_list = [alias['alias'] for alias in alias_store.items({'actor_id': actor_human_id, 'tenant': tenant})]
     logger.debug(f"alias_list: {alias_list}")
-    # loop through configs to look for any that apply to this actor
-    for config in configs_store.items():
-        # first look for the actor_id itself
-        if actor_human_id in config['actors']:
-            logger.debug(f"actor_id matched; adding config {config}")
+    identifiers = [actor_human_id] + alias_list
+    # configs saved before actor_ids was introduced do not have it; they are matched on their actors string, as
+    # before.
+    for config in configs_store.items({'tenant': tenant, 'actor_ids': {'$in': identifiers + [None]}}):
+        if 'actor_ids' in config:
+            logger.debug(f"actor_id or alias matched; adding config {config}")
+            config_list.append(config)
+        elif any(identifier in config['actors'] for identifier in identifiers):
+            logger.debug(f"actor_id or alias matched legacy config; adding config {config}")
             config_list.append(config)
-        else:
-            logger.debug("actor id did not match; checking aliases...")
-            # if we didn't find the actor_id, look for ay of its aliases
-            for alias in alias_list:
-                if alias in config['actors']:
-                    # as soon as we find it, append and get out (only want to add once)
-                    logger.debug(f"alias {alias} matched; adding config: {config}")
-                    config_list.append(config)
-                    break
     logger.debug(f"got config_list: {config_list}")
     # for each config, need to check for secrets and decrypt ---
     for config in config_list:
@@ -528,30 +657,19 @@ def execute_actor(actor_id,
             logger.error(f'something went wrong checking is_secret for config: {config}; e: {e}')
 
     logger.debug(f"final actor configs: {actor_configs}")
-    d['_actor_configs'] = actor_configs
-
+    return actor_configs
 
-    # initially set the global force_quit variable to False
-    globals.force_quit = False
-
-    # initial stats object, environment, binds and volumes
-    result = {'cpu': 0,
-              'io': 0,
-              'runtime': 0 }
-
-    # instantiate docker client
-    cli = docker.APIClient(base_url=dd, version="auto")
-
-    # don't try to pass binary messages through the environment as these can cause
-    # broken pipe errors. the binary data will be passed through the FIFO momentarily.
-    if not fifo_host_path:
-        d['MSG'] = msg
+def get_actor_host_config(cli, privileged=False, mounts=[], mem_limit=None, max_cpus=None):
+    """
+    Returns the docker host config and the list of volumes for an actor container; see execute_actor() for the
+    parameters.
+    """
     binds = {}
     volumes = []
 
     # if container is privileged, mount the docker daemon so that additional
     # containers can be started.
-    logger.debug("privileged: {};(worker {};{})".format(privileged, worker_id, execution_id))
+    logger.debug("privileged: {}".format(privileged))
     if privileged:
         binds = {'/var/run/docker.sock':{
                     'bind': '/var/run/docker.sock',
@@ -579,6 +697,63 @@ def execute_actor(actor_id,
         max_cpus = None
 
     host_config = cli.create_host_config(binds=binds, privileged=privileged, mem_limit=mem_limit, nano_cpus=max_cpus)
+    return host_config, volumes
+
+def execute_actor(actor_id,
+                  worker_id,
+                  execution_id,
+                  image,
+                  msg,
+                  user=None,
+                  d={},
+                  privileged=False,
+                  mounts=[],
+                  leave_container=False,
+                  fifo_host_path=None,
+                  socket_host_path=None,
+                  mem_limit=None,
+                  max_cpus=None,
+                  tenant=None):
+    """
+    Creates and runs an actor container and supervises the execution, collecting statistics about resource consumption
+    from the Docker daemon.
+
+    :param actor_id: the dbid of the actor; for updating worker status
+    :param worker_id: the worker id; also for updating worker status
+    :param execution_id: the id of the execution.
+    :param image: the actor's image; worker must have already downloaded this image to the local docker registry.
+    :param msg: the message being passed to the actor.
+    :param user: string in the form {uid}:{gid} representing the uid and gid to run the command as.
+    :param d: dictionary representing the environment to instantiate within the actor container.
+    :param privileged: whether this actor is "privileged"; i.e., its container should run in privileged mode with the
+    docker daemon mounted.
+    :param mounts: list of dictionaries representing the mounts to add; each dictionary mount should have 3 keys:
+    host_path, container_path and format (which should have value 'ro' or 'rw').
+    :param fifo_host_path: If not None, a string representing a path on the host to a FIFO used for passing binary data to the actor.
+    :param socket_host_path: If not None, a string representing a path on the host to a socket used for collecting results from the actor.
+    :param mem_limit: The maximum amount of memory the Actor container can use; should be the same format as the --memory Docker flag.
+    :param max_cpus: The maximum number of CPUs each actor will have available to them. Does not guarantee these CPU resources; serves as upper bound.
+    :return: result (dict), container_state (dict), exit_code, start_time - `result`: statistics about resource
+    consumption. The logs of the execution are shipped to the logs store while the container runs, and are complete
+    when this function returns.
+    """
+    logger.debug(f"top of execute_actor(); actor_id: {actor_id}; tenant: {tenant} (worker {worker_id};{execution_id})")
+
+    d['_actor_configs'] = get_actor_configs(actor_id, tenant)
+
+    # initial stats object, environment, binds and volumes
+    result = {'cpu': 0,
+              'io': 0,
+              'runtime': 0 }
+
+    # instantiate docker client
+    cli = docker.APIClient(base_url=dd, version="auto")
+
+    # don't try to pass binary messages through the environment as these can cause
+    # broken pipe errors. the binary data will be passed through the FIFO momentarily.
+    if not fifo_host_path:
+        d['MSG'] = msg
+    host_config, volumes = get_actor_host_config(cli, privileged, mounts, mem_limit, max_cpus)
     logger.debug("host_config object created by (worker {};{}).".format(worker_id, execution_id))
 
     # write binary data to FIFO if it exists:
@@ -655,16 +830,20 @@ def execute_actor(actor_id,
 
     # instantiate the results channel:
     results_ch = ExecutionResultsChannel(actor_id, execution_id)
+    # the API waiting on a synchronous execution is notified of its first result; see channels.publish_completion()
+    notify_result = str(d.get('_abaco_synchronous', '')).lower() == 'true'
 
     # create and start the container
     logger.debug("Final container environment: {};(worker {};{})".format(d, worker_id, execution_id))
-    logger.debug("Final binds: {} and host_config: {} for the container.(worker {};{})".format(binds, host_config,
-                                                                                               worker_id, execution_id))
+    logger.debug("Final host_config: {} for the container.(worker {};{})".format(host_config, worker_id, execution_id))
     container = cli.create_container(image=image,
                                      environment=d,
                                      user=user,
                                      volumes=volumes,
                                      host_config=host_config)
+    # watch the container before it starts so that its exit cannot be missed.
+    container_events = get_container_events(dd)
+    watch = container_events.watch(container.get('Id'))
     # get the UTC time stamp
     start_time = get_current_utc_time()
     # start the timer to track total execution time.
@@ -676,49 +855,38 @@ def execute_actor(actor_id,
     except Exception as e:
         # if there was an error starting the container, user will need to debug
         logger.info("Got exception starting actor container: {}; (worker {};{})".format(e, worker_id, execution_id))
+        container_events.unwatch(container.get('Id'))
         raise DockerStartContainerError("Could not start container {}. Exception {}".format(container.get('Id'), str(e)))
 
     # local bool tracking whether the actor container is still running
     running = True
     Execution.update_status(actor_id, execution_id, RUNNING)
 
-    logger.debug("right before creating stats_cli: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                              worker_id, execution_id))
-    # create a separate cli for checking stats objects since these should be fast and we don't want to wait
-    stats_cli = docker.APIClient(base_url=dd, timeout=1, version="auto")
-    logger.debug("right after creating stats_cli: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                             worker_id, execution_id))
-
-    # under load, we can see UnixHTTPConnectionPool ReadTimeout's trying to create the stats_obj
-    # so here we are trying up to 3 times to create the stats object for a possible total of 3s
-    # timeouts
-    ct = 0
-    stats_obj = None
-    logs = None
-    while ct < 3:
-        try:
-            stats_obj = stats_cli.stats(container=container.get('Id'), decode=True)
-            break
-        except ReadTimeout:
-            ct += 1
-        except Exception as e:
-            logger.error("Unexpected exception creating stats_obj. Exception: {}; (worker {};{})".format(e, worker_id,
-                                                                                                         execution_id))
-            # in this case, we need to kill the container since we cannot collect stats;
-            # UPDATE - 07-2018: under load, a errors can occur attempting to create the stats object.
-            # the container could still be running; we need to explicitly check the container status
-            # to be sure.
-    logger.debug("right after attempting to create stats_obj: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                                         worker_id, execution_id))
+    # start sampling the container's resource usage; see container_stats.py
+    logger.debug("right before starting the stats sampler: {}; (worker {};{})".format(timeit.default_timer(),
+                                                                                     worker_id, execution_id))
+    stats_sampler = None
+    try:
+        stats_sampler = get_stats_backend(dd).start(container.get('Id'))
+    except Exception as e:
+        logger.error("Unexpected exception starting the stats sampler. Exception: {}; (worker {};{})".format(e, worker_id,
+                                                                                                     execution_id))
+    logger.debug("right after starting the stats sampler: {}; (worker {};{})".format(timeit.default_timer(),
+                                                                                    worker_id, execution_id))
+    # follow the container's logs, shipping them in chunks as they are produced; see log_shipping.py
+    log_ex = Actor.get_actor_log_ttl(actor_id)
+    log_shipper = Execution.log_shipper(execution_id, actor_id, tenant, log_ex)
+    log_follower = LogFollower(cli, container.get('Id'), log_shipper).start()
     # a counter of the number of iterations through the main "running" loop;
     # this counter is used to determine when less frequent actions, such as log aggregation, need to run.
     loop_idx = 0
-    log_ex = Actor.get_actor_log_ttl(actor_id)
-    while running and not globals.force_quit:
+    # the last time the container was listed to check its status; see CONTAINER_POLL_INTERVAL.
+    last_poll = timeit.default_timer()
+    # a force quit is handled at the bottom of the loop, which stops the container.
+    while running:
         loop_idx += 1
         logger.debug("top of while running loop; loop_idx: {}".format(loop_idx))
         datagram = None
-        stats = None
         try:
             datagram = server.recv(MAX_RESULT_FRAME_SIZE)
         except socket.timeout:
@@ -730,55 +898,33 @@ def execute_actor(actor_id,
         if datagram:
             try:
                 results_ch.put(datagram)
+                if notify_result:
+                    publish_completion(actor_id, execution_id, 'result')
+                    notify_result = False
             except Exception as e:
                 logger.error("Error trying to put datagram on results channel. "
                              "Exception: {}; (worker {};{})".format(e, worker_id, execution_id))
         logger.debug("right after results ch.put: {}; (worker {};{})".format(timeit.default_timer(),
                                                                              worker_id, execution_id))
 
-        # only try to collect stats if we have a stats_obj:
-        if stats_obj:
-            logger.debug("we have a stats_obj; trying to collect stats. (worker {};{})".format(worker_id, execution_id))
-            try:
-                logger.debug("waiting on a stats obj: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                                 worker_id, execution_id))
-                stats = next(stats_obj)
-                logger.debug("got the stats obj: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                            worker_id, execution_id))
-            except StopIteration:
-                # we have read the last stats object - no need for processing
-                logger.debug("Got StopIteration; no stats object. (worker {};{})".format(worker_id, execution_id))
-            except ReadTimeoutError:
-                # this is a ReadTimeoutError from docker, not requests. container is finished.
-                logger.info("next(stats) just timed out: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                                    worker_id, execution_id))
-                # UPDATE - 07-2018: under load, a ReadTimeoutError from the attempt to get a stats object
-                # does NOT imply the container has stopped; we need to explicitly check the container status
-                # to be sure.
-
-        # if we got a stats object, add it to the results; it is possible stats collection timed out and the object
-        # is None
-        if stats:
-            logger.debug("adding stats to results; (worker {};{})".format(worker_id, execution_id))
-            try:
-                result['cpu'] += stats['cpu_stats']['cpu_usage']['total_usage']
-            except KeyError as e:
-                logger.info("Got a KeyError trying to fetch the cpu object: {}; "
-                            "(worker {};{})".format(e, worker_id, execution_id))
-            try:
-                result['io'] += stats['networks']['eth0']['rx_bytes']
-            except KeyError as e:
-                logger.info("Got KeyError exception trying to grab the io object. "
-                            "running: {}; Exception: {}; (worker {};{})".format(running, e, worker_id, execution_id))
+        if stats_sampler:
+            stats_sampler.sample()
 
-        # grab the logs every 5th iteration --
-        if loop_idx % 5 == 0:
-            logs = cli.logs(container.get('Id'))
-            Execution.set_logs(execution_id, logs, actor_id, tenant, worker_id, log_ex)
-            logs = None
+        # ship any buffered logs that are due --
+        log_shipper.maybe_flush()
 
-        # checking the container status to see if it is still running ----
-        if running:
+        # the events stream signals when the container exits ----
+        if running and watch.exited.is_set():
+            logger.debug("container finished, exit code from the events stream: {}; oom killed: {}; "
+                         "(worker {};{})".format(watch.exit_code, watch.oom_killed, worker_id, execution_id))
+            running = False
+            continue
+
+        # checking the container status to see if it is still running; this is only needed when the events stream
+        # is not connected, and otherwise done every CONTAINER_POLL_INTERVAL seconds as a safety net ----
+        poll = not container_events.connected or timeit.default_timer() - last_poll > CONTAINER_POLL_INTERVAL
+        if running and poll:
+            last_poll = timeit.default_timer()
             logger.debug("about to check container status: {}; (worker {};{})".format(timeit.default_timer(),
                                                                                       worker_id, execution_id))
             # we need to wait for the container id to be available
@@ -817,25 +963,34 @@ def execute_actor(actor_id,
                                                                                           worker_id, execution_id))
                 running = False
                 continue
-            else:
-                # container still running; check if a force_quit has been sent OR
-                # we are beyond the max_run_time
-                runtime = timeit.default_timer() - start
-                if globals.force_quit or (max_run_time > 0 and max_run_time < runtime):
-                    logs = cli.logs(container.get('Id'))
-                    if globals.force_quit:
-                        logger.info("issuing force quit: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                               worker_id, execution_id))
-                    else:
-                        logger.info("hit runtime limit: {}; (worker {};{})".format(timeit.default_timer(),
-                                                                               worker_id, execution_id))
-                    cli.stop(container.get('Id'))
-                    running = False
             logger.debug("right after checking container state: {}; (worker {};{})".format(timeit.default_timer(),
                                                                                            worker_id, execution_id))
+        if running:
+            # container still running; check if a force_quit has been sent OR
+            # we are beyond the max_run_time
+            runtime = timeit.default_timer() - start
+            force_quit = globals.force_quit or execution_id in globals.force_quit_executions
+            if force_quit or (max_run_time > 0 and max_run_time < runtime):
+                if force_quit:
+                    logger.info("issuing force quit: {}; (worker {};{})".format(timeit.default_timer(),
+                                                                           worker_id, execution_id))
+                else:
+                    logger.info("hit runtime limit: {}; (worker {};{})".format(timeit.default_timer(),
+                                                                           worker_id, execution_id))
+                cli.stop(container.get('Id'))
+                running = False
     logger.info("container stopped:{}; (worker {};{})".format(timeit.default_timer(), worker_id, execution_id))
     stop = timeit.default_timer()
-    globals.force_quit = False
+    globals.force_quit_executions.discard(execution_id)
+    container_events.unwatch(container.get('Id'))
+    # take the final usage reading right away, while the container's stats are still available; they are gone once
+    # the container is removed below.
+    if stats_sampler:
+        try:
+            result.update(stats_sampler.finish())
+        except Exception as e:
+            logger.error("Got exception finishing the stats sampler: {}; (worker {};{})".format(e, worker_id,
+                                                                                               execution_id))
 
     # get info from container execution, including exit code; Exceptions from any of these commands
     # should not cause the worker to shutdown or prevent starting subsequent actor containers.
@@ -871,10 +1026,13 @@ def execute_actor(actor_id,
                      f"Exception: {e}; (worker {worker_id};{execution_id})")
     logger.debug("right after getting container_info: {}; (worker {};{})".format(timeit.default_timer(),
                                                                                  worker_id, execution_id))
-    # get logs from container
-    if not logs:
-        logs = cli.logs(container.get('Id'))
-    if not logs:
+    # ship the rest of the logs; this must finish before the execution is finalized -- otherwise, there is a race
+    # condition for clients waiting on the execution to be COMPLETE and then immediately retrieving the logs.
+    try:
+        log_follower.finish()
+    except Exception as e:
+        logger.error("Got exception shipping the logs: {}; (worker {};{})".format(e, worker_id, execution_id))
+    if not log_shipper.offset:
         # there are issues where container do not have logs associated with them when they should.
         logger.info("Container id {} had NO logs associated with it. "
                     "(worker {};{})".format(container.get('Id'), worker_id, execution_id))
@@ -958,4 +1116,4 @@ def execute_actor(actor_id,
     result['runtime'] = int(stop - start)
     logger.debug("right after removing fifo; about to return: {}; (worker {};{})".format(timeit.default_timer(),
                                                                                          worker_id, execution_id))
-    return result, logs, container_state, exit_code, start_time
+    return result, container_state, exit_code, start_time
@@ -19,9 +19,8 @@ import time
 from agaveflask.auth import get_api_server
 
 from codes import SUBMITTED
-from channels import ActorMsgChannel, EventsChannel
-from models import Execution
-from stores import actors_store
+from channels import ActorMsgChannel, EventsChannel, signal_enqueued
+from models import Actor, Execution
 
 
 from agaveflask.logs import get_logger
@@ -64,7 +63,7 @@ def process_link(link, msg, d):
     # actor
     logger.debug("top of process_link")
     try:
-        actors_store[link]
+        Actor.from_cache(link)
     except KeyError as e:
         logger.error("Processing event message for actor {} that does not exist. Quiting".format(link))
         raise e
@@ -81,6 +80,7 @@ def process_link(link, msg, d):
     ch = ActorMsgChannel(actor_id=link)
     ch.put_msg(message=msg, d=d)
     ch.close()
+    signal_enqueued(link)
     logger.info("link processed.")
 
 def process_webhook(webhook, msg, d):
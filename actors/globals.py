@@ -7,9 +7,29 @@ Defines global objects used across the platform.
 global keep_running
 keep_running = True
 
-# force_quit can be updated to True through a message sent to the worker on the worker channel to force a running
-# execution to be halted immediately.
+# force_quit is set to True when the worker receives 'stop' (i.e., its actor is being deleted) to halt all of its running
+# executions immediately. The worker exits right after, so it is never reset.
 # The worker thread monitoring the actor executions imports this global and checks it on a regular interval.
 global force_quit
 force_quit = False
 
+# the ids of the executions to halt immediately, added when the worker receives {'force_quit': <execution id>} on its
+# worker channel (see ActorExecutionResource.delete()). Each execution checks for its own id, so the executions running
+# in the other slots of the worker are not affected.
+global force_quit_executions
+force_quit_executions = set()
+
+# the hot containers of the worker, one per execution slot, if its actor has the 'hot' hint (see hot_containers.py);
+# the worker stops them before exiting.
+global hot_containers
+hot_containers = []
+
+# the write-behind queue of the worker, if it uses one (see store.WriteBehindQueue); the worker writes what is still
+# pending before exiting, as its stop path skips atexit handlers.
+global write_behind
+write_behind = None
+
+# the latest revision of the worker's actor, as published on the actor's revision exchange (see
+# channels.publish_revision()); None until a change is received.
+global actor_revision
+actor_revision = None
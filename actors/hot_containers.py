@@ -0,0 +1,388 @@
+"""
+Hot containers: long-lived actor containers that run many executions.
+
+By default, a worker creates, starts, supervises and removes a new actor container for every message (see
+docker_utils.execute_actor()). For actors registered with the 'hot' hint (Actor.HOT_HINT), the worker instead keeps
+one actor container running and delivers successive messages to it over a unix stream socket, mounted in the
+container at /_abaco_hot.sock. The container is recycled -- stopped, removed and replaced on the next message -- after
+[workers] hot_max_executions executions, or as soon as an execution fails at the container level: the container
+exits or closes the socket, or the execution is force quit or exceeds max_run_time.
+
+The protocol. The container connects to the socket when it starts; each frame is a 4-byte, big-endian length followed
+by a UTF-8 encoded JSON object with a 'type':
+  worker -> container:
+    - execute: {'type': 'execute', 'execution_id': ..., 'environment': {...}, 'unset': [...], 'message': ...}
+      `environment` holds the variables of the execution that differ from the environment the container was started
+      with, and `unset` the variables of the latter that the execution does not have. Binary messages are passed
+      base64 encoded, as 'message_b64' instead of 'message'.
+  container -> worker, for the current execution:
+    - log: {'type': 'log', 'data': <str>} -- appended to the logs of the execution;
+    - result: {'type': 'result', 'data': <base64>} -- put on the results channel of the execution;
+    - complete: {'type': 'complete', 'exit_code': <int>} -- the execution has finished.
+The container finds the socket with the _abaco_hot_socket environment variable and should exit when the worker
+closes it; see samples/hot_py3 for a Python runtime implementing the container side.
+
+Each execution still gets its own execution record, logs, results and stats: cpu and io are the usage of the
+container during the execution, while memory_peak is the peak of the container since it started.
+"""
+import base64
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import timeit
+
+import docker
+
+from channels import ExecutionResultsChannel, publish_completion
+from codes import RUNNING
+from config import Config
+from container_stats import get_stats_backend, usage_delta
+from docker_utils import DockerStartContainerError, dd, get_actor_configs, get_actor_host_config, max_run_time, \
+    stop_container
+import globals
+from models import Actor, Execution, get_current_utc_time
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+# where the hot container socket is mounted in the actor container.
+HOT_SOCKET_CONTAINER_PATH = '/_abaco_hot.sock'
+
+# every frame starts with its length, as a 4-byte big-endian unsigned integer.
+FRAME_HEADER = struct.Struct('>I')
+
+# max size, in bytes, of a single frame.
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# timeout (in seconds) for reading a frame; this is how often the supervision loop runs during an execution.
+FRAME_TIMEOUT = 0.1
+
+# how often (in seconds) the resource usage of a hot container is sampled.
+SAMPLE_INTERVAL = 0.5
+
+
+def _get_config(option, default, typ=int):
+    try:
+        return typ(Config.get('workers', option))
+    except Exception:
+        return default
+
+def send_frame(sock, frame):
+    data = json.dumps(frame).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+class FrameReader(object):
+    """Reads frames from a socket with a timeout, keeping partial frames between reads."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = bytearray()
+
+    def _pop(self):
+        if len(self._buffer) < FRAME_HEADER.size:
+            return None
+        length = FRAME_HEADER.unpack_from(self._buffer)[0]
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"frame of {length} bytes exceeds the maximum frame size.")
+        end = FRAME_HEADER.size + length
+        if len(self._buffer) < end:
+            return None
+        data = bytes(self._buffer[FRAME_HEADER.size:end])
+        del self._buffer[:end]
+        return json.loads(data.decode('utf-8'))
+
+    def next(self):
+        """
+        Return the next frame, or None if no whole frame arrived before the socket timed out. Raises EOFError when the
+        other end closed the socket.
+        """
+        while True:
+            frame = self._pop()
+            if frame is not None:
+                return frame
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise EOFError("hot container closed the socket.")
+            self._buffer += data
+
+
+def format_environment(environment):
+    """The environment as the actor container sees it: values are strings and None values are dropped."""
+    return {k: v if isinstance(v, str) else str(v) for k, v in environment.items() if v is not None}
+
+
+class HotContainer(object):
+    """
+    A long-lived actor container of a worker. execute() starts the container if needed and runs an execution in it,
+    returning the same values as docker_utils.execute_actor(); close() stops and removes the container.
+    """
+
+    def __init__(self, actor_id, worker_id, image, user=None, privileged=False, mounts=[], leave_container=False,
+                 mem_limit=None, max_cpus=None, tenant=None, max_executions=None, start_timeout=None, slot=0):
+        self.actor_id = actor_id
+        self.worker_id = worker_id
+        self.image = image
+        self.user = user
+        self.privileged = privileged
+        self.mounts = list(mounts)
+        self.leave_container = leave_container
+        self.mem_limit = mem_limit
+        self.max_cpus = max_cpus
+        self.tenant = tenant
+        self.max_executions = max_executions or _get_config('hot_max_executions', 100)
+        self.start_timeout = start_timeout or _get_config('hot_start_timeout', 60, float)
+        # workers running concurrent executions have a hot container per slot.
+        self.socket_host_path = os.path.join(Config.get('workers', 'socket_host_path_dir'), worker_id,
+                                             f'hot_{slot}.sock')
+        self.cli = docker.APIClient(base_url=dd, version="auto")
+        self.cid = None
+        # the environment the container was started with.
+        self.environment = None
+        # the number of executions run by the current container.
+        self.executions = 0
+        self._server = None
+        self._conn = None
+        self._reader = None
+        self._sampler = None
+        self._sampling = None
+
+    @property
+    def expired(self):
+        """Whether the container has run hot_max_executions executions and should be recycled."""
+        return self.executions >= self.max_executions
+
+    def start(self, environment):
+        """Create and start the container with `environment` and wait for it to connect to the socket."""
+        logger.info(f"starting hot container for actor {self.actor_id}; worker {self.worker_id}")
+        try:
+            os.unlink(self.socket_host_path)
+        except FileNotFoundError:
+            pass
+        try:
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(self.socket_host_path)
+            os.chmod(self.socket_host_path, 0o777)
+            self._server.listen(1)
+            self._server.settimeout(self.start_timeout)
+        except Exception as e:
+            self.close()
+            raise DockerStartContainerError(f"Could not create the hot container socket at {self.socket_host_path}; "
+                                            f"exception: {e}")
+        self.environment = dict(environment)
+        mounts = self.mounts + [{'host_path': self.socket_host_path,
+                                 'container_path': HOT_SOCKET_CONTAINER_PATH,
+                                 'format': 'rw'}]
+        host_config, volumes = get_actor_host_config(self.cli, self.privileged, mounts, self.mem_limit, self.max_cpus)
+        try:
+            container = self.cli.create_container(image=self.image,
+                                                  environment=dict(self.environment,
+                                                                   _abaco_hot_socket=HOT_SOCKET_CONTAINER_PATH),
+                                                  user=self.user,
+                                                  volumes=volumes,
+                                                  host_config=host_config)
+            self.cid = container.get('Id')
+            self.cli.start(container=self.cid)
+        except Exception as e:
+            logger.info(f"Got exception starting hot container: {e}; worker {self.worker_id}")
+            self.close()
+            raise DockerStartContainerError(f"Could not start hot container. Exception {e}")
+        try:
+            self._conn, _ = self._server.accept()
+        except socket.timeout:
+            self.close()
+            raise DockerStartContainerError(f"Hot container did not connect to {HOT_SOCKET_CONTAINER_PATH} within "
+                                            f"{self.start_timeout} seconds; does the image speak the hot container "
+                                            f"protocol?")
+        self._conn.settimeout(FRAME_TIMEOUT)
+        self._reader = FrameReader(self._conn)
+        self.executions = 0
+        try:
+            self._sampler = get_stats_backend(dd).start(self.cid)
+            self._sampling = threading.Event()
+            threading.Thread(target=self._sample, args=(self._sampler, self._sampling), daemon=True).start()
+        except Exception as e:
+            logger.error(f"Unexpected exception starting the stats sampler for hot container {self.cid}; e: {e}")
+            self._sampler = None
+        logger.info(f"hot container {self.cid} connected; worker {self.worker_id}")
+
+    @staticmethod
+    def _sample(sampler, stopped):
+        # samplers of the docker stats stream block until the next stats object, so they are not sampled on the
+        # critical path of the executions.
+        while not stopped.is_set():
+            try:
+                sampler.sample()
+            except Exception as e:
+                logger.info(f"Got exception sampling hot container usage; e: {e}")
+            time.sleep(SAMPLE_INTERVAL)
+
+    def _usage(self):
+        if not self._sampler:
+            return {'cpu': 0, 'io': 0, 'memory_peak': None}
+        return self._sampler.finish()
+
+    def _execute_frame(self, execution_id, msg, environment):
+        frame = {'type': 'execute',
+                 'execution_id': execution_id,
+                 'environment': {k: v for k, v in environment.items() if self.environment.get(k) != v},
+                 'unset': [k for k in self.environment if k not in environment]}
+        if isinstance(msg, bytes):
+            frame['message_b64'] = base64.b64encode(msg).decode('ascii')
+        else:
+            frame['message'] = msg
+        return frame
+
+    def _exit_code(self):
+        try:
+            return self.cli.inspect_container(self.cid)['State']['ExitCode']
+        except Exception as e:
+            logger.error(f"Could not determine ExitCode for hot container {self.cid}; exception: {e}")
+            return 'undetermined'
+
+    def execute(self, execution_id, msg, environment):
+        """
+        Run an execution in the container, starting one if needed; see execute_actor() for the parameters and return
+        values.
+        """
+        logger.debug(f"top of HotContainer.execute(); (worker {self.worker_id};{execution_id})")
+        actor_id = self.actor_id
+        environment = dict(environment)
+        environment['_actor_configs'] = get_actor_configs(actor_id, self.tenant)
+        # binary messages are sent in the execute frame.
+        if not isinstance(msg, bytes):
+            environment['MSG'] = msg
+        environment = format_environment(environment)
+        # a container that exited while idle is replaced once.
+        for attempt in (1, 2):
+            if not self.cid:
+                self.start(environment)
+            try:
+                send_frame(self._conn, self._execute_frame(execution_id, msg, environment))
+                break
+            except OSError as e:
+                logger.info(f"Could not send execution {execution_id} to hot container {self.cid}; recycling it. "
+                            f"exception: {e}")
+                self.close()
+                if attempt == 2:
+                    raise DockerStartContainerError(f"Could not send execution to hot container. Exception {e}")
+        self.executions += 1
+
+        start_time = get_current_utc_time()
+        start = timeit.default_timer()
+        Execution.update_status(actor_id, execution_id, RUNNING)
+        before = self._usage()
+        log_ex = Actor.get_actor_log_ttl(actor_id)
+        log_shipper = Execution.log_shipper(execution_id, actor_id, self.tenant, log_ex)
+        results_ch = ExecutionResultsChannel(actor_id, execution_id)
+        # the API waiting on a synchronous execution is notified of its first result; see channels.publish_completion()
+        notify_result = environment.get('_abaco_synchronous', '').lower() == 'true'
+        exit_code = 'undetermined'
+        # why the container has to be recycled, if it does.
+        failure = None
+        while True:
+            try:
+                frame = self._reader.next()
+            except (EOFError, OSError, ValueError) as e:
+                failure = e
+                break
+            if frame:
+                kind = frame.get('type')
+                if kind == 'complete':
+                    exit_code = frame.get('exit_code', 0)
+                    break
+                elif kind == 'log':
+                    log_shipper.write(frame.get('data', ''))
+                elif kind == 'result':
+                    try:
+                        results_ch.put(base64.b64decode(frame.get('data', '')))
+                        if notify_result:
+                            publish_completion(actor_id, execution_id, 'result')
+                            notify_result = False
+                    except Exception as e:
+                        logger.error(f"Error trying to put result on results channel. Exception: {e}; "
+                                     f"(worker {self.worker_id};{execution_id})")
+                else:
+                    logger.info(f"ignoring unknown frame type {kind} from hot container {self.cid}.")
+            log_shipper.maybe_flush()
+            runtime = timeit.default_timer() - start
+            force_quit = globals.force_quit or execution_id in globals.force_quit_executions
+            if force_quit or (max_run_time > 0 and max_run_time < runtime):
+                failure = 'force quit' if force_quit else 'runtime limit'
+                logger.info(f"issuing {failure} to hot container {self.cid}; (worker {self.worker_id};{execution_id})")
+                # stop_container raises a DockerStopContainerError if the container could not be stopped; it is
+                # handled by the worker.
+                stop_container(self.cli, self.cid)
+                break
+        stop = timeit.default_timer()
+        globals.force_quit_executions.discard(execution_id)
+        finish_time = get_current_utc_time()
+
+        result = usage_delta(before, self._usage())
+        result['runtime'] = int(stop - start)
+        if failure:
+            logger.info(f"execution {execution_id} failed in hot container {self.cid}: {failure}; recycling it. "
+                        f"(worker {self.worker_id})")
+            # the container stops on its own once it has closed the socket.
+            try:
+                self.cli.stop(self.cid)
+            except Exception as e:
+                logger.error(f"Got exception stopping hot container {self.cid}; e: {e}")
+            exit_code = self._exit_code()
+            self.close()
+        try:
+            log_shipper.close()
+        except Exception as e:
+            logger.error(f"Got exception shipping the logs: {e}; (worker {self.worker_id};{execution_id})")
+        # check if the length of the results channel is empty and if so, delete it --
+        try:
+            if len(results_ch._queue._queue) == 0:
+                results_ch.delete()
+            else:
+                results_ch.close()
+        except Exception as e:
+            logger.warn(f"Got exception trying to clean up the results_ch, swallowing it; Exception: {e}")
+        container_state = {'Status': 'exited' if failure else 'running',
+                           'ExitCode': exit_code,
+                           'StartedAt': start_time,
+                           'FinishedAt': finish_time,
+                           'hot_container': self.cid}
+        return result, container_state, exit_code, start_time
+
+    def close(self):
+        """Stop and remove the container (unless leave_containers is set), and remove the socket."""
+        if self._sampling:
+            self._sampling.set()
+            self._sampling = None
+        self._sampler = None
+        for sock in (self._conn, self._server):
+            if sock:
+                try:
+                    sock.close()
+                except Exception:
+                    pass
+        self._conn = self._server = self._reader = None
+        if self.cid:
+            # the container exits once its socket is closed; stop() kills it if it does not.
+            try:
+                self.cli.stop(self.cid)
+            except Exception as e:
+                logger.error(f"Got exception stopping hot container {self.cid}; e: {e}")
+            if not self.leave_container:
+                try:
+                    self.cli.remove_container(container=self.cid, force=True)
+                    logger.info(f"hot container {self.cid} removed. worker {self.worker_id}")
+                except Exception as e:
+                    logger.error(f"Got exception removing hot container {self.cid}; e: {e}")
+            self.cid = None
+        try:
+            os.unlink(self.socket_host_path)
+        except OSError:
+            pass
+        self.executions = 0
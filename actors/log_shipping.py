@@ -0,0 +1,331 @@
+"""
+Incremental, append-only shipping of execution logs.
+
+The log of an execution is stored as a sequence of chunks in the log_chunks_store, each holding the bytes at
+[offset, offset + length) of the log, plus a summary document in the logs_store (keyed by the execution id) with the
+number of chunks, the total length and whether the log was truncated or is complete. Chunks are only ever inserted,
+so the bytes written to the stores are the bytes the actor produced, no matter how long the execution runs.
+
+The worker follows the docker logs stream of the actor container (see LogFollower) and writes what it reads to a
+LogShipper, which flushes a chunk every `flush_interval` seconds or once `chunk_size` bytes are buffered.
+Chunks are optionally compressed with zstd ([logs] compression config; requires the zstandard package).
+
+read_logs() reassembles a log, or a byte range of it, from the chunks, and tail_logs() follows a log as it is
+shipped. Logs written before chunking was introduced are stored as a single 'logs' field of the summary document and
+are still returned. The executions of a batch (see batching.py) share the log of the batch's first execution: their
+summary documents only hold a 'batch' field with its id (see link_logs()).
+"""
+import threading
+import time
+
+from bson.binary import Binary
+
+from config import Config
+from stores import log_chunks_store, logs_store
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TRUNCATED_MESSAGE = b" LOG LIMIT EXCEEDED; this execution log was TRUNCATED!"
+
+
+def _get_config(option, default, typ=str):
+    try:
+        return typ(Config.get('logs', option))
+    except Exception:
+        return default
+
+def get_compression():
+    """Return the compression to use for new chunks: 'zstd' or None."""
+    compression = _get_config('compression', 'none').lower()
+    if compression == 'zstd':
+        if zstandard:
+            return 'zstd'
+        logger.error("log compression is set to zstd but the zstandard package is not installed; "
+                     "storing logs uncompressed.")
+    return None
+
+def encode_chunk(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+def decode_chunk(data, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def _incomplete_utf8_tail(data):
+    """Return the number of bytes at the end of `data` that are the start of an incomplete UTF-8 character."""
+    for i in range(1, min(4, len(data)) + 1):
+        b = data[-i]
+        if b & 0xC0 == 0x80:
+            # a continuation byte; keep looking for the lead byte.
+            continue
+        if b & 0xE0 == 0xC0:
+            needed = 2
+        elif b & 0xF0 == 0xE0:
+            needed = 3
+        elif b & 0xF8 == 0xF0:
+            needed = 4
+        else:
+            needed = 1
+        return i if needed > i else 0
+    return 0
+
+def _to_bytes(logs):
+    if logs is None:
+        return b''
+    if isinstance(logs, str):
+        return logs.encode('utf-8')
+    return logs
+
+
+class LogShipper(object):
+    """
+    Ships the log of one execution as append-only chunks. write() may be called from any thread; chunks are flushed
+    by write() and maybe_flush() when they are due, and by close().
+    """
+
+    def __init__(self, execution_id, actor_id, tenant, log_ex, max_length, compression=None,
+                 chunk_size=None, flush_interval=None):
+        self.execution_id = execution_id
+        self.actor_id = actor_id
+        self.tenant = tenant
+        self.log_ex = log_ex
+        self.max_length = max_length
+        self.compression = compression
+        self.chunk_size = chunk_size or _get_config('chunk_size', 256 * 1024, int)
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            _get_config('flush_interval', 1.0, float)
+        # offset of the next byte to be shipped; i.e., the number of bytes shipped so far.
+        self.offset = 0
+        self.seq = 0
+        self.truncated = False
+        self.closed = False
+        self._buffer = bytearray()
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        data = _to_bytes(data)
+        with self._lock:
+            if self.truncated or self.closed or not data:
+                return
+            room = self.max_length - self.offset - len(self._buffer)
+            if len(data) > room:
+                logger.info(f"truncating log for execution: {self.execution_id}")
+                self._buffer += data[:max(room, 0)] + TRUNCATED_MESSAGE
+                self.truncated = True
+            else:
+                self._buffer += data
+            if self.truncated or len(self._buffer) >= self.chunk_size:
+                self._flush(final=self.truncated)
+
+    def maybe_flush(self):
+        """Flush the buffered bytes if the flush interval has passed."""
+        with self._lock:
+            if self._buffer and time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def close(self):
+        """Flush anything buffered and mark the log complete."""
+        with self._lock:
+            self._flush(final=True)
+            self.closed = True
+            self._update_summary()
+
+    def _update_summary(self):
+        logs_store.update_fields(self.execution_id,
+                                 {'actor_id': self.actor_id,
+                                  'tenant': self.tenant,
+                                  'chunks': self.seq,
+                                  'length': self.offset,
+                                  'truncated': self.truncated,
+                                  'complete': self.closed},
+                                 upsert=True,
+                                 log_ex=self.log_ex)
+
+    def _flush(self, final=False):
+        self._last_flush = time.time()
+        # a character split across two writes is kept whole, in the next chunk.
+        keep = 0 if final else _incomplete_utf8_tail(self._buffer)
+        if len(self._buffer) <= keep:
+            return
+        data = bytes(self._buffer[:len(self._buffer) - keep])
+        self._buffer = self._buffer[len(self._buffer) - keep:]
+        chunk = {'execution_id': self.execution_id,
+                 'actor_id': self.actor_id,
+                 'tenant': self.tenant,
+                 'seq': self.seq,
+                 'offset': self.offset,
+                 'length': len(data),
+                 'end': self.offset + len(data)}
+        text = None
+        if not self.compression:
+            try:
+                text = data.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        if text is not None:
+            # uncompressed text chunks are stored as text so that they can be found by the full-text log search.
+            chunk['logs'] = text
+        else:
+            chunk['encoding'] = self.compression
+            chunk['data'] = Binary(encode_chunk(data, self.compression))
+        start_timer = time.time()
+        log_chunks_store.update_fields(f'{self.execution_id}_{self.seq}', chunk, upsert=True, log_ex=self.log_ex)
+        self.seq += 1
+        self.offset += len(data)
+        self._update_summary()
+        ms = (time.time() - start_timer) * 1000
+        if ms > 2500:
+            logger.critical(f"LogShipper._flush took {ms} to run for execution: {self.execution_id}.")
+
+
+class LogFollower(object):
+    """
+    Follows the docker logs stream of a container in a background thread, writing what it reads to a LogShipper.
+    The stream ends when the container exits.
+    """
+
+    def __init__(self, cli, cid, shipper):
+        self.cli = cli
+        self.cid = cid
+        self.shipper = shipper
+        self.error = None
+        self._stream = None
+        # set by finish(); the follower thread checks it under _lock before every write, so it writes nothing once set.
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self._stream = self.cli.logs(self.cid, stream=True, follow=True)
+            for data in self._stream:
+                with self._lock:
+                    if self._stopped:
+                        return
+                    self.shipper.write(data)
+        except Exception as e:
+            if self._stopped:
+                # the stream was closed by finish().
+                return
+            logger.error(f"Got exception following the logs of container {self.cid}; e: {e}")
+            self.error = e
+
+    def finish(self, timeout=5):
+        """
+        Wait for the stream to end and ship what has not been shipped. If the stream failed or did not end in time,
+        the follower is stopped and the rest of the log is fetched from docker.
+        """
+        self._thread.join(timeout)
+        ended = not self._thread.is_alive()
+        with self._lock:
+            self._stopped = True
+        if not ended:
+            try:
+                if self._stream is not None:
+                    self._stream.close()
+            except Exception as e:
+                logger.info(f"Got exception closing the logs stream of container {self.cid}; e: {e}")
+            self._thread.join(timeout)
+        if self.error or not ended:
+            try:
+                logs = _to_bytes(self.cli.logs(self.cid))
+                with self.shipper._lock:
+                    shipped = self.shipper.offset + len(self.shipper._buffer)
+                self.shipper.write(logs[shipped:])
+            except Exception as e:
+                logger.error(f"Got exception fetching the logs of container {self.cid}; e: {e}")
+        self.shipper.close()
+
+
+def read_logs(execution_id, start=0, end=None):
+    """
+    Return the bytes [start, end) of the log of an execution, along with the summary document of the log.
+    Raises KeyError if the execution has no log.
+    """
+    summary = logs_store[execution_id]
+    if summary.get('batch'):
+        return read_logs(summary['batch'], start, end)
+    if 'logs' in summary:
+        # a log stored before logs were shipped in chunks.
+        logs = _to_bytes(summary['logs'])
+        summary['length'] = len(logs)
+        summary['complete'] = True
+        return logs[start:end], summary
+    query = {'execution_id': execution_id}
+    if start:
+        query['end'] = {'$gt': start}
+    if end is not None:
+        query['offset'] = {'$lt': end}
+    chunks = sorted(log_chunks_store.items(query), key=lambda c: c['seq'])
+    data = bytearray()
+    data_start = None
+    for chunk in chunks:
+        if data_start is None:
+            data_start = chunk['offset']
+        if 'data' in chunk:
+            data += decode_chunk(chunk['data'], chunk.get('encoding'))
+        else:
+            data += chunk['logs'].encode('utf-8')
+    if data_start is None:
+        return b'', summary
+    lo = start - data_start
+    hi = None if end is None else end - data_start
+    return bytes(data[lo:hi]), summary
+
+
+def tail_logs(execution_id, since=0, is_finished=None, poll_interval=0.5, max_time=None):
+    """
+    Generator yielding (offset, data) tuples with the bytes of the log of an execution from offset `since` on, as
+    they are shipped. Ends once the log is complete, once `is_finished()` returns True (e.g., when the worker died
+    before completing the log) or after `max_time` seconds.
+    """
+    cursor = since
+    start = time.time()
+    finished = False
+    while True:
+        try:
+            data, summary = read_logs(execution_id, cursor)
+        except KeyError:
+            data, summary = b'', {}
+        if data:
+            yield cursor, data
+            cursor += len(data)
+        if finished or (summary.get('complete') and cursor >= summary.get('length', 0)):
+            return
+        if max_time and time.time() - start > max_time:
+            return
+        time.sleep(poll_interval)
+        # read one last time once the execution has finished, to get the chunks shipped in the meantime.
+        finished = bool(is_finished and is_finished())
+
+
+def link_logs(execution_id, batch_id, actor_id, tenant, log_ex):
+    """Make the log of the execution `batch_id`, which ran it in the same batch, the log of an execution."""
+    logs_store.update_fields(execution_id,
+                             {'actor_id': actor_id,
+                              'tenant': tenant,
+                              'batch': batch_id},
+                             upsert=True,
+                             log_ex=log_ex)
+
+
+def delete_logs(execution_id):
+    log_chunks_store.delete_many({'execution_id': execution_id})
+    try:
+        del logs_store[execution_id]
+    except KeyError:
+        pass
@@ -0,0 +1,358 @@
+"""
+Asyncio (ASGI) server for the messages API.
+
+Under gunicorn's sync workers, each synchronous execution (POST /actors/<id>/messages?_abaco_synchronous=true)
+holds a whole worker process until the execution finishes. This server runs the same Flask messages API (so the
+routes, auth and validation are those of message_api.py) in a small thread pool, but a synchronous POST does not
+wait in its thread: AsyncMessagesResource subscribes to the execution's completion notification, queues the message
+and hands the execution back to the event loop, which awaits the notification and only then builds the response
+(MessagesResource.synch_response) in the thread pool again. Thousands of synchronous executions can therefore be
+awaited by a handful of processes.
+
+Completion notifications are received with aio-pika on a single exclusive queue per process, bound to the
+completion exchange (see channels.publish_completion) once per pending execution. As a safety net for workers that
+stop without notifying, the status of all pending executions is checked with a single motor query every
+[web] sync_check_interval seconds.
+
+Run with:
+    uvicorn --workers 4 --host 0.0.0.0 --port 5000 message_aio:app
+"""
+import asyncio
+import concurrent.futures
+import io
+import sys
+import threading
+import urllib.parse
+import uuid
+
+import cloudpickle
+
+from codes import COMPLETE, ERROR
+from config import Config
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+# WSGI environ keys used to pass state between the Flask app and the ASGI server.
+COMPLETIONS_KEY = 'abaco.completions'
+PENDING_KEY = 'abaco.pending_sync'
+
+
+def _get_config(option, default, typ=int):
+    try:
+        return typ(Config.get('web', option))
+    except Exception:
+        return default
+
+
+class Completions(object):
+    """
+    Futures for the completion notifications of the synchronous executions pending in this process, keyed by
+    '<actor dbid>_<execution id>'. Notifications are delivered with resolve(); subclasses receive them from a broker.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, key):
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[key] = fut
+        return fut
+
+    async def unsubscribe(self, key):
+        self._waiters.pop(key, None)
+
+    def pending(self):
+        return list(self._waiters.keys())
+
+    def resolve(self, key, notification):
+        fut = self._waiters.get(key)
+        if fut and not fut.done():
+            fut.set_result(notification)
+
+
+class AioCompletions(Completions):
+    """Completions received from the completion exchange with aio-pika."""
+
+    def __init__(self, uri=None):
+        super().__init__()
+        self.uri = uri or Config.get('rabbit', 'uri')
+        self._connection = None
+        self._exchange = None
+        self._queue = None
+
+    async def start(self):
+        import aio_pika
+        from channels import COMPLETION_EXCHANGE
+        self._connection = await aio_pika.connect_robust(self.uri)
+        channel = await self._connection.channel()
+        self._exchange = await channel.declare_exchange(COMPLETION_EXCHANGE, aio_pika.ExchangeType.DIRECT,
+                                                        durable=True)
+        self._queue = await channel.declare_queue('completion_aio_{}'.format(uuid.uuid4().hex), exclusive=True,
+                                                  auto_delete=True)
+        await self._queue.consume(self._on_message, no_ack=True)
+
+    async def stop(self):
+        if self._connection:
+            await self._connection.close()
+
+    async def _on_message(self, message):
+        try:
+            self.resolve(message.routing_key, cloudpickle.loads(message.body))
+        except Exception as e:
+            logger.error(f"Got exception processing completion notification; e: {e}")
+
+    async def subscribe(self, key):
+        fut = await super().subscribe(key)
+        await self._queue.bind(self._exchange, routing_key=key)
+        return fut
+
+    async def unsubscribe(self, key):
+        await super().unsubscribe(key)
+        try:
+            await self._queue.unbind(self._exchange, routing_key=key)
+        except Exception as e:
+            logger.error(f"Got exception unbinding completion key {key}; e: {e}")
+
+
+class MotorStatusChecker(object):
+    """Reads the status of many executions with a single motor query."""
+
+    def __init__(self):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from stores import executions_store, mongo_password, mongo_user
+        # same connection settings as the synchronous stores; see store.MongoStore
+        host = Config.get('store', 'mongo_host')
+        port = Config.getint('store', 'mongo_port')
+        mongo_uri = 'mongodb://{}:{}'.format(host, port)
+        if mongo_user and mongo_password:
+            mongo_uri = 'mongodb://{}:{}@{}:{}'.format(urllib.parse.quote_plus(mongo_user),
+                                                       urllib.parse.quote_plus(mongo_password), host, port)
+        client = AsyncIOMotorClient(mongo_uri)
+        self._collection = client[executions_store._mongo_database.name][executions_store._db.name]
+
+    async def __call__(self, keys):
+        """Return a dictionary mapping each of the execution `keys` that was found to its status."""
+        statuses = {}
+        async for doc in self._collection.find({'_id': {'$in': keys}}, {'status': True}):
+            statuses[doc['_id']] = doc.get('status')
+        return statuses
+
+
+class Subscription(object):
+    """Handed to the Flask view as its completion channel; see AsyncMessagesResource."""
+
+    def __init__(self, server, key, future):
+        self.server = server
+        self.key = key
+        self.future = future
+
+    def close(self):
+        # only called from the Flask thread when the message could not be queued.
+        asyncio.run_coroutine_threadsafe(self.server.completions.unsubscribe(self.key), self.server.loop)
+
+
+class AsyncMessageServer(object):
+    """
+    ASGI application running the WSGI app `wsgi_app` in a thread pool and awaiting the synchronous executions it
+    parks in the environ (see AsyncMessagesResource) on the event loop.
+     `result_response(dbid, execution_id)` builds the (status, headers, body) of the response to a finished
+     synchronous execution; it is called in the thread pool.
+     `check_status(keys)`, if passed, is a coroutine function returning the statuses of the executions `keys`; it is
+     called for the pending executions every `check_interval` seconds.
+    """
+
+    def __init__(self, wsgi_app, completions, result_response, check_status=None, threads=None,
+                 check_interval=None):
+        self.wsgi_app = wsgi_app
+        self.completions = completions
+        self.result_response = result_response
+        self.check_status = check_status
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads or _get_config('aio_threads', 32))
+        self.check_interval = check_interval or _get_config('sync_check_interval', 30, float)
+        self.loop = None
+        self._started = None
+        self._checker = None
+
+    async def startup(self):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._startup())
+        await self._started
+
+    async def _startup(self):
+        self.loop = asyncio.get_running_loop()
+        await self.completions.start()
+        if self.check_status:
+            self._checker = asyncio.ensure_future(self._check_pending())
+
+    async def shutdown(self):
+        if self._checker:
+            self._checker.cancel()
+        await self.completions.stop()
+        self.executor.shutdown(wait=False)
+
+    async def _check_pending(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            keys = self.completions.pending()
+            if not keys:
+                continue
+            try:
+                statuses = await self.check_status(keys)
+            except Exception as e:
+                logger.error(f"Got exception checking the status of pending executions; e: {e}")
+                continue
+            for key in keys:
+                status = statuses.get(key, ERROR)
+                if status in (COMPLETE, ERROR):
+                    logger.info(f"execution {key} finished without a notification; status: {status}")
+                    self.completions.resolve(key, {'event': status})
+
+    def subscribe_threadsafe(self, dbid, execution_id):
+        """Subscribe to the completion of an execution from a thread of the pool; returns a Subscription."""
+        key = '{}_{}'.format(dbid, execution_id)
+        future = asyncio.run_coroutine_threadsafe(self.completions.subscribe(key), self.loop).result()
+        return Subscription(self, key, future)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        await self.startup()
+        body = bytearray()
+        while True:
+            event = await receive()
+            body += event.get('body', b'')
+            if not event.get('more_body'):
+                break
+        environ = self._environ(scope, bytes(body))
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(self.executor, self._call_wsgi, environ)
+        pending = environ.get(PENDING_KEY)
+        if pending:
+            dbid, execution_id, subscription = pending
+            try:
+                notification = await subscription.future
+                logger.debug(f"got completion notification: {notification}")
+            finally:
+                await self.completions.unsubscribe(subscription.key)
+            status, headers, content = await loop.run_in_executor(self.executor, self.result_response,
+                                                                  dbid, execution_id)
+        await send({'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            event = await receive()
+            if event['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif event['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            COMPLETIONS_KEY: self,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'CONTENT_LENGTH':
+                continue
+            else:
+                key = 'HTTP_{}'.format(name)
+                environ[key] = '{},{}'.format(environ[key], value) if key in environ else value
+        return environ
+
+    def _call_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], content
+
+
+def create_app():
+    """Create the ASGI messages API server backed by RabbitMQ and MongoDB."""
+    from flask import g, make_response, request
+    from controllers import MessagesResource
+    import message_api
+
+    class AsyncMessagesResource(MessagesResource):
+        """MessagesResource whose synchronous executions are awaited by the AsyncMessageServer."""
+
+        def subscribe_completion(self, dbid, execution_id):
+            server = request.environ.get(COMPLETIONS_KEY)
+            if not server:
+                return super().subscribe_completion(dbid, execution_id)
+            return server.subscribe_threadsafe(dbid, execution_id)
+
+        def do_synch_message(self, execution_id, completion_ch):
+            if not isinstance(completion_ch, Subscription):
+                return super().do_synch_message(execution_id, completion_ch)
+            # hand the execution to the event loop; this placeholder response is never sent.
+            request.environ[PENDING_KEY] = (g.db_id, execution_id, completion_ch)
+            return make_response('', 202)
+
+    flask_app = message_api.create_app(AsyncMessagesResource)
+
+    def result_response(dbid, execution_id):
+        with flask_app.app_context():
+            response = MessagesResource.synch_response(dbid, execution_id)
+            return response.status, list(response.headers.items()), response.get_data()
+
+    return AsyncMessageServer(flask_app, AioCompletions(), result_response,
+                              check_status=MotorStatusChecker())
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+async def app(scope, receive, send):
+    """ASGI entrypoint; the server is created on first use so that each uvicorn worker process gets its own."""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    await _app(scope, receive, send)
@@ -1,27 +1,35 @@
 from flask import Flask
-from flask_cors import CORS 
+from flask_cors import CORS
 
 from agaveflask.utils import AgaveApi, handle_error
 
 from auth import authn_and_authz
-from controllers import MessagesResource
+from controllers import MessagesResource, MessagesBatchResource
 
-app = Flask(__name__)
-CORS(app)
-api = AgaveApi(app)
 
-# Authn/z
-@app.before_request
-def auth():
-    authn_and_authz()
+def create_app(messages_resource=MessagesResource):
+    """Create the messages API; message_aio.py passes its own MessagesResource subclass."""
+    app = Flask(__name__)
+    CORS(app)
+    api = AgaveApi(app)
 
-# set up error handling
-api.handle_error = handle_error
-api.handle_exception = handle_error
-api.handle_user_exception = handle_error
+    # Authn/z
+    @app.before_request
+    def auth():
+        authn_and_authz()
 
-# Resources
-api.add_resource(MessagesResource, '/actors/<string:actor_id>/messages')
+    # set up error handling
+    api.handle_error = handle_error
+    api.handle_exception = handle_error
+    api.handle_user_exception = handle_error
+
+    # Resources
+    api.add_resource(messages_resource, '/actors/<string:actor_id>/messages')
+    api.add_resource(MessagesBatchResource, '/actors/<string:actor_id>/messages/batch')
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True)
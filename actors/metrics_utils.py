@@ -1,15 +1,18 @@
+import concurrent.futures
 import requests
 import json
 import datetime
 import time
+import timeit
 
 from config import Config
 from models import dict_to_camel, Actor, Execution, ExecutionsSummary, Nonce, Worker, get_permissions, \
     set_permission
 from worker import shutdown_workers, shutdown_worker
-from stores import actors_store, executions_store, logs_store, nonce_store, permissions_store
-from prometheus_client import start_http_server, Summary, MetricsHandler, Counter, Gauge, generate_latest
-from channels import ActorMsgChannel, CommandChannel, ExecutionResultsChannel
+from codes import SHUTTING_DOWN
+from stores import actors_store, executions_store, logs_store, nonce_store, permissions_store, workers_store
+from prometheus_client import start_http_server, Summary, MetricsHandler, Counter, Gauge, Histogram, generate_latest
+from channels import ActorMsgChannel, CommandChannel, ExecutionResultsChannel, get_inbox_lengths
 from agaveflask.logs import get_logger
 logger = get_logger(__name__)
 
@@ -26,172 +29,100 @@ command_gauge = Gauge(
     'Number of messages currently in this command channel',
     ['name'])
 
-def create_gauges(actor_ids):
+def set_actor_gauges(actor_id, msg_length, num_workers):
     """
-    Creates a Prometheus gauge for each actor id. The gauge is used to track the number of
-    pending messages in the actor's queue.
-    :param actor_ids: list of actors that should be processed. Does not include stateful actors or
-    actors in a shutting down state.
-    :return:
+    Sets the Prometheus message and worker gauges for an actor, creating the gauges the first time the actor
+    is seen.
     """
-    logger.debug("top of create_gauges; actor_ids: {}".format(actor_ids))
-    # dictionary mapping actor_ids to their message queue lengths
-    inbox_lengths = {}
-    for actor_id in actor_ids:
-        logger.debug("top of for loop for actor_id: {}".format(actor_id))
-        # first, make sure the actor still exists in the actor store
+    # If the actor doesn't have a gauge, add one
+    if actor_id not in message_gauges.keys():
         try:
-            actor = actors_store[actor_id]
-        except KeyError:
-            logger.info(f"actor {actor_id} does not exist in store; continuing to next actor.")
-            continue
-        # If the actor doesn't have a gauge, add one
-        if actor_id not in message_gauges.keys():
-            try:
-                g = Gauge(
-                    'message_count_for_actor_{}'.format(actor_id.replace('-', '_')),
-                    'Number of messages for actor {}'.format(actor_id.replace('-', '_'))
-                )
-                message_gauges.update({actor_id: g})
-                logger.debug('Created gauge {}'.format(g))
-            except Exception as e:
-                logger.error("got exception trying to create/instantiate the gauge; "
-                             "actor {}; exception: {}".format(actor_id, e))
-                g = None
-        else:
-            # Otherwise, get this actor's existing gauge
-            try:
-                g = message_gauges[actor_id]
-            except Exception as e:
-                logger.info("got exception trying to instantiate an existing gauge; "
-                            "actor: {}: exception:{}".format(actor_id, e))
-                g = None
-        # Update this actor's gauge to its current # of messages
+            g = Gauge(
+                'message_count_for_actor_{}'.format(actor_id.replace('-', '_')),
+                'Number of messages for actor {}'.format(actor_id.replace('-', '_'))
+            )
+            message_gauges.update({actor_id: g})
+            logger.debug('Created gauge {}'.format(g))
+        except Exception as e:
+            logger.error("got exception trying to create/instantiate the gauge; "
+                         "actor {}; exception: {}".format(actor_id, e))
+            g = None
+    else:
+        # Otherwise, get this actor's existing gauge
         try:
-            ch = ActorMsgChannel(actor_id=actor_id)
-            msg_length = len(ch._queue._queue)
+            g = message_gauges[actor_id]
         except Exception as e:
-            logger.error("Exception connecting to ActorMsgChannel: {}".format(e))
-            raise e
-        ch.close()
-        result = {'messages': msg_length}
-        # add the actor's current message queue length to the inbox_lengths in-memory variable
-        inbox_lengths[actor_id] = msg_length
-        # if we were able to create the gauge, set it to the current message:
-        if g:
-            try:
-                g.set(result['messages'])
-            except Exception as e:
-                logger.error(f"Got exception trying to set the messages on the gauge for actor: {actor_id}; "
-                             f"exception: {e}")
-        logger.debug("METRICS: {} messages found for actor: {}.".format(result['messages'], actor_id))
-
-        # add a worker gauge for this actor if one does not exist
-        if actor_id not in worker_gaueges.keys():
-            try:
-                g = Gauge(
-                    'worker_count_for_actor_{}'.format(actor_id.replace('-', '_')),
-                    'Number of workers for actor {}'.format(actor_id.replace('-', '_'))
-                )
-                worker_gaueges.update({actor_id: g})
-                logger.debug('Created worker gauge {}'.format(g))
-            except Exception as e:
-                logger.info("got exception trying to instantiate the Worker Gauge: {}".format(e))
-        else:
-            # Otherwise, get the worker gauge that already exists
-            g = worker_gaueges[actor_id]
+            logger.info("got exception trying to instantiate an existing gauge; "
+                        "actor: {}: exception:{}".format(actor_id, e))
+            g = None
+    # if we were able to create the gauge, set it to the current message:
+    if g:
+        try:
+            g.set(msg_length)
+        except Exception as e:
+            logger.error(f"Got exception trying to set the messages on the gauge for actor: {actor_id}; "
+                         f"exception: {e}")
+    logger.debug("METRICS: {} messages found for actor: {}.".format(msg_length, actor_id))
 
-        # Update this actor's worker IDs
-        workers = Worker.get_workers(actor_id)
-        result = {'workers': len(workers)}
+    # add a worker gauge for this actor if one does not exist
+    g = None
+    if actor_id not in worker_gaueges.keys():
         try:
-            g.set(result['workers'])
+            g = Gauge(
+                'worker_count_for_actor_{}'.format(actor_id.replace('-', '_')),
+                'Number of workers for actor {}'.format(actor_id.replace('-', '_'))
+            )
+            worker_gaueges.update({actor_id: g})
+            logger.debug('Created worker gauge {}'.format(g))
+        except Exception as e:
+            logger.info("got exception trying to instantiate the Worker Gauge: {}".format(e))
+    else:
+        # Otherwise, get the worker gauge that already exists
+        g = worker_gaueges[actor_id]
+    if g:
+        try:
+            g.set(num_workers)
         except Exception as e:
             logger.error(f"got exception trying to set the worker gauge for actor {actor_id}; exception: {e}")
-        logger.debug(f"METRICS: {result['workers']} workers found for actor: {actor_id}.")
+    logger.debug(f"METRICS: {num_workers} workers found for actor: {actor_id}.")
 
-        # Update this actor's command channel metric
-        # channel_name = actor.get("queue")
-        #
-        # queues_list = Config.get('spawner', 'host_queues').replace(' ', '')
-        # valid_queues = queues_list.split(',')
-        #
-        # if not channel_name or channel_name not in valid_queues:
-        #     channel_name = 'default'
-        #
-        # if not channel_name:
-        #     # TODO -- this must be changed. there is no way returning no arguments will result in
-        #     # anythng but an exception. The calling function is expecting 3 arguments...
-        #     # if we really want to blow up right here we should just raise an appropriate exception.
-        #     return
 
-    # TODO -- this code needs to be fixed. What follows is only a partial fix; what I think we want to do
-    # is set the length of all of the different command channels once at the end of this loop. What was
-    # happening instead was that it was only setting one of the command channel's lengths -- whatever command
-    # channel happened to belong to the last actor in the loop.
-    channel_name = 'default'
+def get_cmd_length(channel_name='default'):
+    """Returns the number of messages on a command channel and updates its gauge."""
     ch = CommandChannel(name=channel_name)
-    cmd_length = len(ch._queue._queue)
+    try:
+        cmd_length = len(ch._queue._queue)
+    finally:
+        ch.close()
     command_gauge.labels(channel_name).set(cmd_length)
-    logger.debug(f"METRICS COMMAND CHANNEL {channel_name} size: {command_gauge}")
-    ch.close()
+    logger.debug(f"METRICS COMMAND CHANNEL {channel_name} size: {cmd_length}")
+    return cmd_length
 
-    # Return actor_ids so we don't have to query for them again later
-    return actor_ids, inbox_lengths, cmd_length
 
+AUTOSCALER_PHASE_SECONDS = Histogram(
+    'autoscaler_phase_seconds',
+    'Time spent in each phase of an autoscaler run',
+    ['phase'])
 
-def calc_change_rate(data, last_metric, actor_id):
-    change_rate = 0
-    try:
-        previous_data = last_metric[actor_id]
-        previous_message_count = int(previous_data[0]['value'][1])
-        try:
-            # what is data?
-            current_message_count = int(data[0]['value'][1])
-            change_rate = current_message_count - previous_message_count
-        except:
-            logger.debug("Could not calculate change rate.")
-    except:
-        logger.info("No previous data yet for new actor {}".format(actor_id))
-    return change_rate
+AUTOSCALER_ACTIONS = Counter(
+    'autoscaler_actions',
+    'Number of scale up and scale down actions dispatched by the autoscaler',
+    ['action'])
 
 
-def allow_autoscaling(max_workers, num_workers, cmd_length):
+def scale_up(actor_id, actor=None):
     """
-    This function returns True if the conditions for a specific actor indicate it could be scaled up.
-    Note that this does NOT mean the actor WILL be scaled up, as this function does not take into account
-    the current number of messages queued for the actor.
-    :param max_workers: The maximum number of workers allowed for a specific actor.
-    :param num_workers: The current number of workers for a specific actor.
-    :param cmd_length: The current lenght of the associated command channel for a specific actor.
-    :return:
+    Requests a new worker for an actor and puts the command to start it on the actor's command channel.
+    Pass the actor's document from the actors_store as `actor` to avoid reading it again.
+    Returns the name of the command channel used, or None if the worker could not be requested.
     """
-    logger.debug(f"top of allow_autoscaling; max_workers: {max_workers}, num_workers: {num_workers}, "
-                 f"cmd_length: {cmd_length}")
-    # first check if the number of messages on the command channel exceeds the limit:
-    try:
-        max_cmd_length = int(Config.get('spawner', 'max_cmd_length'))
-    except Exception as e:
-        logger.info(f"Autoscaler got exception trying to compute the max_cmd_lenght; using 10. E"
-                    f"xception: {e}")
-        max_cmd_length = 10
-
-    if cmd_length > max_cmd_length:
-        logger.info(f"Will NOT scale up: Current cmd_length ({cmd_length}) is greater than ({max_cmd_length}).")
-        return False
-    if int(num_workers) >= int(max_workers):
-        logger.debug(f'Will NOT scale up: num_workers ({num_workers}) was >= max_workers ({max_workers})')
-        return False
-
-    logger.debug(f'Will scale up: num_workers ({num_workers}) was >= max_workers ({max_workers})')
-    return True
-
-def scale_up(actor_id):
     tenant, aid = actor_id.split('_')
     logger.debug('METRICS Attempting to create a new worker for {}'.format(actor_id))
     try:
         # create a worker & add to this actor
-        actor = Actor.from_db(actors_store[actor_id])
+        if actor is None:
+            actor = actors_store[actor_id]
+        actor = Actor.from_db(actor)
         worker_id = Worker.request_worker(tenant=tenant, actor_id=actor_id)
         logger.info("New worker id: {}".format(worker_id))
         if actor.queue:
@@ -213,17 +144,21 @@ def scale_up(actor_id):
         return None
 
 
-def scale_down(actor_id, is_sync_actor=False):
+def scale_down(actor_id, is_sync_actor=False, workers=None):
     """
     This function determines whether an actor's worker pool should be scaled down and if so,
     initiates the scaling down.
     :param actor_id: the actor_id
     :param is_sync_actor: whether or not the actor has the SYNC hint.
+    :param workers: the actor's worker objects, if they have already been retrieved.
     :return:
     """
     logger.debug(f"top of scale_down for actor_id: {actor_id}")
     # we retrieve the current workers again as we will need the entire worker ojects (not just the number).
-    workers = Worker.get_workers(actor_id)
+    if workers is None:
+        workers = Worker.get_workers(actor_id)
+    else:
+        workers = list(workers)
     logger.debug(f'scale_down number of workers: {len(workers)}')
     try:
         # iterate through all the actor's workers and determine if they should be shut down.
@@ -287,3 +222,148 @@ def scale_down(actor_id, is_sync_actor=False):
     except Exception as e:
         logger.debug("METRICS SCALE UP FAILED: {}".format(e))
 
+
+def _get_int_config(section, option, default):
+    try:
+        return int(Config.get(section, option))
+    except Exception:
+        return default
+
+
+class Autoscaler(object):
+    """
+    Runs one pass of the autoscaler: loads all candidate actors and their workers with two bulk queries, gets
+    all inbox lengths in bulk, decides in memory which actors to scale up or down, and then dispatches the
+    scale_up()/scale_down() calls concurrently on a bounded thread pool.
+    Each phase is timed in the autoscaler_phase_seconds histogram.
+    """
+
+    def __init__(self, pool_size=None, max_workers_per_actor=None, max_cmd_length=None):
+        # maximum number of scale_up()/scale_down() calls in flight at once.
+        self.pool_size = pool_size or _get_int_config('workers', 'autoscaler_pool_size', 10)
+        self.max_workers_per_actor = max_workers_per_actor or \
+            _get_int_config('spawner', 'max_workers_per_actor', 1)
+        self.max_cmd_length = max_cmd_length or _get_int_config('spawner', 'max_cmd_length', 10)
+
+    @staticmethod
+    def _timed(phase, f, *args):
+        start_timer = timeit.default_timer()
+        try:
+            return f(*args)
+        finally:
+            AUTOSCALER_PHASE_SECONDS.labels(phase).observe(timeit.default_timer() - start_timer)
+
+    def load_actors(self, actor_ids=None):
+        """
+        Returns a dictionary mapping db_id to actor document for every actor the autoscaler manages, optionally
+        restricted to the dbids in `actor_ids`.
+        """
+        query = {'stateless': True, 'status': {'$nin': ['ERROR', SHUTTING_DOWN]}}
+        if actor_ids is not None:
+            query['db_id'] = {'$in': list(actor_ids)}
+        # full documents are loaded since scale_up() builds an Actor from them.
+        actors = actors_store.items(query)
+        logger.debug(f"autoscaler found {len(actors)} actors.")
+        return {actor['db_id']: actor for actor in actors}
+
+    def load_workers(self, actor_ids):
+        """Returns a dictionary mapping each actor db_id to the list of its workers."""
+        workers = {actor_id: [] for actor_id in actor_ids}
+        if not actor_ids:
+            return workers
+        pipeline = [{'$match': {'actor_id': {'$in': list(actor_ids)}}},
+                    {'$project': {'_id': False}},
+                    {'$group': {'_id': '$actor_id', 'workers': {'$push': '$$ROOT'}}}]
+        for group in workers_store.aggregate(pipeline):
+            workers[group['_id']] = group['workers']
+        return workers
+
+    def load_inbox_lengths(self, actor_ids, max_age=None):
+        lengths = get_inbox_lengths(actor_ids, max_age=max_age)
+        cmd_length = get_cmd_length('default')
+        return lengths, cmd_length
+
+    def max_workers(self, actor):
+        # If this actor has a custom max_workers, use that. Otherwise use default.
+        if actor.get('max_workers'):
+            try:
+                return int(actor['max_workers'])
+            except Exception as e:
+                logger.error("max_workers defined for actor_id {} but could not cast to int. "
+                             "Exception: {}".format(actor.get('db_id'), e))
+        return self.max_workers_per_actor
+
+    @staticmethod
+    def is_sync_actor(actor):
+        try:
+            hints = list(actor.get("hints") or [])
+        except Exception:
+            hints = []
+        return Actor.SYNC_HINT in hints
+
+    def decide(self, actors, workers, inbox_lengths, cmd_length, scale_down=True):
+        """
+        Computes the scaling decisions for all actors. Returns a list of ('up', actor_id) and
+        ('down', actor_id) tuples; pass scale_down=False to only compute scale ups. Scale ups that target the
+        default command channel count against `cmd_length` so that a single run cannot overfill it.
+        """
+        decisions = []
+        for actor_id, actor in actors.items():
+            current_message_count = inbox_lengths.get(actor_id, 0)
+            current_workers = len(workers.get(actor_id, []))
+            set_actor_gauges(actor_id, current_message_count, current_workers)
+            max_workers = self.max_workers(actor)
+            logger.debug(f"actor {actor_id}; Current message count: {current_message_count}; "
+                         f"Current workers: {current_workers}; Max workers: {max_workers}")
+            if current_message_count >= 1:
+                if current_workers < max_workers and cmd_length <= self.max_cmd_length:
+                    decisions.append(('up', actor_id))
+                    if not actor.get('queue') or actor.get('queue') == 'default':
+                        cmd_length += 1
+                elif cmd_length > self.max_cmd_length:
+                    logger.warning('METRICS - COMMAND QUEUE is getting full. Skipping autoscale.')
+            elif scale_down and current_workers > 0:
+                decisions.append(('down', actor_id))
+        return decisions
+
+    def dispatch(self, decisions, actors, workers):
+        """Runs the scale_up()/scale_down() calls for the decisions on a bounded thread pool."""
+        if not decisions:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            futures = {}
+            for action, actor_id in decisions:
+                actor = actors[actor_id]
+                if action == 'up':
+                    f = executor.submit(scale_up, actor_id, actor)
+                else:
+                    f = executor.submit(scale_down, actor_id, self.is_sync_actor(actor), workers.get(actor_id))
+                futures[f] = (action, actor_id)
+            for f in concurrent.futures.as_completed(futures):
+                action, actor_id = futures[f]
+                AUTOSCALER_ACTIONS.labels(action).inc()
+                try:
+                    f.result()
+                except Exception as e:
+                    logger.error(f"autoscaler got exception from scale {action} for actor {actor_id}; e: {e}")
+
+    def run(self, scale=True, actor_ids=None, scale_down=True, max_age=None):
+        """
+        Runs one pass of the autoscaler. The gauges are always updated; workers are only started and stopped
+        when `scale` is True. Pass `actor_ids` to only consider those actors, scale_down=False to only scale up
+        and `max_age` to bound the age of the cached inbox lengths used (see channels.get_inbox_lengths).
+        Returns the list of decisions.
+        """
+        start_timer = timeit.default_timer()
+        actors = self._timed('load_actors', self.load_actors, actor_ids)
+        actor_ids = list(actors.keys())
+        workers = self._timed('load_workers', self.load_workers, actor_ids)
+        inbox_lengths, cmd_length = self._timed('queue_depths', self.load_inbox_lengths, actor_ids, max_age)
+        decisions = self._timed('decide', self.decide, actors, workers, inbox_lengths, cmd_length, scale_down)
+        if scale:
+            self._timed('dispatch', self.dispatch, decisions, actors, workers)
+        ms = (timeit.default_timer() - start_timer) * 1000
+        AUTOSCALER_PHASE_SECONDS.labels('total').observe(ms / 1000)
+        if ms > 2500:
+            logger.critical(f"autoscaler run took {ms} ms for {len(actor_ids)} actors.")
+        return decisions
@@ -15,6 +15,9 @@ from werkzeug.exceptions import BadRequest
 
 from agaveflask.utils import RequestParser
 
+import accounting
+from actor_cache import get_actor_cache
+from auth_cache import alias_cache, invalidate_alias, invalidate_permissions, permissions_cache
 from channels import CommandChannel, EventsChannel
 from codes import REQUESTED, READY, ERROR, SHUTDOWN_REQUESTED, SHUTTING_DOWN, SUBMITTED, EXECUTE, PermissionLevel, \
     SPAWNER_SETUP, PULLING_IMAGE, CREATING_CONTAINER, UPDATING_STORE, BUSY
@@ -22,8 +25,9 @@ from config import Config
 import errors
 import codes
 
-from stores import actors_store, alias_store, clients_store, executions_store, logs_store, nonce_store, \
-    permissions_store, workers_store, abaco_metrics_store, configs_permissions_store, configs_store
+import log_shipping
+from stores import actors_store, alias_store, clients_store, executions_store, log_chunks_store, nonce_store, \
+    permissions_store, workers_store, configs_permissions_store, configs_store, abaco_metrics_store
 
 from agaveflask.logs import get_logger
 logger = get_logger(__name__)
@@ -126,6 +130,12 @@ class Search():
         pipeline = search + query + security
         start = time.time()
         full_search_res = list(queried_store.aggregate(pipeline))
+        if self.search_type == 'logs':
+            # logs stored before they were shipped in chunks are single documents with a 'logs' field in the
+            # logs_store; the logs_store also holds the summaries of the chunked logs, which are left out.
+            legacy_pipeline = search + [{'$match': {'logs': {'$exists': True}}},
+                                        {'$addFields': {'execution_id': '$_id'}}] + query + security
+            full_search_res += list(logs_store.aggregate(legacy_pipeline))
         logger.info(f'Got search response in {time.time() - start} seconds.'\
                     f'Pipeline: {pipeline} First two results: {full_search_res[0:1]}')
         final_result = self.post_processing(full_search_res, skip, limit)
@@ -143,7 +153,7 @@ class Search():
         store_dict = {'executions': executions_store,
                       'workers': workers_store,
                       'actors': actors_store,
-                      'logs': logs_store}
+                      'logs': log_chunks_store}
         try:
             queried_store = store_dict[self.search_type]
         except KeyError:
@@ -322,6 +332,13 @@ class Search():
         """
         logger.info(f'Starting post_processing for search with search_type: {self.search_type}')
 
+        if self.search_type == 'logs':
+            # the chunks of a log are matched separately; keep the first (best scored) match of each execution.
+            executions = {}
+            for result in search_list:
+                executions.setdefault(result.get('execution_id'), result)
+            search_list = list(executions.values())
+
         total_count = len(search_list)
         search_list = search_list[skip: skip + limit]
 
@@ -403,7 +420,7 @@ class Search():
             for i, result in enumerate(search_list):
                 try:
                     actor_id = result['actor_id']
-                    exec_id = result['_id']
+                    exec_id = result['execution_id']
                     actor = Actor.from_db(actors_store[actor_id])
                     search_list[i]['_links'] = {
                         'self': f'{actor.api_server}/actors/v2/{actor.id}/executions/{exec_id}/logs',
@@ -411,11 +428,15 @@ class Search():
                         'execution': f'{actor.api_server}/actors/v2/{actor.id}/executions/{exec_id}'}
                 except KeyError:
                     pass
-                search_list[i].pop('_id', None)
-                search_list[i].pop('permissions', None)
-                search_list[i].pop('exp', None)
-                search_list[i].pop('actor_id', None)
-                search_list[i].pop('tenant', None)
+                if 'seq' in result:
+                    # a matched chunk; return the whole log of the execution, as for the logs stored in one document.
+                    try:
+                        search_list[i]['logs'], _ = Execution.get_logs(result['execution_id'])
+                    except KeyError:
+                        pass
+                for field in ('_id', 'permissions', 'exp', 'actor_id', 'tenant', 'execution_id',
+                              'seq', 'offset', 'end', 'length', 'data', 'encoding'):
+                    search_list[i].pop(field, None)
 
         # Adjusts case of the response to match expected case.
         case = Config.get('web', 'case')
@@ -520,7 +541,7 @@ class Event(object):
         :return: the db_id associated with the link, if it exists, or '' otherwise.
         """
         try:
-            actor = Actor.from_db(actors_store[self.db_id])
+            actor = Actor.from_cache(self.db_id)
         except KeyError:
             logger.debug("did not find actor with id: {}".format(self.actor_id))
             raise errors.ResourceError("No actor found with identifier: {}.".format(self.actor_id), 404)
@@ -745,6 +766,9 @@ class Actor(AbacoDAO):
         ('description', 'optional', 'description', str,  'Description of this actor', ''),
         ('privileged', 'optional', 'privileged', inputs.boolean, 'Whether this actor runs in privileged mode.', False),
         ('max_workers', 'optional', 'max_workers', int, 'How many workers this actor is allowed at the same time.', None),
+        ('concurrency', 'optional', 'concurrency', int, 'How many executions each worker of this actor runs at the same time.', 1),
+        ('batch_size', 'optional', 'batch_size', int, 'Maximum number of messages delivered to a single actor container.', 1),
+        ('batch_wait', 'optional', 'batch_wait', int, 'How long, in milliseconds, a worker waits for more messages to fill a batch.', 0),
         ('mem_limit', 'optional', 'mem_limit', str, 'maximum amount of memory this actor can use.', None),
         ('max_cpus', 'optional', 'max_cpus', int, 'Maximum number of CPUs (nanoCPUs) this actor will have available to it.', None),
         ('use_container_uid', 'optional', 'use_container_uid', inputs.boolean, 'Whether this actor runs as the UID set in the container image.', False),
@@ -775,6 +799,8 @@ class Actor(AbacoDAO):
         ]
 
     SYNC_HINT = 'sync'
+    # actors with this hint run their executions in a long-lived container per worker; see hot_containers.py
+    HOT_HINT = 'hot'
 
     def get_derived_value(self, name, d):
         """Compute a derived value for the attribute `name` from the dictionary d of attributes provided."""
@@ -888,8 +914,7 @@ class Actor(AbacoDAO):
             return identifier
         # look for an alias with the identifier:
         alias_id = Alias.generate_alias_id(tenant, identifier)
-        alias = Alias.retrieve_by_alias_id(alias_id)
-        return alias.actor_id
+        return alias_cache.get(alias_id, lambda: Alias.retrieve_by_alias_id(alias_id).actor_id)
 
     @classmethod
     def get_actor(cls, identifier, is_alias=False):
@@ -961,11 +986,25 @@ class Actor(AbacoDAO):
             logger.debug("Actor.ensure_one_worker() returning None.")
             return None
 
+    @classmethod
+    def from_cache(cls, actor_id):
+        """
+        Construct an actor from the process-local actor cache (see actor_cache.py), reading it from the actors_store
+        on a miss. Raises KeyError if the actor does not exist.
+        actor_id (str) should be the actor db_id.
+        """
+        return cls.from_db(get_actor_cache().get(actor_id))
+
+    @classmethod
+    def invalidate_cache(cls, actor_id):
+        """Drop the cached copy of an actor after this process updated or deleted it."""
+        get_actor_cache().invalidate(actor_id)
+
     @classmethod
     def get_actor_log_ttl(cls, actor_id):
         """Returns the log time to live, looking at both the config file and logEx if passed"""
         logger.debug("In get_actor_log_ttl")
-        actor = Actor.from_db(actors_store[actor_id])
+        actor = Actor.from_cache(actor_id)
         # Find the proper log expiry time, starting with user input, then tenant-specific, then global expiry
         tenant = actor['tenant']
         if actor['log_ex'] is not None:
@@ -1004,6 +1043,43 @@ class Actor(AbacoDAO):
         else:
             return dbid
 
+    @classmethod
+    def list_actors(cls, tenant, user, limit=None, after=None):
+        """
+        Return a cursor over the db documents of the actors of `tenant` that `user` can read, ordered by id. This is a
+        single aggregation: the permissions of each actor are joined with $lookup and checked as in
+        permission_process(): the first entry of the permissions document for either `user` or the world user decides,
+        so a NONE permission of the user listed before the world user denies access. Only actors whose display id
+        comes after `after` are returned, at most `limit` of them.
+        """
+        WORLD_USER = 'ABACO_WORLD'
+        match = {'tenant': tenant}
+        if after:
+            match['_id'] = {'$gt': cls.get_dbid(tenant, after)}
+        levels = [level for level in codes.PERMISSION_LEVELS if PermissionLevel(level) >= codes.READ]
+        # the entries of the permissions document are compared by key as values, never used as field paths, so a user
+        # name containing '.' or starting with '$' cannot change the query; $literal keeps it from being read as a
+        # field path or variable.
+        entries = {'$filter': {'input': {'$objectToArray': {'$ifNull': [{'$arrayElemAt': ['$permissions', 0]}, {}]}},
+                               'as': 'entry',
+                               'cond': {'$or': [{'$eq': ['$$entry.k', {'$literal': user}]},
+                                                {'$eq': ['$$entry.k', WORLD_USER]}]}}}
+        readable = {'$let': {'vars': {'first': {'$arrayElemAt': [entries, 0]}},
+                             'in': {'$or': [{'$eq': ['$$first.k', WORLD_USER]},
+                                            {'$in': ['$$first.v', levels]}]}}}
+        pipeline = [{'$match': match},
+                    {'$sort': {'_id': 1}},
+                    {'$lookup':
+                        {'from': permissions_store._db.name,
+                         'localField': '_id',
+                         'foreignField': '_id',
+                         'as': 'permissions'}},
+                    {'$match': {'$expr': readable}},
+                    {'$project': {'_id': False, 'permissions': False}}]
+        if limit:
+            pipeline.append({'$limit': limit})
+        return actors_store.aggregate(pipeline)
+
     @classmethod
     def set_status(cls, actor_id, status, status_message=None):
         """Update the status of an actor.
@@ -1011,6 +1087,7 @@ class Actor(AbacoDAO):
         """
         logger.debug("top of set_status for status: {}".format(status))
         actors_store[actor_id, 'status'] = status
+        Actor.invalidate_cache(actor_id)
         # we currently publish status change events for actors when the status is changing to ERROR or READY:
         if status == ERROR or status == READY:
             try:
@@ -1022,6 +1099,7 @@ class Actor(AbacoDAO):
                              "actor_id: {}; status: {}; exception: {}".format(actor_id, status, e))
         if status_message:
             actors_store[actor_id, 'status_message'] = status_message
+            Actor.invalidate_cache(actor_id)
 
 
 class Alias(AbacoDAO):
@@ -1080,6 +1158,7 @@ class Alias(AbacoDAO):
         obj = alias_store.add_if_empty([self.alias_id], self)
         if not obj:
             raise errors.DAOError("Alias {} already exists.".format(self.alias))
+        invalidate_alias(self.alias_id)
         return obj
 
     @classmethod
@@ -1354,13 +1433,17 @@ class Execution(AbacoDAO):
         ('start_time', 'optional', 'start_time', str, 'Time (UTC) the execution started.', None),
         ('finish_time', 'optional', 'finish_time', str, 'Time (UTC) the execution finished.', None),
         ('runtime', 'required', 'runtime', str, 'Runtime, in milliseconds, of the execution.', None),
-        ('cpu', 'required', 'cpu', str, 'CPU usage, in user jiffies, of the execution.', None),
+        ('cpu', 'required', 'cpu', str, 'CPU usage, in nanoseconds, of the execution.', None),
         ('io', 'required', 'io', str,
-         'Block I/O usage, in number of 512-byte sectors read from and written to, by the execution.', None),
+         'I/O usage, in bytes, of the execution. Block I/O read and written when cgroup accounting is enabled; '
+         'otherwise, network bytes received.', None),
+        ('memory_peak', 'optional', 'memory_peak', str, 'Peak memory usage, in bytes, of the execution.', None),
         ('id', 'derived', 'id', str, 'Human readable id for this execution.', None),
         ('status', 'required', 'status', str, 'Status of the execution.', None),
         ('exit_code', 'optional', 'exit_code', str, 'The exit code of this execution.', None),
         ('final_state', 'optional', 'final_state', str, 'The final state of the execution.', None),
+        ('batch', 'optional', 'batch', str,
+         'For actors with batching, the id of the execution whose actor container also ran this execution.', None),
     ]
 
     def get_derived_value(self, name, d):
@@ -1387,7 +1470,7 @@ class Execution(AbacoDAO):
         :return:
         """
         logger.debug("top of add_execution for actor: {} and execution: {}.".format(actor_id, ex))
-        actor = Actor.from_db(actors_store[actor_id])
+        actor = Actor.from_cache(actor_id)
         ex.update({'actor_id': actor_id,
                    'tenant': actor.tenant,
                    'api_server': actor['api_server']
@@ -1396,11 +1479,7 @@ class Execution(AbacoDAO):
         start_timer = timeit.default_timer()
         
         executions_store[f'{actor_id}_{execution.id}'] = execution
-        abaco_metrics_store.full_update(
-            {'_id': 'stats'},
-            {'$inc': {'executions_total': 1},
-             '$addToSet': {'execution_dbids': f'{actor_id}_{execution.id}'}},
-             upsert=True)
+        accounting.record_executions_created(actor.tenant, actor_id)
 
         stop_timer = timeit.default_timer()
         ms = (stop_timer - start_timer) * 1000
@@ -1409,6 +1488,39 @@ class Execution(AbacoDAO):
         logger.info("Execution: {} saved for actor: {}.".format(ex, actor_id))
         return execution.id
 
+    @classmethod
+    def add_executions(cls, actor_id, exs, actor=None):
+        """
+        Add a batch of executions to an actor with a single write to the executions store.
+        :param actor_id: str; the dbid of the actor
+        :param exs: list of dicts describing the executions.
+        :param actor: the Actor object, if the caller already has it.
+        :return: list of the new execution ids, in the same order as `exs`.
+        """
+        logger.debug("top of add_executions for actor: {}; {} executions.".format(actor_id, len(exs)))
+        if not actor:
+            actor = Actor.from_cache(actor_id)
+        executions = {}
+        for ex in exs:
+            ex.update({'actor_id': actor_id,
+                       'tenant': actor.tenant,
+                       'api_server': actor['api_server']
+                       })
+            execution = Execution(**ex)
+            executions[f'{actor_id}_{execution.id}'] = execution
+        start_timer = timeit.default_timer()
+
+        executions_store.insert_many(executions)
+        accounting.record_executions_created(actor.tenant, actor_id, count=len(executions))
+
+        stop_timer = timeit.default_timer()
+        ms = (stop_timer - start_timer) * 1000
+        if ms > 2500:
+            logger.critical(f"Execution.add_executions took {ms} to run for actor {actor_id}; "
+                            f"{len(executions)} executions")
+        logger.info("{} executions saved for actor: {}.".format(len(executions), actor_id))
+        return [execution.id for execution in executions.values()]
+
     @classmethod
     def add_worker_id(cls, actor_id, execution_id, worker_id):
         """
@@ -1434,6 +1546,32 @@ class Execution(AbacoDAO):
             logger.critical(f"Execution.add_worker_id took {ms} to run for actor {actor_id}, execution: {execution_id}, worker: {worker_id}")
 
 
+    @classmethod
+    def add_to_batch(cls, actor_id, execution_id, worker_id, batch_id, status):
+        """
+        Record that an execution is run by the actor container of the execution `batch_id`, with a single update.
+        :param actor_id: the id of the actor
+        :param execution_id: the id of the execution
+        :param worker_id: the id of the worker that executed this actor.
+        :param batch_id: the id of the first execution of the batch.
+        :param status: the new status of the execution.
+        :return:
+        """
+        logger.debug(f"top of add_to_batch() for actor: {actor_id} execution: {execution_id} batch: {batch_id}")
+        start_timer = timeit.default_timer()
+        try:
+            executions_store.update_fields(f'{actor_id}_{execution_id}', {'worker_id': worker_id,
+                                                                          'batch': batch_id,
+                                                                          'status': status})
+        except KeyError as e:
+            logger.error(f"Could not add execution to batch. KeyError: {e}. actor: {actor_id}. ex: {execution_id}. "
+                         f"batch: {batch_id}")
+            raise errors.ExecutionException("Execution {} not found.".format(execution_id))
+        stop_timer = timeit.default_timer()
+        ms = (stop_timer - start_timer) * 1000
+        if ms > 2500:
+            logger.critical(f"Execution.add_to_batch took {ms} to run for actor {actor_id}, execution: {execution_id}")
+
     @classmethod
     def update_status(cls, actor_id, execution_id, status):
         """
@@ -1460,16 +1598,18 @@ class Execution(AbacoDAO):
                             f"execution: {execution_id}.")
 
     @classmethod
-    def finalize_execution(cls, actor_id, execution_id, status, stats, final_state, exit_code, start_time):
+    def finalize_execution(cls, actor_id, execution_id, status, stats, final_state, exit_code, start_time,
+                           tenant=None):
         """
         Update an execution status and stats after the execution is complete or killed.
          `actor_id` should be the dbid of the actor.
          `execution_id` should be the id of the execution returned from a prior call to add_execution.
          `status` should be the final status of the execution.
-         `stats` parameter should be a dictionary with io, cpu, and runtime.
+         `stats` parameter should be a dictionary with io, cpu, and runtime, and optionally memory_peak.
          `final_state` parameter should be the `State` object returned from the docker inspect command.
          `exit_code` parameter should be the exit code of the container.
          `start_time` should be the start time (UTC string) of the execution. 
+         `tenant` is the tenant of the actor, used for usage accounting.
          """
         params_str = "actor: {}. ex: {}. status: {}. final_state: {}. exit_code: {}. stats: {}".format(
             actor_id, execution_id, status, final_state, exit_code, stats)
@@ -1483,32 +1623,41 @@ class Execution(AbacoDAO):
         if not 'runtime' in stats:
             logger.error("Could not finalize execution. runtime missing. Params: {}".format(params_str))
             raise errors.ExecutionException("'runtime' parameter required to finalize execution.")
-        start_timer = timeit.default_timer()
-        try:
-            executions_store[f'{actor_id}_{execution_id}', 'status'] = status
-            executions_store[f'{actor_id}_{execution_id}', 'io'] = stats['io']
-            executions_store[f'{actor_id}_{execution_id}', 'cpu'] = stats['cpu']
-            executions_store[f'{actor_id}_{execution_id}', 'runtime'] = stats['runtime']
-            executions_store[f'{actor_id}_{execution_id}', 'final_state'] = final_state
-            executions_store[f'{actor_id}_{execution_id}', 'exit_code'] = exit_code
-            executions_store[f'{actor_id}_{execution_id}', 'start_time'] = start_time
-        except KeyError:
-            logger.error("Could not finalize execution. execution not found. Params: {}".format(params_str))
-            raise errors.ExecutionException("Execution {} not found.".format(execution_id))
-
+        fields = {'status': status,
+                  'io': stats['io'],
+                  'cpu': stats['cpu'],
+                  'runtime': stats['runtime'],
+                  'final_state': final_state,
+                  'exit_code': exit_code,
+                  'start_time': start_time}
+        if stats.get('memory_peak') is not None:
+            fields['memory_peak'] = stats['memory_peak']
+        finish_time_error = None
         try:
             finish_time = final_state.get('FinishedAt')
             # we rely completely on docker for the final_state object which includes the FinishedAt time stamp;
             # under heavy load, we have seen docker fail to set this time correctly and instead set it to 1/1/0001.
             # in that case, we should use the total_runtime to back into it.
             if finish_time == datetime.datetime.min:
-                derived_finish_time = start_time + datetime.timedelta(seconds=stats['runtime'])
-                executions_store[f'{actor_id}_{execution_id}', 'finish_time'] = derived_finish_time
+                fields['finish_time'] = start_time + datetime.timedelta(seconds=stats['runtime'])
             else:
-                executions_store[f'{actor_id}_{execution_id}', 'finish_time'] = finish_time
+                fields['finish_time'] = finish_time
         except Exception as e:
-            logger.error(f"Could not finalize execution. Error: {e}")
-            raise errors.ExecutionException(f"Could not finalize execution. Error: {e}")
+            finish_time_error = e
+        start_timer = timeit.default_timer()
+        # all fields are written with a single update
+        try:
+            executions_store.update_fields(f'{actor_id}_{execution_id}', fields)
+        except KeyError:
+            logger.error("Could not finalize execution. execution not found. Params: {}".format(params_str))
+            raise errors.ExecutionException("Execution {} not found.".format(execution_id))
+        if finish_time_error:
+            logger.error(f"Could not finalize execution. Error: {finish_time_error}")
+            raise errors.ExecutionException(f"Could not finalize execution. Error: {finish_time_error}")
+
+        if not tenant:
+            tenant = actor_id.rsplit('_', 1)[0]
+        accounting.record_execution_usage(tenant, actor_id, stats)
 
         stop_timer = timeit.default_timer()
         ms = (stop_timer - start_timer) * 1000
@@ -1532,37 +1681,71 @@ class Execution(AbacoDAO):
 
 
     @classmethod
-    def set_logs(cls, exc_id, logs, actor_id, tenant, worker_id, log_ex):
+    def log_shipper(cls, exc_id, actor_id, tenant, log_ex):
         """
-        Set the logs for an execution.
+        Return a LogShipper for shipping the logs of an execution incrementally; see log_shipping.py.
         :param exc_id: the id of the execution (str)
-        :param logs: dict describing the logs
-        :return:
+        :return: LogShipper
         """
         try:
             max_log_length = int(Config.get('web', 'max_log_length'))
         except:
             max_log_length = DEFAULT_MAX_LOG_LENGTH
-        if len(logs) > DEFAULT_MAX_LOG_LENGTH:
-            logger.info("truncating log for execution: {}".format(exc_id))
-            # in some environments, perhaps depending on OS or docker version, the logs object is of type bytes.
-            # in that case we need to convert to be able to concatenate.
-            if type(logs) == bytes:
-                logs = logs.decode('utf-8')
-            if not type(logs) == str:
-                logger.info(f"Got unexpected type for logs object- could not convert to type str; type: {type(logs)}")
-                logs = ''
-            logs = logs[:max_log_length] + " LOG LIMIT EXCEEDED; this execution log was TRUNCATED!"
-        start_timer = timeit.default_timer()
         logger.info("Storing log with expiry of {} seconds".format(log_ex))
-        logs_store.set_with_expiry([exc_id, 'logs'], logs, log_ex)
-        logs_store[exc_id, 'actor_id'] = actor_id
-        logs_store[exc_id, 'tenant'] = tenant
+        return log_shipping.LogShipper(exc_id, actor_id, tenant, log_ex, max_log_length,
+                                       compression=log_shipping.get_compression())
+
+    @classmethod
+    def set_logs(cls, exc_id, logs, actor_id, tenant, worker_id, log_ex):
+        """
+        Set the logs for an execution.
+        :param exc_id: the id of the execution (str)
+        :param logs: the complete logs (str or bytes)
+        :return:
+        """
+        start_timer = timeit.default_timer()
+        shipper = cls.log_shipper(exc_id, actor_id, tenant, log_ex)
+        shipper.write(logs)
+        shipper.close()
         stop_timer = timeit.default_timer()
         ms = (stop_timer - start_timer) * 1000
         if ms > 2500:
             logger.critical(f"Execution.set_logs took {ms} to run for execution: {exc_id}.")
 
+    @classmethod
+    def get_logs(cls, exc_id, start=0, end=None):
+        """
+        Get the logs, or the bytes [start, end) of the logs, of an execution.
+        :param exc_id: the id of the execution (str)
+        :return: (str, dict) - the logs and the summary of the whole log, with its `length` in bytes and whether it
+         is `complete`, plus `returned`, the number of bytes of the log that were read (before decoding).
+        Raises KeyError if the execution has no logs.
+        """
+        logs, summary = log_shipping.read_logs(exc_id, start, end)
+        summary['returned'] = len(logs)
+        return logs.decode('utf-8', errors='replace'), summary
+
+    @classmethod
+    def tail_logs(cls, actor_id, exc_id, since=0, max_time=None):
+        """
+        Follow the logs of an execution from byte offset `since` on, as they are shipped by the worker.
+        :param actor_id: the dbid of the actor
+        :param exc_id: the id of the execution (str)
+        :return: generator of (str, int) tuples with the new logs and the offset to resume from; it ends when the execution reaches COMPLETE or ERROR and all of
+         its logs have been returned, or after `max_time` seconds.
+        """
+        def is_finished():
+            try:
+                return executions_store[f'{actor_id}_{exc_id}', 'status'] in (codes.COMPLETE, codes.ERROR)
+            except KeyError:
+                return True
+        for offset, data in log_shipping.tail_logs(exc_id, since, is_finished=is_finished, max_time=max_time):
+            yield data.decode('utf-8', errors='replace'), offset + len(data)
+
+    @classmethod
+    def delete_logs(cls, exc_id):
+        log_shipping.delete_logs(exc_id)
+
     def get_uuid_code(self):
         """ Return the Agave code for this object.
         :return: str
@@ -1783,11 +1966,7 @@ class Worker(AbacoDAO):
             return None
         else:
             val = workers_store[f'{actor_id}_{worker_id}'] = worker
-            abaco_metrics_store.full_update(
-                {'_id': 'stats'},
-                {'$inc': {'worker_total': 1},
-                 '$addToSet': {'worker_dbids': f'{actor_id}_{worker_id}'}},
-                upsert=True)
+            accounting.record_workers_created(tenant)
             logger.info(f"got worker: {val} from add_if_empty.")
             return worker_id
 
@@ -1811,19 +1990,11 @@ class Worker(AbacoDAO):
             # we know this worker_id is new since we just generated it, so we don't need to use the update
             # method.
             workers_store[f'{actor_id}_{worker_id}'] = worker
-            abaco_metrics_store.full_update(
-                {'_id': 'stats'},
-                {'$inc': {'worker_total': 1},
-                 '$addToSet': {'worker_dbids': f'{actor_id}_{worker_id}'}},
-                upsert=True)
+            accounting.record_workers_created(tenant)
             logger.info("added additional worker with id: {} to workers_store.".format(worker_id))
         except KeyError:
             workers_store.add_if_empty([f'{actor_id}_{worker_id}'], worker)
-            abaco_metrics_store.full_update(
-                {'_id': 'stats'},
-                {'$inc': {'worker_total': 1},
-                 '$addToSet': {'worker_dbids': f'{actor_id}_{worker_id}'}},
-                upsert=True)
+            accounting.record_workers_created(tenant)
             logger.info("added first worker with id: {} to workers_store.".format(worker_id))
         return worker_id
 
@@ -1840,13 +2011,19 @@ class Worker(AbacoDAO):
         logger.info("worker {} added to actor: {}".format(worker, actor_id))
 
     @classmethod
-    def update_worker_execution_time(cls, actor_id, worker_id):
-        """Pass db_id as `actor_id` parameter."""
+    def update_worker_execution_time(cls, actor_id, worker_id, write_behind=None):
+        """
+        Pass db_id as `actor_id` parameter. If a store.WriteBehindQueue is passed as `write_behind`, the update is
+        queued and written in the background instead.
+        """
         logger.debug("top of update_worker_execution_time().")
         now = get_current_utc_time()
+        if write_behind:
+            write_behind.put(workers_store, f'{actor_id}_{worker_id}', {'last_execution_time': now})
+            return
         start_timer = timeit.default_timer()
         try:
-            workers_store[f'{actor_id}_{worker_id}', 'last_execution_time'] = now
+            workers_store.update_fields(f'{actor_id}_{worker_id}', {'last_execution_time': now})
         except KeyError as e:
             logger.error("Got KeyError; actor_id: {}; worker_id: {}; exception: {}".format(actor_id, worker_id, e))
             raise e
@@ -1888,7 +2065,7 @@ class Worker(AbacoDAO):
         try:
             # workers can transition to SHUTTING_DOWN from any status
             if status == SHUTTING_DOWN or status == SHUTDOWN_REQUESTED:
-                workers_store[f'{actor_id}_{worker_id}', 'status'] = status
+                workers_store.update_fields(f'{actor_id}_{worker_id}', {'status': status})
                 
             elif status == ERROR:
                 res = workers_store.full_update(
@@ -1999,6 +2176,24 @@ def get_permissions(actor_id):
         raise errors.PermissionsException("Actor {} does not exist".format(actor_id))
 
 
+def get_user_permissions(identifier, user):
+    """
+    Return the permissions of `user` and of the world user on `identifier`, an actor db_id or an alias dbid, in the
+    order of the permissions document; for permission_process(). The result is cached; see auth_cache.py.
+    """
+    WORLD_USER = 'ABACO_WORLD'
+
+    def load():
+        # a user name containing '.' or starting with '$' would change a projection on it, so the two entries are
+        # picked from the whole document.
+        docs = permissions_store.items({'_id': identifier}, proj_inp={'_id': False})
+        if not docs:
+            raise errors.PermissionsException("Actor {} does not exist".format(identifier))
+        return {p_user: p_name for p_user, p_name in docs[0].items() if p_user in (user, WORLD_USER)}
+
+    return permissions_cache.get((identifier, user), load)
+
+
 def get_config_permissions(config_id):
     """ Return all permissions for a config_id
     :param config_id: The unique id of the config (as returned by models.ActorConfig.get_config_db_key()).
@@ -2050,6 +2245,7 @@ def set_permission(user, actor_id, level):
     new = permissions_store.add_if_empty([actor_id, user], str(level))
     if not new:
         permissions_store[actor_id, user] = str(level)
+    invalidate_permissions(actor_id)
     logger.info("Permission set for actor: {}; user: {} at level: {}".format(actor_id, user, level))
 
 
@@ -2075,6 +2271,7 @@ class ActorConfig(AbacoDAO):
         ('is_secret', 'required', 'is_secret', inputs.boolean, 'Whether the config should be encrypted at rest and not retrievable.', None),
         # need write access to actor
         ('actors', 'required', 'actors', str, 'List of actor IDs or aliases that should get this config/secret.', []),
+        ('actor_ids', 'derived', 'actor_ids', list, 'The actor IDs and aliases in `actors`, as a list; indexed.', []),
     ] # take both ids and aliases and figure out which one it is
      # they need write access on actor or alias
     # delete of aliases/ids needs to delete from configs
@@ -2083,6 +2280,10 @@ class ActorConfig(AbacoDAO):
     RESERVED_WORDS = ['executions', 'nonces', 'logs', 'messages', 'adapters', 'admin', 'utilization']
     FORBIDDEN_CHAR = [':', '/', '?', '#', '[', ']', '@', '!', '$', '&', "'", '(', ')', '*', '+', ',', ';', '=', ' ']
 
+    # _id of the document in the abaco_metrics_store counting the changes to configs and aliases; see
+    # bump_generation().
+    GENERATION_KEY = 'actor_configs_generation'
+
     @classmethod
     def get_config_db_key(cls, tenant_id, name):
         """
@@ -2091,20 +2292,50 @@ class ActorConfig(AbacoDAO):
         """
         return f"{tenant_id}_{name}"
 
+    @classmethod
+    def parse_actors(cls, actors):
+        """Returns the list of actor ids and aliases in the comma-separated `actors` string."""
+        if not actors:
+            return []
+        return [a.strip() for a in actors.split(',') if a.strip()]
+
+    @classmethod
+    def bump_generation(cls):
+        """
+        Record that a config or an alias changed, so that workers drop the configs they resolved and cached before
+        (see docker_utils.get_actor_configs()).
+        """
+        abaco_metrics_store.full_update(
+            {'_id': ActorConfig.GENERATION_KEY},
+            {'$inc': {'generation': 1},
+             '$setOnInsert': {'type': 'generation'}},
+            upsert=True)
+
+    @classmethod
+    def get_generation(cls):
+        """Returns the number of changes to configs and aliases recorded with bump_generation()."""
+        try:
+            return abaco_metrics_store[ActorConfig.GENERATION_KEY, 'generation']
+        except KeyError:
+            return 0
+
     def get_derived_value(self, name, d):
         """Compute a derived value for the attribute `name` from the dictionary d of attributes provided."""
-        # first, see if the id attribute is already in the object:
+        # first, see if the attribute is already in the object:
         try:
             if d[name]:
                 return d[name]
         except KeyError:
             pass
+        if name == 'actor_ids':
+            return ActorConfig.parse_actors(d.get('actors'))
         # combine the tenant_id and client_key to get the unique id
         return Client.get_client_id(d['tenant'], d['client_key'])
 
     def display(self):
         """Return a representation fit for display."""
         self.pop('tenant')
+        self.pop('actor_ids', None)
         return self.case()
 
     def check_reserved_words(self):
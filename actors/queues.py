@@ -1,12 +1,34 @@
 import cloudpickle
 import json
+import os
 import rabbitpy
+import rabbitpy.exceptions
 import threading
 import time
 
+from prometheus_client import Counter
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
 from config import Config
 
 
+# pool metrics --
+POOL_CHECKOUTS = Counter('rabbit_pool_checkouts', 'Number of RabbitMQ connections checked out of the pool.')
+POOL_WAITS = Counter('rabbit_pool_waits', 'Number of checkouts that had to wait for a connection to be released.')
+POOL_RECONNECTS = Counter('rabbit_pool_reconnects', 'Number of new RabbitMQ connections opened by the pool.')
+QUEUE_DEPTH_FETCHES = Counter('rabbit_queue_depth_fetches', 'Number of queue depths fetched from RabbitMQ.')
+QUEUE_DEPTH_CACHE_HITS = Counter('rabbit_queue_depth_cache_hits', 'Number of queue depths served from the cache.')
+
+
+def _get_pool_config(option, default):
+    try:
+        return float(Config.get('rabbit', option))
+    except Exception:
+        return default
+
+
 class ChannelClosedException(Exception):
     pass
 
@@ -40,7 +62,231 @@ class RabbitConnection(object):
         del exc_type, exc_val, exc_tb
         self.close()
 
-# rconn = RabbitConnection()
+    def is_open(self):
+        """Whether the underlying connection and channel are still usable."""
+        try:
+            return not self._conn.closed and not self._ch.closed
+        except Exception:
+            return False
+
+
+class RabbitPool(object):
+    """
+    Per-process pool of long-lived RabbitConnection objects. Each checkout gives the caller exclusive use of a
+    connection and its channel (rabbitpy channels are not thread safe) until it is released back to the pool.
+    The pool is bound to the pid that created it; use get_pool() so that a forked child never reuses the parent's
+    sockets.
+    """
+
+    def __init__(self, size=None, idle_timeout=None, declare_ttl=None, wait_timeout=None):
+        self.pid = os.getpid()
+        # max number of connections checked out at once; beyond this, callers wait for up to wait_timeout seconds
+        # and then get an overflow connection that is closed instead of pooled when released.
+        self.size = int(size or _get_pool_config('pool_size', 10))
+        # idle connections older than this (in seconds) are closed instead of being handed out again.
+        self.idle_timeout = idle_timeout or _get_pool_config('pool_idle_timeout', 300)
+        # how long (in seconds) to trust that a queue we already declared still exists.
+        self.declare_ttl = declare_ttl or _get_pool_config('queue_declare_cache_ttl', 60)
+        self.wait_timeout = wait_timeout or _get_pool_config('pool_wait_timeout', 5)
+        self._cond = threading.Condition(threading.Lock())
+        # list of (RabbitConnection, time released) tuples, most recently released last.
+        self._idle = []
+        # number of pooled connections checked out; never more than size.
+        self._checked_out = 0
+        # overflow connections currently checked out; they do not count against size and are closed on release.
+        self._overflow = set()
+        # queue name -> time the queue was last declared
+        self._declared = {}
+
+    def _new_connection(self):
+        POOL_RECONNECTS.inc()
+        return RabbitConnection()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.debug(f"got exception closing pooled rabbit connection; swallowing it. e: {e}")
+
+    def checkout(self):
+        """Get a RabbitConnection for the exclusive use of the caller."""
+        POOL_CHECKOUTS.inc()
+        stale = []
+        conn = None
+        with self._cond:
+            if not self._idle and self._checked_out >= self.size:
+                POOL_WAITS.inc()
+                self._cond.wait_for(lambda: self._idle or self._checked_out < self.size, timeout=self.wait_timeout)
+            # still nothing available after wait_timeout: the caller gets an overflow connection.
+            overflow = not self._idle and self._checked_out >= self.size
+            if not overflow:
+                now = time.time()
+                while self._idle:
+                    candidate, released = self._idle.pop()
+                    if now - released > self.idle_timeout or not candidate.is_open():
+                        stale.append(candidate)
+                        continue
+                    conn = candidate
+                    break
+                self._checked_out += 1
+        for c in stale:
+            self._close_quietly(c)
+        if conn is None:
+            try:
+                conn = self._new_connection()
+            except Exception:
+                if not overflow:
+                    with self._cond:
+                        self._checked_out -= 1
+                        self._cond.notify()
+                raise
+        if overflow:
+            logger.info(f"rabbit pool exhausted after waiting {self.wait_timeout}s; using an overflow connection.")
+            with self._cond:
+                self._overflow.add(conn)
+        return conn
+
+    def release(self, conn, reusable=True):
+        """
+        Return a connection to the pool. Connections that are no longer reusable (e.g., ones that have consumed
+        messages which could still be unacked) are closed instead.
+        """
+        if os.getpid() != self.pid:
+            # the connection belongs to the parent process; never touch its socket.
+            return
+        with self._cond:
+            if conn in self._overflow:
+                self._overflow.discard(conn)
+                keep = False
+            else:
+                self._checked_out = max(self._checked_out - 1, 0)
+                keep = reusable and len(self._idle) < self.size and conn.is_open()
+                if keep:
+                    self._idle.append((conn, time.time()))
+                self._cond.notify()
+        if not keep:
+            t = threading.Thread(target=self._close_quietly, args=(conn,))
+            t.start()
+
+    def is_declared(self, name):
+        with self._cond:
+            declared = self._declared.get(name)
+        return declared is not None and time.time() - declared < self.declare_ttl
+
+    def mark_declared(self, name):
+        with self._cond:
+            self._declared[name] = time.time()
+
+    def forget_declared(self, name):
+        with self._cond:
+            self._declared.pop(name, None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the RabbitPool for the current process, creating a new one after a fork."""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = RabbitPool()
+        return _pool
+
+
+class QueueDepths(object):
+    """
+    Short-lived cache of queue depths (number of ready messages). Depths that are not cached, or are older than
+    the requested max age, are fetched together with passive declares on a single pooled channel. A queue that
+    does not exist has a depth of 0.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else _get_pool_config('queue_depth_ttl', 2)
+        self._lock = threading.Lock()
+        # queue name -> (depth, time fetched)
+        self._depths = {}
+
+    def get(self, names, max_age=None):
+        """Return a dictionary mapping each queue name in `names` to its depth."""
+        if max_age is None:
+            max_age = self.ttl
+        now = time.time()
+        result = {}
+        missing = []
+        with self._lock:
+            for name in names:
+                cached = self._depths.get(name)
+                if cached and now - cached[1] <= max_age:
+                    result[name] = cached[0]
+                else:
+                    missing.append(name)
+        QUEUE_DEPTH_CACHE_HITS.inc(len(result))
+        if missing:
+            fetched = self._fetch(missing)
+            with self._lock:
+                for name, depth in fetched.items():
+                    self._depths[name] = (depth, now)
+            result.update(fetched)
+        return result
+
+    def invalidate(self, name):
+        with self._lock:
+            self._depths.pop(name, None)
+
+    def _fetch(self, names):
+        pool = get_pool()
+        conn = pool.checkout()
+        depths = {}
+        try:
+            for name in names:
+                try:
+                    depths[name] = rabbitpy.Queue(conn._ch, name=name).declare(passive=True)[0]
+                except rabbitpy.exceptions.AMQPNotFound:
+                    depths[name] = 0
+                    # the broker closes the channel after a failed passive declare; continue on a new one.
+                    pool.release(conn, reusable=False)
+                    conn = pool.checkout()
+        finally:
+            pool.release(conn)
+        QUEUE_DEPTH_FETCHES.inc(len(depths))
+        return depths
+
+
+_queue_depths = None
+
+
+def get_queue_depths(names, max_age=None):
+    """
+    Return a dictionary mapping each of the queue `names` to its depth, using the per-process QueueDepths cache.
+    Pass `max_age` (in seconds) to override the configured TTL; 0 always fetches fresh depths.
+    """
+    global _queue_depths
+    if _queue_depths is None:
+        _queue_depths = QueueDepths()
+    return _queue_depths.get(names, max_age=max_age)
+
+
+def invalidate_queue_depth(name):
+    if _queue_depths is not None:
+        _queue_depths.invalidate(name)
+
+
+def _reset_pool_after_fork():
+    # drop (without closing) any connections inherited from the parent process and re-create the lock.
+    global _pool, _pool_lock, _queue_depths
+    _pool = None
+    _pool_lock = threading.Lock()
+    _queue_depths = None
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
 
 class LegacyQueue(object):
     """
@@ -59,12 +305,24 @@ class TaskQueue(object):
         # singleton pattern to work, we would need fof individual functions to not call close() directly, but rather
         # have an automated way at the end of each process/thread execution to close the connection.
 
-        # create a new RabbitConnection for this instance of the task queue.
-        self.conn = RabbitConnection()
+        # UPDATE - connections now come from a per-process pool and are returned to it in close(); the queue
+        # declare is skipped when this process has recently declared the same queue.
+        self._pool = get_pool()
+        self.conn = self._pool.checkout()
         self._ch = self.conn._ch
         self.name = name
+        # cleared once this instance consumes from the queue (the connection may still hold unacked messages) or
+        # puts its channel in transaction mode; such connections are closed instead of returned to the pool.
+        self._reusable = True
         self.queue = rabbitpy.Queue(self._ch, name=name, durable=True)
-        self.queue.declare()
+        if not name or not self._pool.is_declared(name):
+            try:
+                self.queue.declare()
+            except Exception:
+                self._pool.release(self.conn, reusable=False)
+                raise
+            if name:
+                self._pool.mark_declared(name)
         # the following added for backwards compatibility so that client code using the ch._queue._queue attribute
         # will continue to work.
         self._queue = LegacyQueue()
@@ -87,29 +345,77 @@ class TaskQueue(object):
         return msg
 
     def put(self, m):
+        if self.conn is None:
+            raise ChannelClosedException()
         msg = rabbitpy.Message(self.conn._ch, self._pre_process(m), {})
         msg.publish('', self.name)
 
+    def put_many(self, ms):
+        """
+        Publish a list of messages as a single AMQP transaction; the broker confirms the whole batch on commit,
+        and none of the messages are delivered if the commit fails.
+        """
+        if self.conn is None:
+            raise ChannelClosedException()
+        # once in transaction mode, the channel cannot be handed out for regular publishing.
+        self._reusable = False
+        with rabbitpy.Tx(self.conn._ch):
+            for m in ms:
+                msg = rabbitpy.Message(self.conn._ch, self._pre_process(m), {})
+                msg.publish('', self.name)
+
     # def close(self):
     #     self.conn.close()
 
     def close(self):
-        def _close(this):
-            this.conn.close()
-
-        t = threading.Thread(target=_close, args=(self,))
-        t.start()
+        conn = self.conn
+        if conn is None:
+            return
+        self.conn = None
+        self._pool.release(conn, reusable=self._reusable)
 
     def delete(self):
+        self._pool.forget_declared(self.name)
         self.queue.delete()
 
+    def get(self, timeout, poll_interval=1):
+        """
+        Get a single message, waiting up to `timeout` seconds for one to arrive; returns None on timeout. The message
+        is acked when it is received. Unlike get_one(), this polls, so it is meant for rarely used queues.
+        """
+        if self.conn is None:
+            raise ChannelClosedException()
+        deadline = time.time() + timeout
+        while True:
+            msg = self.queue.get(acknowledge=False)
+            if msg is not None:
+                return self._post_process(msg)
+            if time.time() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
     def get_one(self):
         """Blocking method to get a single message without polling."""
         if self._queue is None:
             raise ChannelClosedException()
+        self._reusable = False
         for msg in self.queue.consume(prefetch=1):
             return self._post_process(msg), msg
 
+    def get_nowait(self):
+        """
+        Get a single message if one is waiting, without blocking; returns a (message, msg) tuple like get_one(), or
+        None. The message is not acked when it is received. Since basic.get is not limited by the prefetch, this can
+        be called while a message from get_one() is still unacked.
+        """
+        if self.conn is None:
+            raise ChannelClosedException()
+        self._reusable = False
+        msg = self.queue.get(acknowledge=True)
+        if msg is None:
+            return None
+        return self._post_process(msg), msg
+
 
 class JsonTaskQueue(TaskQueue):
     """
@@ -7,7 +7,7 @@ from agaveflask.utils import AgaveApi, handle_error
 from controllers import ActorResource, AliasesResource, AliasResource, AliasNoncesResource, AliasNonceResource, \
     ActorStateResource, ActorsResource, \
     ActorExecutionsResource, ActorExecutionResource, ActorExecutionResultsResource, \
-    ActorExecutionLogsResource, ActorNoncesResource, ActorNonceResource, \
+    ActorExecutionLogsResource, ActorExecutionLogsStreamResource, ActorNoncesResource, ActorNonceResource, \
     AbacoUtilizationResource, SearchResource, CronResource, ActorConfigResource, ActorConfigsResource
 from auth import authn_and_authz
 from errors import errors
@@ -48,6 +48,8 @@ api.add_resource(ActorExecutionResultsResource, '/actors/<string:actor_id>/execu
 api.add_resource(ActorNoncesResource, '/actors/<string:actor_id>/nonces')
 api.add_resource(ActorNonceResource, '/actors/<string:actor_id>/nonces/<string:nonce_id>')
 api.add_resource(ActorExecutionLogsResource, '/actors/<string:actor_id>/executions/<string:execution_id>/logs')
+api.add_resource(ActorExecutionLogsStreamResource,
+                 '/actors/<string:actor_id>/executions/<string:execution_id>/logs/stream')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', debug=True)
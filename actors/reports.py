@@ -133,7 +133,8 @@ def get_actors_executions_for_report():
     # Write some summary keys based on existing data.
     result['summary']['total_actors_existing_with_executions'] = len(actor_info_dict)
     result['summary']['total_actors_all_with_executions'] = len(actors_with_executions)
-    result['summary']['total_actors_all'] += metrics_big_list[0]['actor_total']
+    result['summary']['total_actors_all'] += sum(m.get('actors_total', 0) for m in metrics_big_list
+                                                  if m.get('type') == 'bucket')
     result['summary']['total_actors_existing'] += len(actor_big_list)
 
     # Return either full result or just the summary. 
@@ -1,19 +1,24 @@
+import concurrent.futures
 import json
 import os
+import threading
 import time
+import timeit
 
 import rabbitpy
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 
 from channelpy.exceptions import ChannelTimeoutException
 
 from codes import BUSY, ERROR, SPAWNER_SETUP, PULLING_IMAGE, CREATING_CONTAINER, UPDATING_STORE, READY, \
     REQUESTED, SHUTDOWN_REQUESTED, SHUTTING_DOWN
 from config import Config
-from docker_utils import DockerError, run_worker, pull_image
+from docker_utils import DockerError, run_worker, pull_image_shared, run_warm_worker, container_is_running, rename_container, \
+    rm_container, get_worker_dict
 from errors import WorkerException
 from models import Actor, Worker
 from stores import actors_store, workers_store
-from channels import ActorMsgChannel, ClientsChannel, CommandChannel, WorkerChannel, SpawnerWorkerChannel
+from channels import ClientsChannel, CommandChannel, WorkerChannel, SpawnerWorkerChannel, publish_revision
 from health import get_worker
 
 from agaveflask.logs import get_logger
@@ -26,6 +31,27 @@ except:
 MAX_WORKERS = int(MAX_WORKERS)
 logger.info("Spawner running with MAX_WORKERS = {}".format(MAX_WORKERS))
 
+WARM_POOL_REQUESTS = Counter('spawner_warm_pool_requests',
+                             'Number of worker starts that did (hit) or did not (miss) get a warm worker.',
+                             ['result'])
+WARM_POOL_IDLE = Gauge('spawner_warm_pool_idle', 'Number of idle warm workers held by this spawner.', ['image'])
+COMMAND_WAIT_SECONDS = Histogram('spawner_command_wait_seconds',
+                                 'Time from a command being put on the command channel to the spawner starting to '
+                                 'process it.')
+COMMAND_PROCESSING_SECONDS = Histogram('spawner_command_processing_seconds',
+                                       'Time the spawner spent processing a command.')
+COMMANDS_IN_PROGRESS = Gauge('spawner_commands_in_progress', 'Number of commands the spawner is processing.')
+WORKER_READY_SECONDS = Histogram('spawner_worker_ready_seconds',
+                                 'Time from the spawner starting to process a command to the worker being READY.',
+                                 ['path'])
+
+
+def _get_spawner_config(option, default, typ=int):
+    try:
+        return typ(Config.get('spawner', option))
+    except Exception:
+        return default
+
 
 class SpawnerException(Exception):
     def __init__(self, message):
@@ -33,6 +59,121 @@ class SpawnerException(Exception):
         self.message = message
 
 
+class WarmPool(object):
+    """
+    Idle worker containers that are not yet bound to an actor. Binding a warm worker to an actor skips creating the
+    worker container and the spawner/worker handshake. Generic warm workers can be bound to any actor; warm
+    workers for one of the configured popular images also have that image pulled already.
+    Warm workers older than `max_idle` seconds are replaced; the worker containers exit on their own if they are
+    not bound within twice that time, so warm workers left behind by a dead spawner do not linger.
+    """
+
+    def __init__(self, size=0, images=None, image_size=1, max_idle=1800):
+        # number of generic warm workers to keep.
+        self.size = size
+        # images to keep `image_size` warm workers for.
+        self.images = images or []
+        self.image_size = image_size
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        # list of {'id', 'cid', 'image', 'create_time'} dictionaries; 'image' is None for generic warm workers.
+        self._idle = []
+
+    @classmethod
+    def from_config(cls):
+        """Return the WarmPool configured in the [spawner] stanza, or None if no warm workers are configured."""
+        size = _get_spawner_config('warm_pool_size', 0)
+        images = _get_spawner_config('warm_pool_images', '', str)
+        images = [i.strip() for i in images.split(',') if i.strip()]
+        if not size and not images:
+            return None
+        return cls(size=size,
+                   images=images,
+                   image_size=_get_spawner_config('warm_pool_image_size', 1),
+                   max_idle=_get_spawner_config('warm_pool_max_idle', 1800))
+
+    def targets(self):
+        """Dictionary of image (None for generic) to the number of warm workers to keep."""
+        targets = {}
+        if self.size:
+            targets[None] = self.size
+        for image in self.images:
+            targets[image] = self.image_size
+        return targets
+
+    def _set_gauges(self):
+        for image in self.targets():
+            WARM_POOL_IDLE.labels(image or 'generic').set(len([w for w in self._idle if w['image'] == image]))
+
+    def checkout(self, image):
+        """
+        Take a running warm worker out of the pool for `image`, preferring one that already has the image pulled.
+        Returns None when the pool has no warm worker.
+        """
+        while True:
+            with self._lock:
+                candidates = [w for w in self._idle if w['image'] == image] or \
+                             [w for w in self._idle if w['image'] is None]
+                warm = candidates[0] if candidates else None
+                if warm:
+                    self._idle.remove(warm)
+                self._set_gauges()
+            if not warm:
+                WARM_POOL_REQUESTS.labels('miss').inc()
+                return None
+            if container_is_running(warm['cid']):
+                WARM_POOL_REQUESTS.labels('hit').inc()
+                return warm
+            logger.info(f"warm worker {warm['id']} is no longer running; discarding it.")
+            self.discard(warm)
+
+    def start(self, image=None):
+        """Start a new warm worker, pulling `image` first if it is given."""
+        if image:
+            pull_image_shared(image)
+        warm_id = Worker.get_uuid()
+        cid = run_warm_worker(warm_id, bind_timeout=self.max_idle * 2)
+        with self._lock:
+            self._idle.append({'id': warm_id, 'cid': cid, 'image': image, 'create_time': time.time()})
+            self._set_gauges()
+        logger.info(f"started warm worker {warm_id} for image: {image}.")
+
+    def discard(self, warm):
+        try:
+            rm_container(warm['cid'])
+        except Exception as e:
+            logger.info(f"got exception removing warm worker {warm['id']}; e: {e}")
+
+    def retire_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [w for w in self._idle if now - w['create_time'] > self.max_idle]
+            for warm in expired:
+                self._idle.remove(warm)
+            self._set_gauges()
+        for warm in expired:
+            logger.debug(f"retiring warm worker {warm['id']}.")
+            self.discard(warm)
+
+    def refill(self):
+        """Replace expired warm workers and start new ones until the configured sizes are reached."""
+        self.retire_expired()
+        for image, n in self.targets().items():
+            with self._lock:
+                missing = n - len([w for w in self._idle if w['image'] == image])
+            for _ in range(missing):
+                self.start(image)
+
+    def maintain(self, interval=10):
+        """Loop that keeps the pool filled; run it in a background thread."""
+        while True:
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"spawner got exception refilling the warm pool; e: {e}")
+            time.sleep(interval)
+
+
 class Spawner(object):
 
     def __init__(self):
@@ -46,9 +187,23 @@ class Spawner(object):
         except Exception as e:
             logger.critical("Spawner not configured with a host_id! Aborting! Exception: {}".format(e))
             raise e
+        self.warm_pool = WarmPool.from_config()
+        # number of commands processed at once; commands block on image pulls, client generation and docker, so
+        # processing them concurrently keeps one slow command from holding up the others.
+        self.concurrency = max(min(_get_spawner_config('max_concurrent_commands', 4), MAX_WORKERS), 1)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        # number of commands currently being processed; their workers count against MAX_WORKERS.
+        self.in_progress = 0
 
     def run(self):
+        if self.warm_pool:
+            t = threading.Thread(target=self.warm_pool.maintain, daemon=True)
+            t.start()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
         while True:
+            # wait for one of the command processing threads to be free before taking another command.
+            self._slots.acquire()
             # check resource threshold before subscribing
             while True:
                 if self.overloaded():
@@ -61,68 +216,103 @@ class Spawner(object):
             # directly ack the messages from the command channel; problems generated from starting workers are
             # handled downstream; e.g., by setting the actor in an ERROR state; command messages should not be re-queued
             msg_obj.ack()
-            try:
-                self.process(cmd)
-            except Exception as e:
-                logger.error("spawner got an exception trying to process cmd: {}. "
-                             "Exception type: {}. Exception: {}".format(cmd, type(e), e))
+            with self._lock:
+                self.in_progress += 1
+            COMMANDS_IN_PROGRESS.inc()
+            executor.submit(self.process_cmd, cmd)
+
+    def process_cmd(self, cmd):
+        """Process a command in one of the command processing threads and then free up its slot."""
+        start = time.time()
+        if cmd.get('time_queued'):
+            COMMAND_WAIT_SECONDS.observe(max(start - cmd['time_queued'], 0))
+        try:
+            self.process(cmd)
+        except Exception as e:
+            logger.error("spawner got an exception trying to process cmd: {}. "
+                         "Exception type: {}. Exception: {}".format(cmd, type(e), e))
+        finally:
+            COMMAND_PROCESSING_SECONDS.observe(time.time() - start)
+            COMMANDS_IN_PROGRESS.dec()
+            with self._lock:
+                self.in_progress -= 1
+            self._slots.release()
 
     def get_tot_workers(self):
         logger.debug("top of get_tot_workers")
-        self.tot_workers = 0
         logger.debug('spawner host_id: {}'.format(self.host_id))
-        for worker_info in workers_store.items():
-            try:
-                if worker_info['host_id'] == self.host_id:
-                    self.tot_workers += 1
-            except KeyError:
-                continue
+        self.tot_workers = len(workers_store.items({'host_id': self.host_id}, {'_id': True}))
         logger.debug("returning total workers: {}".format(self.tot_workers))
         return self.tot_workers
 
     def overloaded(self):
         logger.debug("top of overloaded")
         self.get_tot_workers()
-        logger.info("total workers for this host: {}".format(self.tot_workers))
-        if self.tot_workers >= MAX_WORKERS:
+        with self._lock:
+            in_progress = self.in_progress
+        # idle warm workers are running containers on this host but are not in the workers_store until bound.
+        warm = 0
+        if self.warm_pool:
+            with self.warm_pool._lock:
+                warm = len(self.warm_pool._idle)
+        logger.info("total workers for this host: {}; commands in progress: {}; idle warm workers: {}".format(
+            self.tot_workers, in_progress, warm))
+        if self.tot_workers + in_progress + warm >= MAX_WORKERS:
             return True
 
-    def stop_workers(self, actor_id, worker_ids):
-        """Stop existing workers; used when updating an actor's image."""
+    def stop_workers(self, actor_id, worker_ids, revision=None):
+        """
+        Stop existing workers; used when updating an actor's image. The workers of the actor, except `worker_ids` and
+        the workers of `revision`, finish their running executions and shut down gracefully. With a `revision` of
+        None, all workers except `worker_ids` are stopped.
+
+        The change is published on the actor's revision exchange (see channels.publish_revision()), which reaches the
+        workers following it right away. The exchange does not hold messages for workers that are not following it
+        at that moment (e.g., while they start or reconnect), so a 'drain' message is also sent to the worker
+        channel of each of the workers to stop. Raises WorkerException only when neither could be sent.
+        """
         logger.debug("Top of stop_workers() for actor: {}.".format(actor_id))
+        # since this is an update, there are new workers being started, so the workers don't delete the actor msg
+        # channel.
+        published = publish_revision(actor_id, revision, keep=worker_ids)
+        if published:
+            logger.info(f"Published revision {revision} to the workers of actor: {actor_id}; keeping: {worker_ids}")
         try:
             workers_list = workers_store.items({'actor_id': actor_id})
         except KeyError:
             logger.debug("workers_store had no workers for actor: {}".format(actor_id))
             workers_list = []
-
-        # if there are existing workers, we need to close the actor message channel and
-        # gracefully shutdown the existing worker processes.
-        if len(workers_list) > 0:
-            logger.info(f"Found {len(workers_list)} workers to stop.")
-            # first, close the actor msg channel to prevent any new messages from being pulled
-            # by the old workers.
-            actor_ch = ActorMsgChannel(actor_id)
-            actor_ch.close()
-            logger.info("Actor channel closed for actor: {}".format(actor_id))
-            # now, send messages to workers for a graceful shutdown:
-            for worker in workers_list:
-                # don't stop the new workers:
-                if worker['id'] not in worker_ids:
-                    ch = WorkerChannel(worker_id=worker['id'])
-                    # since this is an update, there are new workers being started, so
-                    # don't delete the actor msg channel:
-                    ch.put('stop-no-delete')
-                    logger.info(f"Sent 'stop-no-delete' message to worker_id: {worker['id']}")
-                    ch.close()
-                else:
-                    logger.debug("skipping worker {worker} as it it not in worker_ids.")
-        else:
-            logger.info("No workers to stop.")
+        failed = []
+        for worker in workers_list:
+            # don't stop the new workers:
+            if worker['id'] in worker_ids:
+                logger.debug(f"skipping worker {worker['id']} as it is in worker_ids.")
+                continue
+            if not self.drain_worker(worker['id'], revision):
+                failed.append(worker['id'])
+        if failed and not published:
+            raise WorkerException(f"Could not send the revision change to workers {failed} of actor {actor_id}.")
+
+    def drain_worker(self, worker_id, revision, attempts=3):
+        """Send 'drain' to the worker channel of a worker, retrying up to `attempts` times. Returns whether it was sent."""
+        for attempt in range(attempts):
+            try:
+                ch = WorkerChannel(worker_id=worker_id)
+                # the worker ignores it if it is of `revision` itself:
+                ch.put({'drain': revision})
+                ch.close()
+                logger.info(f"Sent 'drain' message for revision {revision} to worker_id: {worker_id}")
+                return True
+            except Exception as e:
+                logger.error(f"spawner got exception sending 'drain' to worker_id: {worker_id}; "
+                             f"attempt: {attempt + 1}; e: {e}")
+                time.sleep(1)
+        return False
 
     def process(self, cmd):
         """Main spawner method for processing a command from the CommandChannel."""
         logger.info("top of process; cmd: {}".format(cmd))
+        start_timer = timeit.default_timer()
         actor_id = cmd['actor_id']
         try:
             actor = Actor.from_db(actors_store[actor_id])
@@ -215,6 +405,28 @@ class Spawner(object):
                     client_secret = self.client_generation(actor_id, worker_id, tenant)
             else:
                 logger.debug("actor's token attribute was False. Not generating client.")
+
+        # ---- bind a warm worker, if the pool has one -------
+        warm = self.warm_pool.checkout(image) if self.warm_pool else None
+        if warm:
+            logger.debug(f"spawner binding warm worker {warm['id']} as worker {worker_id}")
+            try:
+                self.bind_warm_worker(warm, image, revision, tenant, actor_id, worker_id, client_id,
+                                      client_access_token, client_refresh_token, api_server, client_secret)
+            except Exception as e:
+                msg = "Spawner got an exception trying to bind a warm worker. Exception:{}".format(e)
+                logger.error(msg)
+                self.warm_pool.discard(warm)
+                self.error_out_actor(actor_id, worker_id, msg)
+                if client_id:
+                    self.delete_client(tenant, actor_id, worker_id, client_id, client_secret)
+                return
+            WORKER_READY_SECONDS.labels('warm').observe(timeit.default_timer() - start_timer)
+            if stop_existing:
+                logger.info("Stopping existing workers: {}".format(worker_id))
+                self.stop_workers(actor_id, [worker_id], revision)
+            return
+
         ch = SpawnerWorkerChannel(worker_id=worker_id)
 
         logger.debug("spawner attempting to start worker; worker_id: {}".format(worker_id))
@@ -241,13 +453,14 @@ class Spawner(object):
             return
 
         logger.debug("Returned from start_worker; Created new worker: {}".format(worker))
+        WORKER_READY_SECONDS.labels('cold').observe(timeit.default_timer() - start_timer)
         ch.close()
         logger.debug("Client channel closed")
 
         if stop_existing:
             logger.info("Stopping existing workers: {}".format(worker_id))
             # TODO - update status to stop_requested
-            self.stop_workers(actor_id, [worker_id])
+            self.stop_workers(actor_id, [worker_id], revision)
 
 
     def client_generation(self, actor_id, worker_id, tenant):
@@ -356,7 +569,7 @@ class Spawner(object):
         Worker.update_worker_status(actor_id, worker_id, PULLING_IMAGE)
         try:
             logger.debug("Worker pulling image {}...".format(image))
-            pull_image(image)
+            pull_image_shared(image)
         except DockerError as e:
             # return a message to the spawner that there was an error pulling image and abort.
             # this is not necessarily an error state: the user simply could have provided an
@@ -411,6 +624,55 @@ class Spawner(object):
             break
         logger.debug('finished loop')
         worker_dict['ch_name'] = WorkerChannel.get_name(worker_id)
+        self.set_actor_ready(actor_id, worker_id)
+        # finalize worker with READY status
+        worker = Worker(tenant=tenant, **worker_dict)
+        logger.info("calling add_worker for worker: {}.".format(worker))
+        Worker.add_worker(actor_id, worker)
+
+        ch.put('READY')  # step 4
+        logger.info('sent message through channel')
+
+    def bind_warm_worker(self,
+                         warm,
+                         image,
+                         revision,
+                         tenant,
+                         actor_id,
+                         worker_id,
+                         client_id,
+                         client_access_token,
+                         client_refresh_token,
+                         api_server,
+                         client_secret):
+        """Bind the warm worker `warm` (see WarmPool) to an actor as the worker `worker_id`."""
+        if not warm['image'] == image:
+            Worker.update_worker_status(actor_id, worker_id, PULLING_IMAGE)
+            logger.debug("Worker pulling image {}...".format(image))
+            pull_image_shared(image)
+        # give the container the name it would have had as a regular worker.
+        rename_container(warm['cid'], 'worker_{}_{}'.format(actor_id, worker_id))
+        worker_dict = get_worker_dict(image, worker_id, warm['cid'])
+        worker_dict['ch_name'] = WorkerChannel.get_name(worker_id)
+        self.set_actor_ready(actor_id, worker_id)
+        worker = Worker(tenant=tenant, **worker_dict)
+        logger.info("calling add_worker for warm worker: {}.".format(worker))
+        Worker.add_worker(actor_id, worker)
+        ch = SpawnerWorkerChannel(worker_id=warm['id'])
+        ch.put({'worker_id': worker_id,
+                'actor_id': actor_id,
+                'image': image,
+                'revision': revision,
+                'tenant': tenant,
+                'api_server': api_server,
+                'client_id': client_id,
+                'client_secret': client_secret,
+                'client_access_token': client_access_token,
+                'client_refresh_token': client_refresh_token})
+        ch.close()
+        logger.info(f"sent bind message to warm worker {warm['id']}")
+
+    def set_actor_ready(self, actor_id, worker_id):
         # if the actor is not already in READY status, set actor status to READY before worker status has been
         # set to READY.
         # it is possible the actor status is already READY because this request is the autoscaler starting a new worker
@@ -429,13 +691,6 @@ class Spawner(object):
                 # so, the worker should have a stop message waiting for it. starting subscribe
                 # as usual should allow this process to work as expected.
                 pass
-        # finalize worker with READY status
-        worker = Worker(tenant=tenant, **worker_dict)
-        logger.info("calling add_worker for worker: {}.".format(worker))
-        Worker.add_worker(actor_id, worker)
-
-        ch.put('READY')  # step 4
-        logger.info('sent message through channel')
 
     def error_out_actor(self, actor_id, worker_id, message):
         """In case of an error, put the actor in error state and kill all workers"""
@@ -495,6 +750,10 @@ class Spawner(object):
 
 
 def main():
+    # spawners are not web processes, so they serve their metrics themselves when a port is configured.
+    metrics_port = _get_spawner_config('metrics_port', None)
+    if metrics_port:
+        start_http_server(metrics_port)
     # todo - find something more elegant
     idx = 0
     while idx < 3:
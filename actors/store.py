@@ -1,15 +1,18 @@
 
 import collections
 from datetime import datetime, timedelta
+import functools
 import json
+import operator
 import os
+import threading
 import urllib.parse
 
 import configparser
 import pprint
 import redis
 from pymongo.errors import WriteError, DuplicateKeyError
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 
 from config import Config
 
@@ -31,6 +34,25 @@ def _do_set(setter, key, value):
     obj = json.dumps(value)
     setter(key, obj.encode('utf-8'))
 
+@functools.lru_cache(maxsize=1024)
+def _field_accessor(path):
+    """
+    Return a function that extracts the value at `path`, a tuple of (nested) field names, from a document.
+    Accessors are built once per path and cached; a missing field raises KeyError.
+    """
+    if not path:
+        return lambda doc: doc
+    if len(path) == 1:
+        return operator.itemgetter(path[0])
+    getters = tuple(operator.itemgetter(f) for f in path)
+
+    def accessor(doc):
+        for getter in getters:
+            doc = getter(doc)
+        return doc
+    return accessor
+
+
 class StoreMutexException(Exception):
     pass
 
@@ -126,14 +148,18 @@ class MongoStore(AbstractStore):
         Atomically does either:
         Gets and returns 'self[key]' or 'self[key][field1][field2][...]' as a dictionary
         """
-        key, _, subscripts = self._process_inputs(fields)
+        key, dots, subscripts = self._process_inputs(fields)
+        # only fetch the requested field when one is given
+        projection = {'_id': False}
+        if subscripts:
+            projection[dots] = True
         result = self._db.find_one(
             {'_id': key},
-            projection={'_id': False})
+            projection=projection)
         if result == None:
             raise KeyError(f"'_id' of '{key}' not found")
         try:
-            return eval('result' + subscripts)
+            return _field_accessor(self._subfields(fields))(result)
         except KeyError:
             raise KeyError(f"Subscript of {subscripts} does not exists in document of '_id' {key}")
 
@@ -218,6 +244,16 @@ class MongoStore(AbstractStore):
             subscripts = "['" + "']['".join(fields[1:]) + "']"
         return key, dots, subscripts
 
+    @staticmethod
+    def _subfields(fields):
+        """
+        Returns the tuple of fields below the key (ex. ('field1', 'field2')) for use with _field_accessor;
+        the tuple is empty when `fields` is just the key.
+        """
+        if isinstance(fields, str) or len(fields) < 2:
+            return ()
+        return tuple(fields[1:])
+
     def _prepset(self, value):
         if type(value) is bytes:
             return value.decode('utf-8')
@@ -241,12 +277,48 @@ class MongoStore(AbstractStore):
         else:
             result = self._db.find_one_and_update(
                 filter={'_id': key},
-                update={'$unset': {dots: ''}})
+                update={'$unset': {dots: ''}},
+                projection={'_id': False, dots: True})
+            if result == None:
+                raise KeyError(f"'_id' of '{key}' not found")
             try:
-                return eval('result' + subscripts)
+                return _field_accessor(self._subfields(fields))(result)
             except KeyError:
                 raise KeyError(f"Subscript of {subscripts} does not exist in document of '_id' {key}")
 
+    def update_fields(self, key, fields, upsert=False, log_ex=None):
+        """
+        Atomically sets many fields of 'self[key]' with a single '$set'.
+        `fields` maps each field to its new value; nested fields can be given in dot notation ('field1.field2')
+        or as a tuple of field names.
+        If `log_ex` is passed, also sets the 'exp' field used with the MongoDB TTL expiration index (see
+        set_with_expiry).
+        Raises KeyError if no document with '_id' `key` exists and `upsert` is False.
+        """
+        update = {}
+        for field, value in fields.items():
+            if not isinstance(field, str):
+                field = '.'.join(field)
+            update[field] = self._prepset(value)
+        if log_ex is not None:
+            update['exp'] = self._expiry_time(log_ex)
+        result = self._db.update_one(
+            filter={'_id': key},
+            update={'$set': update},
+            upsert=upsert)
+        if not upsert and result.matched_count == 0:
+            raise KeyError(f"'_id' of '{key}' not found")
+        return result
+
+    def _expiry_time(self, log_ex):
+        """
+        Returns the 'exp' time to set so that the TTL index, which is configured with the global log_ex, expires
+        the document after `log_ex` seconds.
+        """
+        log_ex_config = int(Config.get('web','log_ex'))
+        time_change = log_ex_config - log_ex
+        return datetime.utcnow() - timedelta(seconds=time_change)
+
     def set_with_expiry(self, fields, value, log_ex):
         """
         Atomically:
@@ -275,6 +347,15 @@ class MongoStore(AbstractStore):
         result = self._db.update_one(key, value, upsert)
         return result
 
+    def bulk_update(self, updates, upsert=False):
+        """
+        Applies many updates in a single round trip; `updates` is a list of (filter, update) tuples, each applied as
+        with full_update().
+        """
+        if not updates:
+            return None
+        return self._db.bulk_write([UpdateOne(key, value, upsert=upsert) for key, value in updates], ordered=False)
+
     def getset(self, fields, value):
         """
         Atomically does either:
@@ -284,14 +365,15 @@ class MongoStore(AbstractStore):
         key, dots, subscripts = self._process_inputs(fields)
         result = self._db.find_one_and_update(
             filter={'_id': key, dots: {'$exists': True}},
-            update={'$set': {dots: value}})
+            update={'$set': {dots: value}},
+            projection={'_id': False, dots: True})
         if result == None:
             raise KeyError(f"1Subscript of {subscripts} does not exist in document of '_id' {key}")   
         try:
             if len(fields) == 1:
-                return eval(f"result['{key}']")
+                return result[key]
             else:
-                return eval('result' + subscripts)
+                return _field_accessor(self._subfields(fields))(result)
         except KeyError:
             raise KeyError(f"Subscript of {subscripts} does not exist in document of '_id' {key}")
 
@@ -301,6 +383,17 @@ class MongoStore(AbstractStore):
             filter=filter_inp,
             projection=proj_inp))
 
+    def insert_many(self, items):
+        """
+        Inserts many new documents in a single round trip.
+        `items` is a dictionary mapping each key ('_id') to its document; returns the list of inserted keys.
+        """
+        docs = [dict(value, _id=key) for key, value in items.items()]
+        if not docs:
+            return []
+        result = self._db.insert_many(docs, ordered=False)
+        return result.inserted_ids
+
     def add_if_empty(self, fields, value):
         """
         Atomically:
@@ -340,8 +433,51 @@ class MongoStore(AbstractStore):
         except DuplicateKeyError:
             return None
     
+    def delete_many(self, filter_inp):
+        """Deletes all documents matching `filter_inp` in a single round trip; returns the number deleted."""
+        return self._db.delete_many(filter_inp).deleted_count
+
     def aggregate(self, pipeline, options = None):
         return self._db.aggregate(pipeline, options)
 
     def create_index(self, index_list):
-        return self._db.create_index(index_list)
\ No newline at end of file
+        return self._db.create_index(index_list)
+
+class WriteBehindQueue(object):
+    """
+    Buffers non-critical field updates and writes them from a background thread every `interval` seconds.
+    Updates to the same key of the same store are coalesced so that only the latest value of each field is
+    written, with a single update_fields() call.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, store, key, fields):
+        with self._lock:
+            _, _, pending = self._pending.setdefault((id(store), key), (store, key, {}))
+            pending.update(fields)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for store, key, fields in pending.values():
+            try:
+                store.update_fields(key, fields)
+            except Exception as e:
+                logger.error(f"Got exception writing fields {list(fields.keys())} for key {key}; e: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and write anything still pending."""
+        self._stop.set()
+        self._thread.join()
+        self.flush()
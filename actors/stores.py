@@ -2,7 +2,7 @@ from functools import partial
 import os
 
 import configparser
-from pymongo import errors, TEXT
+from pymongo import errors, ASCENDING, TEXT
 
 from store import MongoStore
 from config import Config
@@ -33,7 +33,9 @@ mongo_config_store = partial(
     password=mongo_password)
 
 logs_store = mongo_config_store(db='1')
-# create an expiry index for the log store if we want logs to expire
+# chunks of execution logs; see log_shipping.py
+log_chunks_store = mongo_config_store(db='13')
+# create an expiry index for the log stores if we want logs to expire
 log_ex = Config.get('web', 'log_ex')
 #logger.debug(f"{log_ex}")
 try:
@@ -42,14 +44,15 @@ try:
     logger.debug("42")
     if not log_ex == -1:
         logger.debug("44")
-        try:
-            logger.debug(f"{logs_store._db.index_information()}")
-            logs_store._db.create_index("exp", expireAfterSeconds=log_ex)
-            logger.debug(f"{logs_store._db.index_information()}")
-        except errors.OperationFailure:
-            logger.debug("49")
-            # this will happen if the index already exists.
-            pass
+        for store in (logs_store, log_chunks_store):
+            try:
+                logger.debug(f"{store._db.index_information()}")
+                store._db.create_index("exp", expireAfterSeconds=log_ex)
+                logger.debug(f"{store._db.index_information()}")
+            except errors.OperationFailure:
+                logger.debug("49")
+                # this will happen if the index already exists.
+                pass
 except (ValueError, configparser.NoOptionError):
     logger.debug("53")
     pass
@@ -68,6 +71,24 @@ configs_permissions_store = mongo_config_store(db='12')
 
 # Indexing
 logs_store.create_index([('$**', TEXT)])
+log_chunks_store.create_index([('logs', TEXT)])
 executions_store.create_index([('$**', TEXT)])
 actors_store.create_index([('$**', TEXT)])
-workers_store.create_index([('$**', TEXT)])
\ No newline at end of file
+workers_store.create_index([('$**', TEXT)])
+
+# usage counter documents are read by type (and tenant/hour); see accounting.py
+abaco_metrics_store.create_index([('type', ASCENDING), ('tenant', ASCENDING), ('hour', ASCENDING)])
+
+# the autoscaler groups workers by actor_id; see metrics_utils.Autoscaler
+workers_store.create_index([('actor_id', ASCENDING)])
+# spawners count the workers on their host before taking each command
+workers_store.create_index([('host_id', ASCENDING)])
+# logs are reassembled from their chunks in order, and tailed from an offset
+log_chunks_store.create_index([('execution_id', ASCENDING), ('seq', ASCENDING)])
+log_chunks_store.create_index([('execution_id', ASCENDING), ('end', ASCENDING)])
+# workers look up the aliases of an actor, then the configs of the actor and its aliases (multikey index on the
+# actor_ids list); see docker_utils.resolve_actor_configs()
+alias_store.create_index([('actor_id', ASCENDING), ('tenant', ASCENDING)])
+# actors are listed per tenant, in order of their key, a page at a time; see models.Actor.list_actors()
+actors_store.create_index([('tenant', ASCENDING), ('_id', ASCENDING)])
+configs_store.create_index([('actor_ids', ASCENDING)])
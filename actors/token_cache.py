@@ -0,0 +1,142 @@
+"""
+Access token cache for workers.
+
+Actors with an OAuth client get a fresh access token in the _abaco_access_token variable of every execution. Instead of
+refreshing the token before each execution, a worker caches it with its expiration and a background thread refreshes
+it [workers] token_refresh_margin seconds before it expires, so executions only wait for a refresh when no valid
+token is available: when the worker starts, and when the background refreshes keep failing until the token expires.
+
+Refresh latency and failures are recorded in prometheus metrics, served by workers on [workers] metrics_port when it
+is configured.
+"""
+import threading
+import time
+import timeit
+
+from prometheus_client import Counter, Histogram
+
+from config import Config
+
+from agaveflask.logs import get_logger
+logger = get_logger(__name__)
+
+TOKEN_REFRESH_SECONDS = Histogram('worker_token_refresh_seconds',
+                                  'Time taken by a worker to refresh its access token, in seconds.',
+                                  ['outcome'])
+TOKEN_REFRESH_FAILURES = Counter('worker_token_refresh_failures',
+                                 'Number of failed attempts by a worker to refresh its access token.',
+                                 ['background'])
+TOKEN_CACHE_HITS = Counter('worker_token_cache_hits', 'Number of executions given a cached access token.')
+TOKEN_CACHE_WAITS = Counter('worker_token_cache_waits',
+                            'Number of executions that waited for the access token to be refreshed.')
+
+# a cached token is not handed to an execution if it expires within this many seconds.
+MIN_VALIDITY = 30
+
+
+def _get_config(option, default, typ=int):
+    try:
+        return typ(Config.get('workers', option))
+    except Exception:
+        return default
+
+
+class TokenCache(object):
+    """
+    Caches the access token of the Agave client `ag`, refreshing it in a background thread ahead of its expiration.
+    """
+
+    def __init__(self, ag, refresh_margin=None, retry_interval=2, max_attempts=10):
+        self.ag = ag
+        self.refresh_margin = refresh_margin if refresh_margin is not None else \
+            _get_config('token_refresh_margin', 300)
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self._token = None
+        self._created_at = 0
+        self._expiration = 0
+        # serializes refreshes, so that a refresh token is never used twice.
+        self._refresh_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def valid(self):
+        return self._token is not None and time.time() < self._expiration - MIN_VALIDITY
+
+    def get_token(self):
+        """
+        Return a valid access token, refreshing it first, with up to `max_attempts` attempts, if the cached one is
+        missing or about to expire. Raises the exception of the last attempt if none of them succeeded.
+        """
+        token = self._token
+        if self.valid():
+            TOKEN_CACHE_HITS.inc()
+            return token
+        TOKEN_CACHE_WAITS.inc()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return self.refresh()
+            except Exception as e:
+                logger.error(f"Got an exception trying to get an access token. Attempt number {attempts}; "
+                             f"exception: {e}")
+                # try to log the raw response; the exception object may not have one.
+                try:
+                    logger.error("content from response: {}".format(e.response.content))
+                except Exception:
+                    pass
+                if attempts >= self.max_attempts:
+                    raise e
+                time.sleep(self.retry_interval)
+
+    def refresh(self, background=False):
+        """Refresh the access token unless it is already valid; returns the access token."""
+        with self._refresh_lock:
+            # another thread may have refreshed the token while this one waited for the lock.
+            if self.valid() and not (background and self._refresh_due()):
+                return self._token
+            start = timeit.default_timer()
+            try:
+                self.ag.token.refresh()
+            except Exception:
+                TOKEN_REFRESH_SECONDS.labels(outcome='failure').observe(timeit.default_timer() - start)
+                TOKEN_REFRESH_FAILURES.labels(background=str(background).lower()).inc()
+                raise
+            elapsed = timeit.default_timer() - start
+            TOKEN_REFRESH_SECONDS.labels(outcome='success').observe(elapsed)
+            info = self.ag.token.token_info
+            self._created_at = info.get('created_at') or int(time.time())
+            self._expiration = info.get('expiration') or self._created_at + 3600
+            self._token = info['access_token']
+            logger.info(f"Refreshed the access token in {elapsed * 1000:.0f} ms; it expires at "
+                        f"{time.ctime(self._expiration)}.")
+            return self._token
+
+    def _refresh_at(self):
+        """When the background thread refreshes the token: refresh_margin seconds before it expires, but no sooner
+        than half way through its lifetime."""
+        lifetime = self._expiration - self._created_at
+        return self._created_at + max(lifetime - self.refresh_margin, lifetime / 2)
+
+    def _refresh_due(self):
+        return time.time() >= self._refresh_at()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if self._token is not None and not self._refresh_due():
+                self._stopped.wait(max(self._refresh_at() - time.time(), 0))
+                continue
+            try:
+                self.refresh(background=True)
+            except Exception as e:
+                logger.error(f"Got an exception refreshing the access token in the background; retrying in "
+                             f"{self.retry_interval} seconds. exception: {e}")
+                self._stopped.wait(self.retry_interval)
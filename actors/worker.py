@@ -1,3 +1,4 @@
+import atexit
 import copy
 import os
 import shutil
@@ -8,16 +9,22 @@ import time
 
 import channelpy
 import configparser
+from prometheus_client import start_http_server
 from aga import Agave
 
 from auth import get_tenant_verify
-from channels import ActorMsgChannel, ClientsChannel, CommandChannel, WorkerChannel, SpawnerWorkerChannel
+from batching import Batch, MessageBatch
+from channels import ActorMsgChannel, ActorRevisionChannel, ClientsChannel, CommandChannel, WorkerChannel, \
+    SpawnerWorkerChannel, publish_completion
 from codes import SHUTDOWN_REQUESTED, SHUTTING_DOWN, ERROR, READY, BUSY, COMPLETE
 from config import Config
 from docker_utils import DockerError, DockerStartContainerError, DockerStopContainerError, execute_actor, pull_image
 from errors import WorkerException
 import globals
+from hot_containers import HotContainer
 from models import Actor, Execution, Worker
+from store import WriteBehindQueue
+from token_cache import TokenCache
 from stores import actors_store, workers_store
 
 from agaveflask.logs import get_logger
@@ -68,7 +75,7 @@ def shutdown_workers(actor_id, delete_actor_ch=True):
         shutdown_worker(actor_id, worker['id'], delete_actor_ch)
 
 
-def process_worker_ch(tenant, worker_ch, actor_id, worker_id, actor_ch, ag_client):
+def process_worker_ch(tenant, worker_ch, actor_id, worker_id, actor_ch, ag_client, revision, status):
     """ Target for a thread to listen on the worker channel for a message to stop processing.
     :param worker_ch:
     :return:
@@ -98,11 +105,22 @@ def process_worker_ch(tenant, worker_ch, actor_id, worker_id, actor_ch, ag_clien
                 time.sleep(10)
                 continue
 
-        elif msg == 'force_quit':
+        elif type(msg) == dict and 'force_quit' in msg:
             logger.info("Worker with worker_id: {} (actor_id: {}) received a force_quit message, "
-                        "forcing the execution to halt...".format(worker_id, actor_id))
-            globals.force_quit = True
-            globals.keep_running = False
+                        "forcing execution {} to halt...".format(worker_id, actor_id, msg['force_quit']))
+            globals.force_quit_executions.add(msg['force_quit'])
+
+        elif type(msg) == dict and 'drain' in msg:
+            # sent by the spawner when the actor moved to another revision (see Spawner.stop_workers()); the same
+            # change is usually also received on the actor's revision exchange (see process_revision_ch()).
+            if msg['drain'] is not None and msg['drain'] == revision:
+                logger.debug("Received drain for the worker's own revision; ignoring. {}_{}".format(actor_id, worker_id))
+                continue
+            logger.info("Worker with worker_id: {} (actor_id: {}) received a drain message for revision {}, "
+                        "draining worker...".format(worker_id, actor_id, msg['drain']))
+            # the drain waits for the running executions, so it runs in its own thread to keep answering health
+            # checks meanwhile.
+            threading.Thread(target=drain_worker, args=(worker_id, status), daemon=True).start()
 
         elif msg == 'stop' or msg == 'stop-no-delete':
             logger.info("Worker with worker_id: {} (actor_id: {}) received stop message, "
@@ -148,6 +166,13 @@ def process_worker_ch(tenant, worker_ch, actor_id, worker_id, actor_ch, ag_clien
                 clients_ch.close()
             else:
                 logger.info("Did not receive client. Not issuing delete. Exiting. {}_{}".format(actor_id, worker_id))
+            # the worker exits with os._exit(), which skips the atexit handlers, so the pending writes are written
+            # here, before the worker record is deleted.
+            if globals.write_behind:
+                try:
+                    globals.write_behind.close()
+                except Exception as e:
+                    logger.error(f"Got exception writing the pending worker fields; worker_id: {worker_id}; e: {e}")
             try:
                 Worker.delete_worker(actor_id, worker_id)
             except WorkerException as e:
@@ -171,10 +196,59 @@ def process_worker_ch(tenant, worker_ch, actor_id, worker_id, actor_ch, ag_clien
                             "worker_id: {}; exception: {}".format(actor_id, worker_id, e))
 
             logger.info("Worker with worker_id: {} is now exiting.".format(worker_id))
+            for hot_container in globals.hot_containers:
+                try:
+                    hot_container.close()
+                except Exception as e:
+                    logger.error(f"Got exception closing a hot container; worker_id: {worker_id}; e: {e}")
             _thread.interrupt_main()
             logger.info("main thread interrupted, worker {}_{} issuing os._exit()...".format(actor_id, worker_id))
             os._exit(0)
 
+def process_revision_ch(actor_id, worker_id, revision, status):
+    """
+    Target for a thread to follow the revision changes of the actor, published on the actor's fanout exchange (see
+    channels.publish_revision()). Every change drops the worker's cached copy of the actor. When the actor moves to
+    another revision, the worker drains: it stops taking messages, waits for its running executions to finish and
+    then shuts down, as if it had received 'stop-no-delete'.
+    """
+    logger.info("Worker subscribing to actor revision changes...{}_{}".format(actor_id, worker_id))
+    ch = None
+    while globals.keep_running:
+        try:
+            if ch is None:
+                ch = ActorRevisionChannel(actor_id)
+            change = ch.get()
+        except Exception as e:
+            logger.error(f"worker {worker_id} got exception trying to read the actor revision changes! "
+                         f"sleeping for 10 seconds and then will try again; e: {e}")
+            if ch is not None:
+                ch.close()
+                ch = None
+            # changes published meanwhile were missed; the actor cache is still kept coherent with the store.
+            time.sleep(10)
+            continue
+        logger.debug("Received actor revision change: {}; {}_{}".format(change, actor_id, worker_id))
+        Actor.invalidate_cache(actor_id)
+        if change.get('revision') is not None:
+            globals.actor_revision = change['revision']
+        if worker_id in change.get('keep', []) or change.get('revision') == revision:
+            continue
+        logger.info(f"Worker with worker_id: {worker_id} (actor_id: {actor_id}) has revision {revision} but the actor "
+                    f"moved to revision {change.get('revision')}; draining worker...")
+        ch.close()
+        drain_worker(worker_id, status)
+        return
+
+def drain_worker(worker_id, status):
+    """
+    Stop taking messages, wait for the running executions to finish and then shut the worker down by sending
+    'stop-no-delete' to its worker channel.
+    """
+    globals.keep_running = False
+    status.wait_idle()
+    stop_worker(worker_id)
+
 def subscribe(tenant,
               actor_id,
               image,
@@ -232,34 +306,156 @@ def subscribe(tenant,
                    verify=verify)
     else:
         logger.info("Not creating agave client.")
+    # the access token of the agave client is cached, and refreshed ahead of its expiration by a background thread.
+    tokens = None
+    if ag:
+        tokens = TokenCache(ag)
+        tokens.start()
+
+    # global tracks whether this worker should keep running.
+    globals.keep_running = True
+    status = WorkerStatus(actor_id, worker_id)
 
     # start a separate thread for handling messages sent to the worker channel ----
     logger.info("Starting the process worker channel thread.")
     t = threading.Thread(target=process_worker_ch,
-                         args=(tenant, worker_ch, actor_id, worker_id, actor_ch, ag),
+                         args=(tenant, worker_ch, actor_id, worker_id, actor_ch, ag, revision, status),
                          daemon=True)
     t.start()
 
-    # subscribe to the actor message queue -----
-    logger.info("Worker subscribing to actor channel. worker_id: {}".format(worker_id))
+    # start a separate thread for following the revision changes of the actor ----
+    logger.info("Starting the actor revision changes thread.")
+    revision_t = threading.Thread(target=process_revision_ch,
+                                  args=(actor_id, worker_id, revision, status),
+                                  daemon=True)
+    revision_t.start()
+
+    # optionally, non-critical worker fields (i.e., last_execution_time) are written in the background by a
+    # write-behind queue instead of on the critical path after each execution.
+    try:
+        write_behind_interval = float(Config.get('workers', 'write_behind_interval'))
+    except Exception:
+        write_behind_interval = 0
+    write_behind = None
+    if write_behind_interval > 0:
+        write_behind = WriteBehindQueue(interval=write_behind_interval)
+        atexit.register(write_behind.close)
+        globals.write_behind = write_behind
+
+    # the worker runs up to `concurrency` executions at once, each in its own slot; see process_messages().
+    try:
+        concurrency = int(Actor.from_db(actors_store[actor_id]).get('concurrency') or 1)
+    except Exception as e:
+        logger.error(f"Got exception reading the concurrency of actor {actor_id}; running one execution at a time. "
+                     f"e: {e}")
+        concurrency = 1
+    logger.info(f"worker {worker_id} running up to {concurrency} concurrent executions.")
+    Worker.update_worker_status(actor_id, worker_id, READY)
+    logger.debug("updated worker status to READY in SUBSCRIBE; worker id: {}".format(worker_id))
+    slots = []
+    for slot in range(1, concurrency):
+        slot_t = threading.Thread(target=run_slot,
+                                  args=(slot, ActorMsgChannel(actor_id), tenant, actor_id, image, revision, worker_id,
+                                        tokens, client_id, client_secret, leave_containers, mem_limit, max_cpus,
+                                        write_behind, status),
+                                  daemon=True)
+        slot_t.start()
+        slots.append(slot_t)
+    # the first slot runs in the main thread.
+    process_messages(0, actor_ch, tenant, actor_id, image, revision, worker_id, tokens, client_id, client_secret,
+                     leave_containers, mem_limit, max_cpus, write_behind, status)
+    for slot_t in slots:
+        slot_t.join()
+    logger.info("global.keep_running no longer true. worker is now exited. worker id: {}".format(worker_id))
+
+
+class WorkerStatus(object):
+    """
+    Tracks the executions running in the slots of a worker: the worker is BUSY while any of them is running and READY
+    otherwise.
+    """
+
+    def __init__(self, actor_id, worker_id):
+        self.actor_id = actor_id
+        self.worker_id = worker_id
+        self.running = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def start_execution(self):
+        with self._lock:
+            if not self.running:
+                Worker.update_worker_status(self.actor_id, self.worker_id, BUSY)
+            self.running += 1
+
+    def finish_execution(self):
+        with self._lock:
+            self.running -= 1
+            if not self.running:
+                self._idle.notify_all()
+                Worker.update_worker_status(self.actor_id, self.worker_id, READY)
+                logger.debug("updated worker status to READY; worker id: {}".format(self.worker_id))
+
+    def wait_idle(self):
+        """Block until no execution is running."""
+        with self._idle:
+            self._idle.wait_for(lambda: not self.running)
+
+
+def run_slot(slot, actor_ch, *args):
+    """
+    Target for the threads of the slots after the first; `args` are the remaining arguments of process_messages().
+    """
+    worker_id = args[4]
+    try:
+        process_messages(slot, actor_ch, *args)
+    except BaseException as e:
+        # as for the main thread (see __main__), a slot that fails shuts the worker down, unless it is already
+        # shutting down.
+        if globals.keep_running:
+            logger.error(f"worker {worker_id} slot {slot} got exception: {e}; worker exiting.")
+            stop_worker(worker_id)
+
+
+def process_messages(slot,
+                     actor_ch,
+                     tenant,
+                     actor_id,
+                     image,
+                     revision,
+                     worker_id,
+                     tokens,
+                     client_id,
+                     client_secret,
+                     leave_containers,
+                     mem_limit,
+                     max_cpus,
+                     write_behind,
+                     status):
+    """
+    Subscription loop of one execution slot of a worker: gets messages from the actor's inbox and executes them, one
+    at a time. Each slot consumes from its own connection (`actor_ch`) with a prefetch of 1, so every message is acked
+    or nacked on the channel it was delivered on, and a worker with `concurrency` slots runs up to that many actor
+    containers at once, each with the actor's mem_limit and max_cpus. For actors with batching, a container runs a
+    batch of messages instead; see batching.py.
+    """
     # keep track of whether we need to update the worker's status back to READY; otherwise, we
     # will hit redis with an UPDATE every time the subscription loop times out (i.e., every 2s)
-    update_worker_status = True
-
-    # global tracks whether this worker should keep running.
-    globals.keep_running = True
+    update_worker_status = False
 
     # consecutive_errors tracks the number of consecutive times a worker has gotten an error trying to process a
     # message. Even though the message will be requeued, we do not want the worker to continue processing
     # indefinitely when a compute node is unhealthy.
     consecutive_errors = 0
 
+    # the long-lived actor container of actors with the hot hint; see hot_containers.py
+    hot_container = None
+
     # main subscription loop -- processing messages from actor's mailbox
     while globals.keep_running:
-        logger.debug("top of keep_running; worker id: {}".format(worker_id))
+        logger.debug("top of keep_running; worker id: {}; slot: {}".format(worker_id, slot))
         if update_worker_status:
-            Worker.update_worker_status(actor_id, worker_id, READY)
-            logger.debug("updated worker status to READY in SUBSCRIBE; worker id: {}".format(worker_id))
+            status.finish_execution()
             update_worker_status = False
 
         # note: the following get_one() call blocks until a message is returned. this means it could be a long time
@@ -288,8 +484,11 @@ def subscribe(tenant,
         # NOTE: we could also compare the worker's revision to the revision contained in the message itself so that
         # a given message was always processed by a worker of the same revision, but this would take more work and is
         # not the requirement.
+        # the worker also learns of new revisions as soon as they are published (see process_revision_ch()), and
+        # the actor is read from the process-local actor cache, which is kept coherent with the actors store (see
+        # actor_cache.py), so this check does not go to the database for every message.
         try:
-            actor = Actor.from_db(actors_store[actor_id])
+            actor = Actor.from_cache(actor_id)
         except Exception as e:
             logger.error("unexpected exception retrieving actor to check revision. Nacking message."
                          "actor_id: {}; worker_id: {}; status: {}; exception: {}".format(actor_id,
@@ -299,9 +498,10 @@ def subscribe(tenant,
             msg_obj.nack(requeue=True)
             logger.info("worker exiting. worker_id: {}".format(worker_id))
             raise e
-        if not revision == actor.revision:
+        if not revision == actor.revision or globals.actor_revision not in (None, revision):
             logger.info(f"got msg from get_one() but worker's revision ({revision}) was different "
-                        f"from actor.revision ({actor.revision}). Requeing message and worker will "
+                        f"from actor.revision ({actor.revision}; published: {globals.actor_revision}). "
+                        f"Requeing message and worker will "
                         f"exit. {actor_id}+{worker_id}")
             msg_obj.nack(requeue=True)
             logger.info("message requeued; worker exiting:{}_{}".format(actor_id, worker_id))
@@ -309,7 +509,7 @@ def subscribe(tenant,
             raise Exception()
 
         try:
-            Worker.update_worker_status(actor_id, worker_id, BUSY)
+            status.start_execution()
         except Exception as e:
             logger.error("unexpected exception from call to update_worker_status. Nacking message."
                          "actor_id: {}; worker_id: {}; status: {}; exception: {}".format(actor_id,
@@ -327,6 +527,9 @@ def subscribe(tenant,
         try:
             execution_id = msg['_abaco_execution_id']
             content_type = msg['_abaco_Content_Type']
+            # the API waits for the completion notification of synchronous executions; see publish_completion().
+            synchronous = str(msg.get('_abaco_synchronous', '')).lower() == 'true'
+            hot = Actor.HOT_HINT in (actor.get('hints') or [])
             mounts = actor.mounts
             logger.debug("actor mounts: {}".format(mounts))
         except Exception as e:
@@ -339,6 +542,17 @@ def subscribe(tenant,
             logger.info("worker exiting. worker_id: {}".format(worker_id))
             raise e
 
+        # for actors with batching, fill a batch with the messages that arrive within batch_wait milliseconds; a single
+        # actor container runs all of them (see batching.py), and msg_obj acks or nacks the whole batch from here on.
+        batch_messages = None
+        batch_size = actor.get('batch_size') or 1
+        if batch_size > 1 and not hot:
+            more = actor_ch.get_more(batch_size - 1, (actor.get('batch_wait') or 0) / 1000)
+            if more:
+                batch_messages = [(message, msg)] + [(m.pop('message', ''), m) for m, _ in more]
+                msg_obj = MessageBatch([msg_obj] + [m_obj for _, m_obj in more])
+                logger.info(f"worker {worker_id} got a batch of {len(batch_messages)} messages.")
+
         # for results, create a socket in the configured directory.
         try:
             socket_host_path_dir = Config.get('workers', 'socket_host_path_dir')
@@ -348,16 +562,23 @@ def subscribe(tenant,
             msg_obj.nack(requeue=True)
             logger.info("worker exiting. worker_id: {}".format(worker_id))
             raise e
+        batch = None
+        executions = [(execution_id, synchronous)]
+        if batch_messages:
+            batch = Batch(actor_id, worker_id, tenant, batch_messages, os.path.join(socket_host_path_dir, worker_id))
+            executions = batch.executions
         socket_host_path = '{}.sock'.format(os.path.join(socket_host_path_dir, worker_id, execution_id))
         logger.info("Create socket at path: {}".format(socket_host_path))
-        # add the socket as a mount:
-        mounts.append({'host_path': socket_host_path,
-                       'container_path': '/_abaco_results.sock',
-                       'format': 'ro'})
+        # add the socket as a mount; hot containers send their results over the hot container socket instead.
+        if not hot:
+            mounts.append({'host_path': socket_host_path,
+                           'container_path': '/_abaco_results.sock',
+                           'format': 'ro'})
         # for binary data, create a fifo in the configured directory. The configured
-        # fifo_host_path_dir is equal to the fifo path in the worker container:
+        # fifo_host_path_dir is equal to the fifo path in the worker container. Hot containers get binary data in
+        # the execute frame instead, and batches in the batch file.
         fifo_host_path = None
-        if content_type == 'application/octet-stream':
+        if content_type == 'application/octet-stream' and not hot and not batch:
             try:
                 fifo_host_path_dir = Config.get('workers', 'fifo_host_path_dir')
             except (configparser.NoSectionError, configparser.NoOptionError) as e:
@@ -411,8 +632,9 @@ def subscribe(tenant,
         user = get_container_user(actor)
         logger.debug("Final user valiue: {}".format(user))
         # overlay the default_environment registered for the actor with the msg
-        # dictionary
-        environment.update(msg)
+        # dictionary; the messages of a batch get theirs in the batch file instead.
+        if not batch:
+            environment.update(msg)
         environment['_abaco_access_token'] = ''
         environment['_abaco_actor_dbid'] = actor_id
         environment['_abaco_actor_id'] = actor.id
@@ -422,59 +644,61 @@ def subscribe(tenant,
         environment['_abaco_actor_name'] = actor.name or 'None'
         logger.debug("Overlayed environment: {}; worker_id: {}".format(environment, worker_id))
 
-        # if we have an agave client, get a fresh set of tokens:
-        if ag:
-            need_to_refresh = True
-            refresh_attempts = 0
-            while need_to_refresh and refresh_attempts < 10:
-                refresh_attempts = refresh_attempts + 1
-                logger.debug("About to try and refreh the token; "
-                             "attempt number: {}; {}_{}".format(refresh_attempts, actor_id, worker_id))
-                try:
-                    ag.token.refresh()
-                    token = ag.token.token_info['access_token']
-                    environment['_abaco_access_token'] = token
-                    logger.info("Refreshed the tokens. Passed {} to the environment.".format(token))
-                    need_to_refresh = False
-                except Exception as e:
-                    logger.error("Got an exception trying to get an access token. Attempt number {} "
-                                 "Exception: {}; actor_id: {}; worker_id: {}; execution_id: {}; client_id: {}; "
-                                 "client_secret: {}".format(refresh_attempts, e, actor_id, worker_id, execution_id, client_id, client_secret))
-                    # try to log the raw response; it is possible the exception object, e, will not have a response object
-                    # on it, for instance if one of the other lines above caused the exception.
-                    try:
-                        logger.error("content from response: {}".format(e.response.content))
-                    except Exception as e2:
-                        logger.error("got exception trying to log response content: {}".format(e2))
-                    # we hit the limit; give up, nack the message and raise an exception (which will put the actor in
-                    # ERROR state).
-                    if refresh_attempts == 10:
-                        msg_obj.nack(requeue=True)
-                        logger.info("worker exiting. worker_id: {}".format(worker_id))
-                        raise e
-                    else:
-                        # otherwise, wait 2 seconds and then try again:
-                        time.sleep(2)
+        # if we have an agave client, pass its access token; it is cached and refreshed in the background (see
+        # token_cache.py), so this only waits when no valid token is available.
+        if tokens:
+            try:
+                environment['_abaco_access_token'] = tokens.get_token()
+            except Exception as e:
+                logger.error("Could not get an access token; giving up. Nacking message. Exception: {}; actor_id: {}; "
+                             "worker_id: {}; execution_id: {}; client_id: {}".format(e, actor_id, worker_id,
+                                                                                    execution_id, client_id))
+                # nack the message and raise an exception (which will put the actor in ERROR state).
+                msg_obj.nack(requeue=True)
+                logger.info("worker exiting. worker_id: {}".format(worker_id))
+                raise e
         else:
-            logger.info("Agave client `ag` is None -- not passing access token; worker_id: {}".format(worker_id))
+            logger.info("No agave client -- not passing access token; worker_id: {}".format(worker_id))
         logger.info("Passing update environment: {}".format(environment))
         logger.info("About to execute actor; worker_id: {}".format(worker_id))
         try:
-            stats, logs, final_state, exit_code, start_time = execute_actor(actor_id,
-                                                                            worker_id,
-                                                                            execution_id,
-                                                                            image,
-                                                                            message,
-                                                                            user,
-                                                                            environment,
-                                                                            privileged,
-                                                                            mounts,
-                                                                            leave_containers,
-                                                                            fifo_host_path,
-                                                                            socket_host_path,
-                                                                            mem_limit,
-                                                                            max_cpus,
-                                                                            tenant)
+            if hot:
+                if not hot_container:
+                    hot_container = HotContainer(actor_id, worker_id, image, user, privileged, mounts,
+                                                 leave_containers, mem_limit, max_cpus, tenant, slot=slot)
+                    globals.hot_containers.append(hot_container)
+                stats, final_state, exit_code, start_time = hot_container.execute(execution_id, message, environment)
+                if hot_container.expired:
+                    logger.info(f"hot container ran {hot_container.executions} executions; recycling it. "
+                                f"worker_id: {worker_id}")
+                    hot_container.close()
+            else:
+                if batch:
+                    try:
+                        batch.start()
+                    except Exception as e:
+                        raise DockerStartContainerError(f"Could not write the batch files: {e}")
+                    mounts = mounts + batch.mounts()
+                    environment.update(batch.environment())
+                stats, final_state, exit_code, start_time = execute_actor(actor_id,
+                                                                          worker_id,
+                                                                          execution_id,
+                                                                          image,
+                                                                          '' if batch else message,
+                                                                          user,
+                                                                          environment,
+                                                                          privileged,
+                                                                          mounts,
+                                                                          leave_containers,
+                                                                          fifo_host_path,
+                                                                          socket_host_path,
+                                                                          mem_limit,
+                                                                          max_cpus,
+                                                                          tenant)
+            if batch:
+                outcomes = batch.finish(stats, exit_code)
+            else:
+                outcomes = [(execution_id, synchronous, stats, exit_code)]
         except DockerStartContainerError as e:
             logger.error("Worker {} got DockerStartContainerError: {} trying to start actor for execution {}."
                          "Placing message back on queue.".format(worker_id, e, execution_id))
@@ -488,7 +712,7 @@ def subscribe(tenant,
                              "down workers.".format(worker_id, execution_id, MAX_WORKER_CONSECUTIVE_ERRORS, e))
                 Actor.set_status(actor_id, ERROR, "Error executing container: {}; w".format(e))
                 shutdown_workers(actor_id, delete_actor_ch=False)
-                Execution.update_status(actor_id, execution_id, ERROR)
+                fail_executions(actor_id, executions)
                 # wait for worker to be shutdown..
                 time.sleep(60)
                 break
@@ -504,7 +728,7 @@ def subscribe(tenant,
             # since the error was with stopping the actor, we will consider this message "processed"; this choice
             # could be reconsidered/changed
             msg_obj.ack()
-            Execution.update_status(actor_id, execution_id, ERROR)
+            fail_executions(actor_id, executions)
             shutdown_workers(actor_id, delete_actor_ch=False)
             # wait for worker to be shutdown..
             time.sleep(60)
@@ -524,36 +748,31 @@ def subscribe(tenant,
             # actor container; if the container was started, then another exception should be raised. Therefore,
             # we can assume here that the container was at least started and we can ack the message.
             msg_obj.ack()
-            Execution.update_status(actor_id, execution_id, ERROR)
+            fail_executions(actor_id, executions)
             shutdown_workers(actor_id, delete_actor_ch=False)
             # wait for worker to be shutdown..
             time.sleep(60)
             break
+        finally:
+            if batch:
+                batch.cleanup()
         # ack the message
         msg_obj.ack()
 
-        # Add the logs to the execution before finalizing it -- otherwise, there is a race condition for clients
-        # waiting on the execution to be COMPLETE and then immediately retrieving the logs.
-        try:
-            logger.debug("Checking for get_actor_log_ttl")
-            log_ex = Actor.get_actor_log_ttl(actor_id)
-            logger.debug("log ex is {log_ex}")
-            Execution.set_logs(execution_id, logs, actor_id, tenant, worker_id, log_ex)
-            logger.debug(f"Successfully added execution logs of expiry {log_ex}.")
-        except Exception as e:
-            msg = "Got exception trying to set logs for exception {}; " \
-                  "Exception: {}; worker_id: {}".format(execution_id, e, worker_id)
-            logger.error(msg)
-
+        # the logs were shipped by execute_actor, before the execution is finalized.
         logger.debug("container finished successfully; worker_id: {}".format(worker_id))
         # Add the completed stats to the execution
         logger.info("Actor container finished successfully. Got stats object:{}".format(str(stats)))
-        Execution.finalize_execution(actor_id, execution_id, COMPLETE, stats, final_state, exit_code, start_time)
-        logger.info("Added execution: {}; worker_id: {}".format(execution_id, worker_id))
+        for ex_id, ex_synchronous, ex_stats, ex_exit_code in outcomes:
+            Execution.finalize_execution(actor_id, ex_id, COMPLETE, ex_stats, final_state, ex_exit_code, start_time,
+                                         tenant=tenant)
+            if ex_synchronous:
+                publish_completion(actor_id, ex_id, COMPLETE)
+            logger.info("Added execution: {}; worker_id: {}".format(ex_id, worker_id))
 
         # Update the worker's last updated and last execution fields:
         try:
-            Worker.update_worker_execution_time(actor_id, worker_id)
+            Worker.update_worker_execution_time(actor_id, worker_id, write_behind=write_behind)
             logger.debug("worker execution time updated. worker_id: {}".format(worker_id))
         except KeyError:
             # it is possible that this worker was sent a gracful shutdown command in the other thread
@@ -566,7 +785,31 @@ def subscribe(tenant,
         # we completed an execution successfully; reset the consecutive_errors counter
         consecutive_errors = 0
         logger.info("worker time stamps updated; worker_id: {}".format(worker_id))
-    logger.info("global.keep_running no longer true. worker is now exited. worker id: {}".format(worker_id))
+    # the last execution of the slot finished right before keep_running was found False.
+    if update_worker_status:
+        status.finish_execution()
+    if hot_container:
+        hot_container.close()
+
+def fail_executions(actor_id, executions):
+    """Set the executions, a list of (execution_id, synchronous) tuples, to ERROR and notify the synchronous ones."""
+    for execution_id, synchronous in executions:
+        Execution.update_status(actor_id, execution_id, ERROR)
+        if synchronous:
+            publish_completion(actor_id, execution_id, ERROR)
+
+def stop_worker(worker_id):
+    """Shut this worker down after an unexpected exception by sending 'stop-no-delete' to its worker channel."""
+    try:
+        ch = WorkerChannel(worker_id=worker_id)
+        # since this is an exception, we don't know that the actor has been deleted
+        # don't delete the actor msg channel:
+        ch.put('stop-no-delete')
+        logger.info(f"Worker sent 'stop-no-delete' message to itself; worker_id: {worker_id}.")
+        ch.close()
+    except Exception as e:
+        logger.error(f"worker got exception trying to send stop-no-delete message to itself;"
+                     f"worker_id: {worker_id}; e: {e}")
 
 def get_container_user(actor):
     logger.debug("top of get_container_user")
@@ -586,12 +829,58 @@ def get_container_user(actor):
         user = '{}:{}'.format(uid, gid)
     return user
 
+def wait_for_bind(warm_id):
+    """
+    Wait for the spawner to bind this warm worker to an actor. Sets up the worker's directories and environment for
+    the bound worker and returns the bind message, or None if the worker was not bound in time.
+    """
+    try:
+        bind_timeout = float(os.environ.get('_abaco_warm_bind_timeout', 3600))
+    except ValueError:
+        bind_timeout = 3600
+    spawner_worker_ch = SpawnerWorkerChannel(worker_id=warm_id)
+    logger.info(f"Warm worker {warm_id} waiting up to {bind_timeout} seconds to be bound to an actor...")
+    bind = spawner_worker_ch.get(timeout=bind_timeout)
+    spawner_worker_ch.delete()
+    spawner_worker_ch.close()
+    if not bind:
+        return None
+    worker_id = bind['worker_id']
+    # warm workers have the parent fifo and socket directories mounted, so create the ones for this worker.
+    for option in ('fifo_host_path_dir', 'socket_host_path_dir'):
+        try:
+            path_dir = Config.get('workers', option)
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            continue
+        os.makedirs(os.path.join(path_dir, worker_id), exist_ok=True)
+    # the remainder of the worker, including the exception handling in __main__, reads the environment.
+    for k in ('worker_id', 'image', 'revision', 'actor_id', 'tenant', 'api_server', 'client_id',
+              'client_secret', 'client_access_token', 'client_refresh_token'):
+        if bind.get(k) is not None:
+            os.environ[k] = str(bind[k])
+    logger.info(f"Warm worker {warm_id} bound to actor {bind['actor_id']} as worker {worker_id}.")
+    return bind
+
+
 def main():
     """
     Main function for the worker process.
 
     This function
     """
+    # like spawners, workers serve their metrics (e.g., of the access token cache) themselves when a port is
+    # configured.
+    try:
+        metrics_port = int(Config.get('workers', 'metrics_port'))
+    except Exception:
+        metrics_port = None
+    if metrics_port:
+        start_http_server(metrics_port)
+    warm = os.environ.get('_abaco_warm') == 'true'
+    if warm:
+        if not wait_for_bind(os.environ.get('worker_id')):
+            logger.info("Warm worker was not bound to an actor in time; exiting.")
+            sys.exit()
     worker_id = os.environ.get('worker_id')
     image = os.environ.get('image')
     actor_id = os.environ.get('actor_id')
@@ -611,16 +900,18 @@ def main():
 
     logger.info(f"Top of main() for worker: {worker_id}, image: {image}; revision: {revision}"
                 f"actor_id: {actor_id}; client_id:{client_id}; tenant: {tenant}; api_server: {api_server}")
-    spawner_worker_ch = SpawnerWorkerChannel(worker_id=worker_id)
-
-    logger.debug("Worker waiting on message from spawner...")
-    result = spawner_worker_ch.get_one()
-    logger.debug("Worker received reply from spawner. result: {}.".format(result))
-
-    # should be OK to close the spawner_worker_ch on the worker side since spawner was first client
-    # to open it.
-    spawner_worker_ch.delete()
-    logger.debug('spawner_worker_ch closed.')
+    # warm workers already got the go-ahead from the spawner with their bind message.
+    if not warm:
+        spawner_worker_ch = SpawnerWorkerChannel(worker_id=worker_id)
+
+        logger.debug("Worker waiting on message from spawner...")
+        result = spawner_worker_ch.get_one()
+        logger.debug("Worker received reply from spawner. result: {}.".format(result))
+
+        # should be OK to close the spawner_worker_ch on the worker side since spawner was first client
+        # to open it.
+        spawner_worker_ch.delete()
+        logger.debug('spawner_worker_ch closed.')
     if not client_id:
         logger.info("Did not get client id.")
     else:
@@ -659,19 +950,9 @@ if __name__ == '__main__':
                          f"worker_id: {worker_id}.")
             worker_id = ''
         if worker_id:
-            try:
-                ch = WorkerChannel(worker_id=worker_id)
-                # since this is an exception, we don't know that the actor has been deleted
-                # don't delete the actor msg channel:
-                ch.put('stop-no-delete')
-                logger.info(f"Worker main loop sent 'stop-no-delete' message to itself; worker_id: {worker_id}.")
-                ch.close()
-                msg = "worker caught exception from main loop. worker exiting. e" \
-                      "Exception: {} worker_id: {}".format(e, worker_id)
-                logger.info(msg)
-            except Exception as e:
-                logger.error(f"worker main thread got exception trying to send stop-no-delete message to itself;"
-                             f"worker_id: {worker_id}.")
+            logger.info("worker caught exception from main loop. worker exiting. e"
+                        "Exception: {} worker_id: {}".format(e, worker_id))
+            stop_worker(worker_id)
     keep_running = False
     sys.exit()
 
@@ -28,6 +28,8 @@ elif [ $api = "metrics" ]; then
 elif [ $api = "mes" ]; then
     if [ $server = "dev" ]; then
         python3 -u /actors/message_api.py
+    elif [ $server = "aio" ]; then
+        cd /actors; uvicorn --workers $threads --host 0.0.0.0 --port 5000 message_aio:app
     else
         cd /actors; /usr/local/bin/gunicorn -w $threads -b :5000 message_api:app
     fi
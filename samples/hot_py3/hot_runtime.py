@@ -0,0 +1,103 @@
+"""
+Container side of the Abaco hot container protocol (see actors/hot_containers.py). An actor registered with the
+'hot' hint runs in a long-lived container that gets its messages over a unix socket; serve(handler) runs
+`handler(message)` for each of them, with the environment of the execution set in os.environ, as a regular actor
+container would see it. What the handler prints is shipped as the logs of the execution, and send_result() sends
+results.
+"""
+import base64
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import traceback
+
+FRAME_HEADER = struct.Struct('>I')
+
+_sock = None
+
+
+def _recv_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+def recv_frame(sock):
+    """Return the next frame, or None once the worker closed the socket."""
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, FRAME_HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+def send_frame(sock, frame):
+    data = json.dumps(frame).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+def send_result(data):
+    """Send a result (bytes) for the current execution."""
+    send_frame(_sock, {'type': 'result', 'data': base64.b64encode(data).decode('ascii')})
+
+
+class LogWriter(io.TextIOBase):
+    """Ships what is written to it as the logs of the current execution, a line or more at a time."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = ''
+
+    def write(self, s):
+        self._buffer += s
+        if '\n' in s:
+            end = self._buffer.rindex('\n') + 1
+            data, self._buffer = self._buffer[:end], self._buffer[end:]
+            send_frame(self.sock, {'type': 'log', 'data': data})
+        return len(s)
+
+    def flush(self):
+        if self._buffer:
+            data, self._buffer = self._buffer, ''
+            send_frame(self.sock, {'type': 'log', 'data': data})
+
+
+def serve(handler):
+    """Run `handler(message)` for each message delivered to this container; returns when the worker closes the socket."""
+    global _sock
+    _sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    _sock.connect(os.environ['_abaco_hot_socket'])
+    base_environment = dict(os.environ)
+    while True:
+        frame = recv_frame(_sock)
+        if frame is None:
+            return
+        if frame.get('type') != 'execute':
+            continue
+        os.environ.clear()
+        os.environ.update(base_environment)
+        for k in frame.get('unset', []):
+            os.environ.pop(k, None)
+        os.environ.update(frame.get('environment', {}))
+        if 'message_b64' in frame:
+            message = base64.b64decode(frame['message_b64'])
+        else:
+            message = frame.get('message')
+        exit_code = 0
+        writer = LogWriter(_sock)
+        with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+            try:
+                handler(message)
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+        writer.flush()
+        send_frame(_sock, {'type': 'complete', 'exit_code': exit_code})
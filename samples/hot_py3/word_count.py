@@ -0,0 +1,10 @@
+from hot_runtime import send_result, serve
+
+
+def word_count(message):
+    count = len(str(message).split())
+    print("counted {} words.".format(count))
+    send_result(str(count).encode('utf-8'))
+
+if __name__ == '__main__':
+    serve(word_count)
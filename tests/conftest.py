@@ -0,0 +1,30 @@
+# Configuration shared by the test modules in this directory.
+# The unit tests (test_actor_cache.py, test_auth_cache.py, test_batching.py, test_container_stats.py,
+# test_docker_events.py, test_docker_utils.py, test_hot_containers.py, test_message_aio_load.py and
+# test_token_cache.py) replace the docker daemon, the stores and the other services with mocks, so they do not need the
+# development stack. From the root directory, execute, e.g.:
+#     docker run --entrypoint=py.test -it --rm abaco/testsuite:dev /tests/test_token_cache.py
+
+import os
+import sys
+from unittest import mock
+sys.path.append(os.path.split(os.getcwd())[0])
+sys.path.append('/actors')
+
+import pytest
+
+# unit test modules whose code under test imports stores.py, which connects to Mongo when it is imported. These tests
+# do not read or write any store, so a mock stands in for stores.py while they are imported.
+STORELESS_MODULES = {'test_batching.py', 'test_docker_utils.py', 'test_hot_containers.py'}
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_make_collect_report(collector):
+    stub = isinstance(collector, pytest.Module) and collector.path.name in STORELESS_MODULES \
+           and 'stores' not in sys.modules
+    if stub:
+        sys.modules['stores'] = mock.MagicMock()
+    yield
+    if stub:
+        # the modules imported along with the test module keep the mock.
+        del sys.modules['stores']
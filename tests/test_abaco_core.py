@@ -548,6 +548,35 @@ def test_list_actor(headers):
     assert result['id'] is not None
 
 
+@pytest.mark.regapi
+def test_list_actors_paginated(headers):
+    url = '{}/actors'.format(base_url)
+    rsp = requests.get(url, headers=headers)
+    all_ids = [actor['id'] for actor in basic_response_checks(rsp)]
+    assert len(all_ids) > 1
+    ids = []
+    after = None
+    while True:
+        params = {'limit': 1}
+        if after:
+            params['after'] = after
+        rsp = requests.get(url, headers=headers, params=params)
+        result = basic_response_checks(rsp)
+        metadata = json.loads(rsp.content.decode('utf-8'))['_metadata']
+        ids.extend(actor['id'] for actor in result)
+        after = metadata.get('next_after') or metadata.get('nextAfter')
+        if not after:
+            break
+    assert ids == all_ids
+
+
+@pytest.mark.regapi
+def test_list_actors_invalid_limit(headers):
+    url = '{}/actors'.format(base_url)
+    rsp = requests.get(url, headers=headers, params={'limit': 0})
+    assert rsp.status_code == 400
+
+
 @pytest.mark.regapi
 def test_list_actor_state(headers):
     actor_id = get_actor_id(headers)
@@ -663,6 +692,22 @@ def test_cant_register_max_workers_stateful(headers):
     assert "stateful actors can only have 1 worker" in message
 
 
+@pytest.mark.regapi
+def test_cant_register_concurrency_stateful(headers):
+    url = '{}/{}'.format(base_url, '/actors')
+    data = {'image': 'abacosamples/test',
+            'name': 'abaco_test_suite_invalid',
+            'stateless': False,
+            'concurrency': 2,
+            }
+    rsp = requests.post(url, json=data, headers=headers)
+    response_format(rsp)
+    assert rsp.status_code not in range(1, 399)
+    data = json.loads(rsp.content.decode('utf-8'))
+    message = data['message']
+    assert "stateful actors can only run one execution at a time" in message
+
+
 @pytest.mark.regapi
 def test_register_with_put(headers):
     url = '{}/actors'.format(base_url)
@@ -953,6 +998,48 @@ def test_execute_and_delete_sleep_loop_actor(headers):
           "actor_id: {}; execution_id: {}".format(status, actor_id, exc_id))
     assert stopped
 
+def test_execute_batch_default_env_actor(headers):
+    actor_id = get_actor_id(headers, name='abaco_test_suite_default_env')
+    url = '{}/actors/{}/messages/batch'.format(base_url, actor_id)
+    messages = ['testing batch execution {}'.format(i) for i in range(5)]
+    rsp = requests.post(url, json=messages, headers=headers)
+    result = basic_response_checks(rsp)
+    if case == 'snake':
+        exc_ids = result.get('execution_ids')
+    else:
+        exc_ids = result.get('executionIds')
+    assert len(exc_ids) == 5
+    assert len(set(exc_ids)) == 5
+    # every execution in the batch should complete
+    for exc_id in exc_ids:
+        url = '{}/actors/{}/executions/{}'.format(base_url, actor_id, exc_id)
+        idx = 0
+        status = None
+        while idx < 30:
+            rsp = requests.get(url, headers=headers)
+            status = basic_response_checks(rsp).get('status')
+            if status == 'COMPLETE':
+                break
+            time.sleep(1)
+            idx += 1
+        assert status == 'COMPLETE'
+
+def test_execute_batch_ndjson(headers):
+    actor_id = get_actor_id(headers, name='abaco_test_suite_default_env')
+    url = '{}/actors/{}/messages/batch'.format(base_url, actor_id)
+    data = '{"key": "value 1"}\n{"key": "value 2"}\n'
+    batch_headers = dict(headers)
+    batch_headers['Content-Type'] = 'application/x-ndjson'
+    rsp = requests.post(url, data=data, headers=batch_headers)
+    result = basic_response_checks(rsp)
+    assert result.get('count') == 2
+
+def test_execute_batch_not_a_list(headers):
+    actor_id = get_actor_id(headers, name='abaco_test_suite_default_env')
+    url = '{}/actors/{}/messages/batch'.format(base_url, actor_id)
+    rsp = requests.post(url, json={'message': 'not a batch'}, headers=headers)
+    assert rsp.status_code == 400
+
 def test_list_execution_details(headers):
     actor_id = get_actor_id(headers)
     # get execution id
@@ -1020,6 +1107,49 @@ def test_list_execution_logs(headers):
     assert '_abaco_execution_id' in result['logs']
     assert '_abaco_Content_Type' in result['logs']
 
+def test_execution_logs_byte_range(headers):
+    actor_id = get_actor_id(headers)
+    url = '{}/actors/{}/executions'.format(base_url, actor_id)
+    rsp = requests.get(url, headers=headers)
+    result = basic_response_checks(rsp, check_tenant=False)
+    exec_id = result.get('executions')[0].get('id')
+    url = '{}/actors/{}/executions/{}/logs'.format(base_url, actor_id, exec_id)
+    full = basic_response_checks(requests.get(url, headers=headers), check_tenant=False)['logs']
+    range_headers = dict(headers, Range='bytes=5-14')
+    rsp = requests.get(url, headers=range_headers)
+    assert rsp.status_code == 206
+    assert rsp.headers['Content-Range'].startswith('bytes 5-14/')
+    result = rsp.json()['result']
+    assert result['logs'] == full.encode('utf-8')[5:15].decode('utf-8', errors='replace')
+    assert result['offset'] == 5
+    assert result['length'] == len(full.encode('utf-8'))
+    range_headers = dict(headers, Range='bytes=5-')
+    result = requests.get(url, headers=range_headers).json()['result']
+    assert result['logs'] == full.encode('utf-8')[5:].decode('utf-8', errors='replace')
+    length = len(full.encode('utf-8'))
+    range_headers = dict(headers, Range=f'bytes={length}-')
+    rsp = requests.get(url, headers=range_headers)
+    assert rsp.status_code == 416
+    assert rsp.headers['Content-Range'] == f'bytes */{length}'
+
+def test_execution_logs_stream(headers):
+    actor_id = get_actor_id(headers)
+    url = '{}/actors/{}/executions'.format(base_url, actor_id)
+    rsp = requests.get(url, headers=headers)
+    result = basic_response_checks(rsp, check_tenant=False)
+    exec_id = result.get('executions')[0].get('id')
+    url = '{}/actors/{}/executions/{}/logs'.format(base_url, actor_id, exec_id)
+    full = basic_response_checks(requests.get(url, headers=headers), check_tenant=False)['logs']
+    # the execution is complete, so the stream returns the rest of the logs and closes.
+    rsp = requests.get('{}/stream'.format(url), headers=headers, params={'since': 5}, timeout=30)
+    assert rsp.status_code == 200
+    assert rsp.text == full.encode('utf-8')[5:].decode('utf-8', errors='replace')
+    sse_headers = dict(headers, Accept='text/event-stream')
+    rsp = requests.get('{}/stream'.format(url), headers=sse_headers, timeout=30)
+    assert rsp.headers['content-type'].startswith('text/event-stream')
+    assert 'id: {}'.format(len(full.encode('utf-8'))) in rsp.text
+    assert rsp.text.endswith('event: end\ndata: \n\n')
+
 def test_execute_actor_json(headers):
     actor_id = get_actor_id(headers)
     data = {'key1': 'value1', 'key2': 'value2'}
@@ -2016,6 +2146,9 @@ def test_search_logs_details(headers):
     assert not 'permissions' in result['search'][0]
     assert not 'tenant' in result['search'][0]
     assert not 'exp' in result['search'][0]
+    # one result per execution, not per log chunk:
+    for field in ('seq', 'offset', 'end', 'data', 'encoding'):
+        assert not field in result['search'][0]
 
 def test_search_executions_details(headers):
     url = '{}/actors/search/executions'.format(base_url)
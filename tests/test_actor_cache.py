@@ -0,0 +1,79 @@
+# Unit tests for the process-local actor cache (actor_cache.py); see conftest.py.
+
+from unittest import mock
+
+import pytest
+
+from actor_cache import ActorCache
+
+
+def reads(store):
+    return store.__getitem__.call_count + store.items.call_count
+
+@pytest.fixture()
+def docs():
+    return {'a': {'revision': 1, 'default_environment': {}}, 'b': {'revision': 1}}
+
+@pytest.fixture()
+def store(docs):
+    # mock of the actors_store, reading the documents in `docs`.
+    store = mock.MagicMock()
+    store.__getitem__.side_effect = lambda key: dict(docs[key])
+    store.items.side_effect = lambda filter_inp=None, proj_inp=None: \
+        [dict(doc, _id=key) for key, doc in docs.items() if key in filter_inp['_id']['$in']]
+    return store
+
+@pytest.fixture()
+def cache(store):
+    cache = ActorCache(store, maxsize=2, max_staleness=30, poll_interval=3600, change_stream=False)
+    # the tests poll explicitly.
+    cache._watcher = 'disabled'
+    return cache
+
+
+def test_hits(store, cache):
+    assert cache.get('a')['revision'] == 1
+    assert cache.get('a')['revision'] == 1
+    assert reads(store) == 1
+
+def test_copies(cache):
+    cache.get('a')['default_environment']['x'] = 1
+    assert cache.get('a')['default_environment'] == {}
+
+def test_missing(cache):
+    with pytest.raises(KeyError):
+        cache.get('missing')
+
+def test_lru(docs, store, cache):
+    cache.get('a')
+    cache.get('b')
+    cache.get('a')
+    docs['c'] = {'revision': 1}
+    cache.get('c')
+    n = reads(store)
+    cache.get('a')
+    assert reads(store) == n
+    cache.get('b')
+    assert reads(store) == n + 1
+
+def test_invalidate(docs, cache):
+    cache.get('a')
+    docs['a']['revision'] = 2
+    cache.invalidate('a')
+    assert cache.get('a')['revision'] == 2
+
+def test_poll(docs, cache):
+    cache.get('a')
+    cache.get('b')
+    docs['a']['revision'] = 2
+    del docs['b']
+    cache.poll()
+    assert cache.get('a')['revision'] == 2
+    with pytest.raises(KeyError):
+        cache.get('b')
+
+def test_max_staleness(store, cache):
+    cache.max_staleness = 0
+    cache.get('a')
+    cache.get('a')
+    assert reads(store) == 2
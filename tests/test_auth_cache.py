@@ -0,0 +1,81 @@
+# Unit tests for the caches of the authorization lookups (auth_cache.py); see conftest.py.
+
+import time
+from unittest import mock
+
+from flask import Flask
+import pytest
+
+from auth_cache import TTLCache
+
+
+@pytest.fixture()
+def values():
+    return {'a': 'actor1', 'b': 'actor2', 'c': 'actor1'}
+
+@pytest.fixture()
+def lookup(values):
+    # mock of a store read, returning the entries of `values`.
+    return mock.Mock(side_effect=lambda key: values[key])
+
+@pytest.fixture()
+def cache():
+    return TTLCache('test', maxsize=2, ttl=30)
+
+
+def test_hits(lookup, cache):
+    assert cache.get('a', lambda: lookup('a')) == 'actor1'
+    assert cache.get('a', lambda: lookup('a')) == 'actor1'
+    assert lookup.call_count == 1
+
+def test_errors_not_cached(values, lookup, cache):
+    with pytest.raises(KeyError):
+        cache.get('missing', lambda: lookup('missing'))
+    values['missing'] = 'actor3'
+    assert cache.get('missing', lambda: lookup('missing')) == 'actor3'
+
+def test_expiration(lookup, cache):
+    cache.ttl = 0.01
+    cache.get('a', lambda: lookup('a'))
+    time.sleep(0.02)
+    cache.get('a', lambda: lookup('a'))
+    assert lookup.call_count == 2
+
+def test_disabled(lookup, cache):
+    cache.ttl = 0
+    cache.get('a', lambda: lookup('a'))
+    cache.get('a', lambda: lookup('a'))
+    assert lookup.call_count == 2
+
+def test_lru(lookup, cache):
+    cache.get('a', lambda: lookup('a'))
+    cache.get('b', lambda: lookup('b'))
+    cache.get('a', lambda: lookup('a'))
+    cache.get('c', lambda: lookup('c'))
+    cache.get('a', lambda: lookup('a'))
+    assert lookup.call_count == 3
+    cache.get('b', lambda: lookup('b'))
+    assert lookup.call_count == 4
+
+def test_invalidate(values, lookup, cache):
+    cache.get('a', lambda: lookup('a'))
+    cache.get('b', lambda: lookup('b'))
+    values['a'] = 'actor3'
+    cache.invalidate(lambda key, value: value == 'actor1')
+    assert cache.get('a', lambda: lookup('a')) == 'actor3'
+    assert cache.get('b', lambda: lookup('b')) == 'actor2'
+    assert lookup.call_count == 3
+
+def test_request_memo(values, lookup, cache):
+    cache.ttl = 0
+    app = Flask(__name__)
+    with app.test_request_context('/actors'):
+        cache.get('a', lambda: lookup('a'))
+        cache.get('a', lambda: lookup('a'))
+        assert lookup.call_count == 1
+        values['a'] = 'actor3'
+        cache.invalidate(lambda key, value: key == 'a')
+        assert cache.get('a', lambda: lookup('a')) == 'actor3'
+    with app.test_request_context('/actors'):
+        cache.get('a', lambda: lookup('a'))
+        assert lookup.call_count == 3
@@ -0,0 +1,66 @@
+# Unit tests for the batch files of micro-batch delivery (batching.py). These tests only read and write the batch
+# files in a temporary directory and do not start any containers; see conftest.py.
+
+import json
+import os
+
+import pytest
+
+from batching import BATCH_CONTAINER_PATH, Batch, MessageBatch
+
+
+class MsgObj(object):
+    def __init__(self):
+        self.acked = False
+        self.nacked = False
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self, requeue=True):
+        self.nacked = requeue
+
+
+@pytest.fixture()
+def batch(tmpdir):
+    messages = [('first', {'_abaco_execution_id': 'ex1', '_abaco_synchronous': 'true', 'x': 1}),
+                (b'\x00\x01', {'_abaco_execution_id': 'ex2', '_abaco_Content_Type': 'application/octet-stream'}),
+                ('third', {'_abaco_execution_id': 'ex3'})]
+    batch = Batch('abc', 'w1', 'tenant', messages, str(tmpdir))
+    batch.write()
+    yield batch
+    batch.cleanup()
+
+
+def test_batch_file(batch):
+    with open(batch.input_path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['execution_id'] for line in lines] == ['ex1', 'ex2', 'ex3']
+    assert lines[0]['message'] == 'first'
+    assert lines[0]['environment'] == {'_abaco_execution_id': 'ex1', '_abaco_synchronous': 'true', 'x': '1'}
+    assert lines[1]['message_b64'] == 'AAE='
+    assert batch.executions == [('ex1', True), ('ex2', False), ('ex3', False)]
+    assert batch.mounts()[0] == {'host_path': batch.input_path, 'container_path': BATCH_CONTAINER_PATH,
+                                 'format': 'ro'}
+    assert batch.environment()['_abaco_batch_size'] == '3'
+
+def test_batch_outcomes(batch):
+    with open(batch.results_path, 'a') as f:
+        f.write(json.dumps({'execution_id': 'ex2', 'exit_code': 3}) + '\n')
+        f.write('not json\n')
+    outcomes = batch.finish({'cpu': 300, 'io': 30, 'runtime': 3.0, 'memory_peak': 1024}, 0)
+    assert [(ex_id, exit_code) for ex_id, _, _, exit_code in outcomes] == [('ex1', 0), ('ex2', 3), ('ex3', 0)]
+    assert outcomes[0][2] == {'cpu': 100, 'io': 10, 'runtime': 1.0, 'memory_peak': 1024}
+    assert outcomes[0][1]
+
+def test_cleanup(batch):
+    batch.cleanup()
+    assert not os.path.exists(batch.input_path)
+    assert not os.path.exists(batch.results_path)
+
+def test_message_batch():
+    msg_objs = [MsgObj(), MsgObj()]
+    MessageBatch(msg_objs).ack()
+    assert all(m.acked for m in msg_objs)
+    MessageBatch(msg_objs).nack(requeue=True)
+    assert all(m.nacked for m in msg_objs)
@@ -0,0 +1,68 @@
+# Unit tests for the cgroup accounting backend (container_stats.py). These tests build sample cgroup v1 and v2 file
+# trees in a temporary directory and do not need a docker daemon; see conftest.py.
+
+import os
+import shutil
+
+import pytest
+
+from container_stats import CgroupStats
+
+CID = 'c0ffee'
+
+
+def write(root, path, content):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+@pytest.fixture()
+def v2(tmp_path):
+    root = str(tmp_path)
+    write(root, 'cgroup.controllers', 'cpuset cpu io memory pids\n')
+    d = f'system.slice/docker-{CID}.scope'
+    write(root, f'{d}/cpu.stat', 'usage_usec 2500\nuser_usec 2000\nsystem_usec 500\n')
+    write(root, f'{d}/io.stat', '8:0 rbytes=4096 wbytes=1024 rios=2 wios=1 dbytes=0 dios=0\n'
+                                '8:16 rbytes=512 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n')
+    write(root, f'{d}/memory.peak', '1048576\n')
+    write(root, f'{d}/memory.current', '524288\n')
+    return root
+
+@pytest.fixture()
+def v1(tmp_path):
+    root = str(tmp_path)
+    write(root, f'cpu,cpuacct/docker/{CID}/cpuacct.usage', '3000000\n')
+    write(root, f'blkio/docker/{CID}/blkio.throttle.io_service_bytes',
+          '8:0 Read 8192\n8:0 Write 2048\n8:0 Sync 0\n8:0 Async 10240\n8:0 Total 10240\nTotal 10240\n')
+    write(root, f'memory/docker/{CID}/memory.max_usage_in_bytes', '2097152\n')
+    return root
+
+
+def test_v2_read(v2):
+    stats = CgroupStats(v2)
+    assert stats.version() == 2
+    assert stats.read(CID) == {'cpu': 2500000, 'io': 5632, 'memory_peak': 1048576}
+
+def test_v2_falls_back_to_memory_current(v2):
+    os.remove(os.path.join(v2, f'system.slice/docker-{CID}.scope/memory.peak'))
+    assert CgroupStats(v2).read(CID)['memory_peak'] == 524288
+
+def test_v1_read(v1):
+    stats = CgroupStats(v1)
+    assert stats.version() == 1
+    assert stats.read(CID) == {'cpu': 3000000, 'io': 10240, 'memory_peak': 2097152}
+
+def test_unknown_container(v1):
+    assert CgroupStats(v1).read('nope') is None
+
+def test_sampler_keeps_last_values_after_exit(v2):
+    sampler = CgroupStats(v2).start(CID)
+    write(v2, f'system.slice/docker-{CID}.scope/cpu.stat', 'usage_usec 4000\n')
+    sampler.sample()
+    # the cgroup directory is removed when the container exits.
+    shutil.rmtree(os.path.join(v2, 'system.slice'))
+    assert sampler.finish() == {'cpu': 4000000, 'io': 5632, 'memory_peak': 1048576}
+
+def test_sampler_without_cgroup(v1):
+    assert CgroupStats(v1).start('nope').finish() == {'cpu': 0, 'io': 0, 'memory_peak': None}
@@ -0,0 +1,71 @@
+# Unit tests for the docker events based container supervision (docker_events.py). These tests use a FakeEventSource
+# and do not need a docker daemon; see conftest.py.
+
+import time
+
+import pytest
+
+from docker_events import ContainerEvents, FakeEventSource
+
+
+@pytest.fixture()
+def source():
+    return FakeEventSource()
+
+@pytest.fixture()
+def events(source):
+    ev = ContainerEvents(source, reconnect_interval=0.01).start()
+    yield ev
+    ev.stop()
+    source.disconnect()
+
+def wait_for(condition, timeout=2):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_die_signals_watch(source, events):
+    w = events.watch('abc')
+    assert not w.exited.is_set()
+    source.die('abc', exit_code=3)
+    assert w.wait(timeout=2)
+    assert w.exit_code == 3
+    assert not w.oom_killed
+
+def test_events_for_other_containers_are_ignored(source, events):
+    w = events.watch('abc')
+    source.die('def')
+    assert not w.wait(timeout=0.2)
+
+def test_oom_then_die(source, events):
+    w = events.watch('abc')
+    source.oom('abc')
+    source.die('abc', exit_code=137)
+    assert w.wait(timeout=2)
+    assert w.oom_killed
+    assert w.exit_code == 137
+
+def test_die_before_watch_is_remembered(source, events):
+    source.die('abc', exit_code=0)
+    assert wait_for(lambda: 'abc' in events._recent)
+    w = events.watch('abc')
+    assert w.exited.is_set()
+    assert w.exit_code == 0
+
+def test_unwatch(source, events):
+    w = events.watch('abc')
+    events.unwatch('abc')
+    source.die('abc')
+    assert not w.wait(timeout=0.2)
+
+def test_reconnects_after_stream_ends(source, events):
+    assert wait_for(lambda: events.connected)
+    source.disconnect()
+    assert wait_for(lambda: source.connections >= 2)
+    w = events.watch('abc')
+    source.die('abc')
+    assert w.wait(timeout=2)
@@ -0,0 +1,87 @@
+# Unit tests for the supervision of (non-hot) actor containers by execute_actor() (docker_utils.py); see conftest.py.
+
+import threading
+from unittest import mock
+
+import pytest
+
+import docker_utils
+import globals
+
+
+@pytest.fixture()
+def calls():
+    # records the calls made to the docker client and the stats sampler, in order.
+    return mock.Mock()
+
+@pytest.fixture()
+def cli(calls):
+    cli = mock.MagicMock()
+    cli.create_container.return_value = {'Id': 'cid'}
+    cli.inspect_container.return_value = {'State': {'ExitCode': 0,
+                                                    'StartedAt': '2021-01-01T00:00:00.000000Z',
+                                                    'FinishedAt': '2021-01-01T00:00:01.000000Z'}}
+    calls.attach_mock(cli, 'cli')
+    return cli
+
+@pytest.fixture()
+def sampler(calls):
+    sampler = mock.MagicMock()
+    sampler.finish.return_value = {'cpu': 100, 'io': 10, 'memory_peak': 1024}
+    calls.attach_mock(sampler, 'sampler')
+    return sampler
+
+@pytest.fixture()
+def watch():
+    # the docker_events.ContainerWatch of a container that already exited.
+    exited = threading.Event()
+    exited.set()
+    return mock.Mock(exited=exited, exit_code=0, oom_killed=False)
+
+@pytest.fixture()
+def execute(tmpdir, cli, sampler, watch):
+    events = mock.MagicMock()
+    events.watch.return_value = watch
+    results_ch = mock.MagicMock()
+    results_ch._queue._queue = []
+    with mock.patch.multiple(docker_utils,
+                             get_actor_configs=mock.MagicMock(return_value=[]),
+                             get_container_events=mock.MagicMock(return_value=events),
+                             get_stats_backend=mock.MagicMock(),
+                             ExecutionResultsChannel=mock.MagicMock(return_value=results_ch),
+                             LogFollower=mock.MagicMock(),
+                             Actor=mock.MagicMock(),
+                             Execution=mock.MagicMock()), \
+            mock.patch.object(docker_utils.docker, 'APIClient', return_value=cli):
+        docker_utils.get_stats_backend.return_value.start.return_value = sampler
+        yield lambda **kwargs: docker_utils.execute_actor('actor', 'worker', 'ex', 'abacosamples/test', 'msg',
+                                                          d={}, socket_host_path=str(tmpdir.join('results.sock')),
+                                                          tenant='tenant', **kwargs)
+
+
+def test_execute_actor(execute, cli):
+    result, container_state, exit_code, start_time = execute(mounts=[{'host_path': '/data',
+                                                                      'container_path': '/data',
+                                                                      'format': 'ro'}])
+    assert exit_code == 0
+    assert result['cpu'] == 100
+    assert result['io'] == 10
+    assert cli.create_container.call_args[1]['volumes'] == ['/data']
+    assert cli.create_host_config.call_args[1]['binds'] == {'/data': {'bind': '/data', 'ro': True}}
+    cli.remove_container.assert_called_once()
+
+def test_final_usage_read_before_container_is_removed(execute, calls):
+    result, _, _, _ = execute()
+    assert result['memory_peak'] == 1024
+    names = [name for name, _, _ in calls.mock_calls]
+    assert names.index('sampler.finish') < names.index('cli.remove_container')
+
+def test_force_quit_execution(execute, cli, watch):
+    # the container keeps running until it is stopped by the force quit of its own execution.
+    watch.exited.clear()
+    cli.containers.return_value = [{'State': 'running'}]
+    globals.force_quit_executions.update({'ex', 'other'})
+    execute()
+    cli.stop.assert_called_once_with('cid')
+    assert globals.force_quit_executions == {'other'}
+    globals.force_quit_executions.clear()
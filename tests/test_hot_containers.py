@@ -0,0 +1,54 @@
+# Unit tests for the worker side of the hot container protocol (hot_containers.py). These tests exchange frames over a
+# local socket pair and do not start any containers; see conftest.py.
+
+import socket
+
+import pytest
+
+from hot_containers import FRAME_HEADER, FrameReader, HotContainer, format_environment, send_frame
+
+
+@pytest.fixture()
+def sockets():
+    worker, container = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    worker.settimeout(0.1)
+    yield worker, container
+    worker.close()
+    container.close()
+
+
+def test_frames_roundtrip(sockets):
+    worker, container = sockets
+    reader = FrameReader(worker)
+    assert reader.next() is None
+    send_frame(container, {'type': 'log', 'data': 'hello'})
+    send_frame(container, {'type': 'complete', 'exit_code': 0})
+    assert reader.next() == {'type': 'log', 'data': 'hello'}
+    assert reader.next() == {'type': 'complete', 'exit_code': 0}
+
+def test_partial_frames(sockets):
+    worker, container = sockets
+    reader = FrameReader(worker)
+    data = b'{"type": "complete", "exit_code": 3}'
+    frame = FRAME_HEADER.pack(len(data)) + data
+    container.sendall(frame[:10])
+    assert reader.next() is None
+    container.sendall(frame[10:])
+    assert reader.next() == {'type': 'complete', 'exit_code': 3}
+
+def test_closed_socket(sockets):
+    worker, container = sockets
+    reader = FrameReader(worker)
+    container.close()
+    with pytest.raises(EOFError):
+        reader.next()
+
+def test_execute_frame_overlay():
+    hot = HotContainer.__new__(HotContainer)
+    hot.environment = format_environment({'_abaco_actor_id': 'abc', 'MSG': 'first', 'x': 1, 'y': 'only first'})
+    environment = format_environment({'_abaco_actor_id': 'abc', 'MSG': 'second', 'x': 2, 'z': None})
+    frame = hot._execute_frame('ex1', 'second', environment)
+    assert frame['environment'] == {'MSG': 'second', 'x': '2'}
+    assert frame['unset'] == ['y']
+    assert frame['message'] == 'second'
+    assert hot._execute_frame('ex2', b'\x00\x01', environment)['message_b64'] == 'AAE='
@@ -0,0 +1,72 @@
+# Tests for listing the actors a user can read (Actor.list_actors(), models.py) against the permission checks made for
+# each actor (auth.check_permissions()). The tests write their own actor and permission documents to the stores, under
+# a tenant of their own, so first start the development stack using:
+#  1. export abaco_path=$(pwd)
+#  2. docker-compose -f docker-compose-local-db.yml up -d (from within the root directory)
+# Then, also from the root directory, execute:
+#     docker run -v $(pwd)/local-dev.conf:/etc/service.conf --entrypoint=py.test -it --rm abaco/testsuite:dev /tests/test_list_actors.py
+
+import os
+import sys
+sys.path.append(os.path.split(os.getcwd())[0])
+sys.path.append('/actors')
+
+import pytest
+
+from auth import check_permissions
+from auth_cache import permissions_cache
+from codes import READ
+from models import Actor
+from stores import actors_store, permissions_store
+
+TENANT = 'list_actors_test_tenant'
+
+# actor id -> the permissions document of the actor, in order; the first entry for the user or the world user decides.
+PERMISSIONS = {
+    'user_update': {'tuser': 'UPDATE'},
+    'user_read': {'tuser': 'READ'},
+    'user_none': {'tuser': 'NONE'},
+    'user_none_before_world': {'tuser': 'NONE', 'ABACO_WORLD': 'READ'},
+    'world_before_user_none': {'ABACO_WORLD': 'READ', 'tuser': 'NONE'},
+    'world': {'ABACO_WORLD': 'READ'},
+    'other_user': {'other': 'UPDATE'},
+    'dotted_user': {'t.user': 'READ'},
+    'no_permissions': {},
+}
+
+USERS = ['tuser', 'other', 't.user', 't', '$where', 'nobody']
+
+
+@pytest.fixture(scope='module')
+def actors():
+    dbids = []
+    for actor_id, permissions in PERMISSIONS.items():
+        dbid = Actor.get_dbid(TENANT, actor_id)
+        actors_store[dbid] = {'id': actor_id, 'db_id': dbid, 'tenant': TENANT}
+        doc = {'_id': dbid}
+        doc.update(permissions)
+        permissions_store._db.replace_one({'_id': dbid}, doc, upsert=True)
+        dbids.append(dbid)
+    permissions_cache.clear()
+    yield dbids
+    for dbid in dbids:
+        del actors_store[dbid]
+        del permissions_store[dbid]
+
+
+@pytest.mark.parametrize('user', USERS)
+def test_list_actors_matches_check_permissions(actors, user):
+    listed = [actor['db_id'] for actor in Actor.list_actors(TENANT, user)]
+    assert listed == [dbid for dbid in sorted(actors) if check_permissions(user, dbid, READ)]
+
+def test_list_actors_user_and_world_permissions(actors):
+    listed = {actor['id'] for actor in Actor.list_actors(TENANT, 'tuser')}
+    assert listed == {'user_update', 'user_read', 'world_before_user_none', 'world'}
+    listed = {actor['id'] for actor in Actor.list_actors(TENANT, 't.user')}
+    assert listed == {'dotted_user', 'user_none_before_world', 'world_before_user_none', 'world'}
+
+def test_list_actors_pages(actors):
+    first = [actor['id'] for actor in Actor.list_actors(TENANT, 'tuser', limit=2)]
+    assert first == ['user_read', 'user_update']
+    rest = [actor['id'] for actor in Actor.list_actors(TENANT, 'tuser', after=first[-1])]
+    assert rest == ['world', 'world_before_user_none']
@@ -0,0 +1,139 @@
+# Load test comparing the throughput of concurrent synchronous executions on the asyncio message API server
+# (message_aio.py) with the Flask implementation under sync workers, where each request holds a worker until its
+# execution finishes. RabbitMQ, MongoDB and the actor workers are replaced with local stand-ins, so the test does not
+# need the development stack; see conftest.py.
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+
+from message_aio import COMPLETIONS_KEY, PENDING_KEY, AsyncMessageServer, Completions
+
+# number of concurrent synchronous executions
+CONCURRENCY = 100
+# how long each execution runs, in seconds
+EXECUTION_TIME = 0.1
+# number of sync workers (gunicorn -w) for the Flask implementation, and of threads for the async server
+WORKERS = 4
+
+
+class StandInWorker(object):
+    """Stands in for the actor workers: finishes each execution EXECUTION_TIME seconds after it is queued."""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, execution_id, on_complete):
+        def finish():
+            self.results[execution_id] = 'result of {}'.format(execution_id).encode('utf-8')
+            on_complete()
+        threading.Timer(EXECUTION_TIME, finish).start()
+
+    def result_response(self, dbid, execution_id):
+        return '200 OK', [('Content-Type', 'application/octet-stream')], self.results[execution_id]
+
+
+def flask_view(worker):
+    """
+    Stand-in for MessagesResource.post under a sync worker: queues the execution and blocks until it completes.
+    """
+    def app(environ, start_response):
+        execution_id = urllib.parse.parse_qs(environ['QUERY_STRING'])['execution_id'][0]
+        done = threading.Event()
+        worker.run(execution_id, done.set)
+        done.wait()
+        status, headers, body = worker.result_response('dbid', execution_id)
+        start_response(status, headers)
+        return [body]
+    return app
+
+
+def async_view(worker):
+    """
+    Stand-in for the AsyncMessagesResource.post: subscribes to the completion, queues the execution and parks it.
+    """
+    def app(environ, start_response):
+        execution_id = urllib.parse.parse_qs(environ['QUERY_STRING'])['execution_id'][0]
+        server = environ[COMPLETIONS_KEY]
+        subscription = server.subscribe_threadsafe('dbid', execution_id)
+
+        def on_complete():
+            server.loop.call_soon_threadsafe(server.completions.resolve, subscription.key, {'event': 'COMPLETE'})
+        worker.run(execution_id, on_complete)
+        environ[PENDING_KEY] = ('dbid', execution_id, subscription)
+        start_response('202 ACCEPTED', [])
+        return [b'']
+    return app
+
+
+def scope(execution_id):
+    return {'type': 'http', 'method': 'POST', 'path': '/actors/abc/messages', 'root_path': '',
+            'query_string': '_abaco_synchronous=true&execution_id={}'.format(execution_id).encode('latin-1'),
+            'headers': [], 'server': ('localhost', 5000), 'scheme': 'http', 'http_version': '1.1'}
+
+async def call(server, execution_id):
+    response = {}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(event):
+        if event['type'] == 'http.response.start':
+            response['status'] = event['status']
+        else:
+            response['body'] = event['body']
+    await server(scope(execution_id), receive, send)
+    return response
+
+def run_flask(app):
+    """Run CONCURRENCY requests against the WSGI `app` on WORKERS sync workers; returns the bodies and the time."""
+    def request(execution_id):
+        environ = {'QUERY_STRING': 'execution_id={}'.format(execution_id)}
+        return b''.join(app(environ, lambda status, headers: None))
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        bodies = list(pool.map(request, [str(i) for i in range(CONCURRENCY)]))
+    return bodies, time.time() - start
+
+def run_async(server):
+    async def run():
+        await server.startup()
+        start = time.time()
+        responses = await asyncio.gather(*[call(server, str(i)) for i in range(CONCURRENCY)])
+        elapsed = time.time() - start
+        await server.shutdown()
+        return responses, elapsed
+    return asyncio.new_event_loop().run_until_complete(run())
+
+
+def test_async_server_returns_results():
+    worker = StandInWorker()
+    server = AsyncMessageServer(async_view(worker), Completions(), worker.result_response, threads=WORKERS)
+    responses, _ = run_async(server)
+    for i, response in enumerate(responses):
+        assert response['status'] == 200
+        assert response['body'] == 'result of {}'.format(i).encode('utf-8')
+
+def test_async_server_unsubscribes():
+    worker = StandInWorker()
+    completions = Completions()
+    server = AsyncMessageServer(async_view(worker), completions, worker.result_response, threads=WORKERS)
+    run_async(server)
+    assert completions.pending() == []
+
+def test_sync_throughput():
+    worker = StandInWorker()
+    bodies, flask_time = run_flask(flask_view(worker))
+    assert bodies == ['result of {}'.format(i).encode('utf-8') for i in range(CONCURRENCY)]
+    worker = StandInWorker()
+    server = AsyncMessageServer(async_view(worker), Completions(), worker.result_response, threads=WORKERS)
+    _, async_time = run_async(server)
+    flask_throughput = CONCURRENCY / flask_time
+    async_throughput = CONCURRENCY / async_time
+    print("sync executions per second; flask: {:.1f}, async: {:.1f}".format(flask_throughput, async_throughput))
+    # the Flask implementation completes at most WORKERS executions per EXECUTION_TIME, while the async server
+    # awaits all of them at once.
+    assert flask_throughput <= WORKERS / EXECUTION_TIME * 1.1
+    assert async_throughput > 5 * flask_throughput
@@ -18,6 +18,7 @@ import sys
 import threading
 import time
 import timeit
+from unittest import mock
 sys.path.append(os.path.split(os.getcwd())[0])
 sys.path.append('/actors')
 
@@ -118,6 +119,39 @@ def test_getset(st):
     assert st['test'] == {'k': 'v', 'k2': f'w{n-1}'}
     assert st['k']['k'] == f'v{n-1}'
 
+def test_update_fields(st):
+    st['test'] = {'k': {'sub': 'v'}, 'k2': 'v2'}
+    st.update_fields('test', {'k.sub': 'v1', ('k', 'sub2'): 'v2', 'k2': b'w2', 'k3': 'v3'})
+    assert st['test'] == {'k': {'sub': 'v1', 'sub2': 'v2'}, 'k2': 'w2', 'k3': 'v3'}
+    with pytest.raises(KeyError):
+        st.update_fields('test_does_not_exist', {'k': 'v'})
+    st.update_fields('test_upsert', {'k': 'v'}, upsert=True)
+    assert st['test_upsert', 'k'] == 'v'
+    del st['test_upsert']
+
+def test_bulk_update(st):
+    st['test'] = {'n': 1}
+    st.bulk_update([({'_id': 'test'}, {'$inc': {'n': 1}}),
+                    ({'_id': 'test_upsert'}, {'$inc': {'n': 2}, '$setOnInsert': {'k': 'v'}})], upsert=True)
+    assert st['test', 'n'] == 2
+    assert st['test_upsert'] == {'n': 2, 'k': 'v'}
+    del st['test_upsert']
+
+def test_nested_get_projection(st):
+    # reading one nested field of a large document only fetches that field from mongo, instead of the full document.
+    big = {f'field{i}': 'x' * 1000 for i in range(1000)}
+    big['status'] = {'state': 'READY'}
+    st['test_big'] = big
+    try:
+        with mock.patch.object(st._db, 'find_one', wraps=st._db.find_one) as find_one:
+            assert st['test_big', 'status', 'state'] == 'READY'
+        assert find_one.call_args[1]['projection'] == {'_id': False, 'status.state': True}
+        assert st['test_big', 'field0'] == 'x' * 1000
+        with pytest.raises(KeyError):
+            st['test_big', 'status', 'missing']
+    finally:
+        del st['test_big']
+
 def test_within_transaction(st):
         # mongo store does not support within_transaction
     if not store == 'redis':
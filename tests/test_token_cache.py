@@ -0,0 +1,75 @@
+# Unit tests for the access token cache of workers (token_cache.py); see conftest.py.
+
+import time
+from unittest import mock
+
+import pytest
+
+from token_cache import TokenCache
+
+
+def agave(expires_in=3600, failures=0):
+    """
+    Mock of the OAuth client. The first `failures` refreshes of its token raise; the others return a new token, valid
+    for `expires_in` seconds.
+    """
+    ag = mock.Mock()
+    ag.token.token_info = {}
+
+    def refresh():
+        n = ag.token.refresh.call_count - failures
+        if n <= 0:
+            raise Exception("token service unavailable")
+        created_at = int(time.time())
+        ag.token.token_info = {'access_token': 'token{}'.format(n),
+                               'created_at': created_at,
+                               'expiration': created_at + expires_in}
+        return ag.token.token_info['access_token']
+    ag.token.refresh.side_effect = refresh
+    return ag
+
+
+def test_token_is_cached():
+    ag = agave()
+    cache = TokenCache(ag, retry_interval=0)
+    assert cache.get_token() == 'token1'
+    assert cache.get_token() == 'token1'
+    assert ag.token.refresh.call_count == 1
+
+def test_get_token_retries():
+    ag = agave(failures=2)
+    cache = TokenCache(ag, retry_interval=0, max_attempts=3)
+    assert cache.get_token() == 'token1'
+
+def test_get_token_gives_up():
+    ag = agave(failures=5)
+    cache = TokenCache(ag, retry_interval=0, max_attempts=3)
+    with pytest.raises(Exception):
+        cache.get_token()
+
+def test_expiring_token_is_refreshed():
+    # a token that expires within MIN_VALIDITY seconds is not handed out.
+    ag = agave(expires_in=10)
+    cache = TokenCache(ag, retry_interval=0)
+    assert cache.get_token() == 'token1'
+    assert cache.get_token() == 'token2'
+
+def test_background_refresh():
+    ag = agave(expires_in=3600)
+    cache = TokenCache(ag, refresh_margin=300, retry_interval=0)
+    cache.start()
+    try:
+        deadline = time.time() + 5
+        while not cache.valid() and time.time() < deadline:
+            time.sleep(0.01)
+        assert cache.get_token() == 'token1'
+        assert ag.token.refresh.call_count == 1
+        assert cache._refresh_at() == cache._created_at + 3300
+    finally:
+        cache.stop()
+
+def test_refresh_margin_longer_than_lifetime():
+    ag = agave(expires_in=600)
+    cache = TokenCache(ag, refresh_margin=900, retry_interval=0)
+    cache.get_token()
+    assert cache._refresh_at() == cache._created_at + 300